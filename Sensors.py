@@ -9,7 +9,7 @@ import logging.handlers
 from lib.gas_sensor import GasSensor
 from lib.light_sensor import LightSensor, LightSensorResult
 import lib.temp_probe as temp_probe
-from lib.recurring_task import RecurringTask
+from lib.recurring_task import RecurringTask, COALESCE
 
 DEFAULT_SENSOR_LOG = 'sensors.log'
 DEFAULT_LIGHT_SENSOR_UPDATE_INTERVAL = 30
@@ -34,6 +34,7 @@ class Sensors(object):
 
         self.__gas_sensor__ = None
         self.__light_sensor__ = None
+        self.__update_tasks__ = []
 
         self.current_gas_sensor_reading = None
         self.current_light_sensor_reading = None
@@ -42,21 +43,41 @@ class Sensors(object):
         self.__light_sensor__ = LightSensor()
 
         if self.__light_sensor__.enabled:
-            RecurringTask("__update_light_sensor__", DEFAULT_LIGHT_SENSOR_UPDATE_INTERVAL,
-                          self.__update_light_sensor__, self.__logger__)
+            self.__update_tasks__.append(
+                RecurringTask("__update_light_sensor__", DEFAULT_LIGHT_SENSOR_UPDATE_INTERVAL,
+                              self.__update_light_sensor__, self.__logger__,
+                              missed_run_policy=COALESCE))
 
         if configuration.is_mq2_enabled:
             self.__gas_sensor__ = GasSensor()
 
             if self.__gas_sensor__ is not None and \
                     self.__gas_sensor__.enabled:
-                RecurringTask("__update_gas_sensor__", DEFAULT_GAS_SENSOR_UPDATE_INTERVAL,
-                              self.__update_gas_sensor__, self.__logger__)
+                self.__update_tasks__.append(
+                    RecurringTask("__update_gas_sensor__", DEFAULT_GAS_SENSOR_UPDATE_INTERVAL,
+                                  self.__update_gas_sensor__, self.__logger__,
+                                  missed_run_policy=COALESCE))
 
         if configuration.is_temp_probe_enabled:
-            RecurringTask("__update_temperature_sensor__",
-                          DEFAULT_TEMPERATURE_SENSOR_UPDATE_INTEVAL,
-                          self.__update_temperature_sensor__, self.__logger__)
+            self.__update_tasks__.append(
+                RecurringTask("__update_temperature_sensor__",
+                              DEFAULT_TEMPERATURE_SENSOR_UPDATE_INTEVAL,
+                              self.__update_temperature_sensor__, self.__logger__,
+                              missed_run_policy=COALESCE))
+
+    def close(self):
+        """
+        Stops reading the sensors and releases their buses.
+        """
+
+        for update_task in self.__update_tasks__:
+            update_task.cancel()
+
+        if self.__gas_sensor__ is not None:
+            self.__gas_sensor__.close()
+
+        if self.__light_sensor__.enabled:
+            self.__light_sensor__.close()
 
     def __update_light_sensor__(self):
         """
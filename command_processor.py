@@ -8,15 +8,25 @@ Contains the response generated by a command request.
 import sys
 import time
 import datetime
-import Queue
 import math
-from multiprocessing import Queue as MPQueue
 import serial  # Requires "pyserial"
 import text
 from fona_manager import FonaManager
 from Sensors import Sensors
 from relay_controller import RelayManager
-from lib.recurring_task import RecurringTask
+from lib.recurring_task import RecurringTask, get_all_task_metrics, SKIP, COALESCE
+from lib.scheduler import get_live_thread_count, get_default_scheduler
+from lib.wakeup import WakeupEvent, DEFAULT_MAXIMUM_IDLE_SECONDS
+from lib.event_bus import EventBus
+from lib.events import GasReadingEvent, MessagesReadEvent
+from lib.priority_lanes import PriorityLanes, CRITICAL, NORMAL, BULK
+from lib.modem_scheduler import SAFETY, REPLY, BROADCAST
+from lib.task_metrics import Histogram
+from lib.watchdog import get_default_watchdog
+from lib.lifecycle import LifecycleManager
+from lib.staged_startup import StagedStartup
+from lib.baud_rate import BaudRateNegotiator, load_baud_rate
+from lib.status_renderer import StatusRenderer, get_terse_time_text, describe_segments
 import lib.utilities as utilities
 import lib.local_debug as local_debug
 from lib.logger import Logger
@@ -38,6 +48,10 @@ VALID_COMMANDS = {text.FULL_STATUS_COMMAND,
                   text.RESTART_COMMAND,
                   text.QUIT_COMMAND}
 
+# How many seconds to wait for the Fona to read the
+# battery and signal before sending the startup status.
+MAXIMUM_STARTUP_STATUS_ATTEMPTS = 30
+
 
 class CommandResponse(object):
     """
@@ -91,22 +105,47 @@ class CommandProcessor(object):
         # and writes into the MPqueue...
         # It kicks off every 30 seconds
 
+        # A gas check that was missed runs as soon as it can.
+        # The polls and the LCD only care about the latest state,
+        # so missed runs are dropped.
         RecurringTask("monitor_gas_sensor", 30,
-                      self.__monitor_gas_sensor__, self.__logger__)
+                      self.__monitor_gas_sensor__, self.__logger__,
+                      missed_run_policy=COALESCE)
 
         RecurringTask("battery_check", 60 * 5,
-                      self.__monitor_fona_health__, self.__logger__)
+                      self.__monitor_fona_health__, self.__logger__,
+                      missed_run_policy=SKIP)
+
+        RecurringTask("update_lcd", 5, self.__queue_lcd_update__, self.__logger__,
+                      missed_run_policy=SKIP)
+
+        # The main service loop.
+        # Everything that produces work for the loop
+        # signals the wakeup event, so the loop sleeps
+        # until there is something to do, or until the
+        # next deadline (such as the heater shutoff timer).
+        # The work itself is done in priority order by the lanes.
+        try:
+            while not self.__lifecycle__.is_shutdown_requested():
+                watchdog_token = get_default_watchdog().begin("service_loop")
+                self.__work_lanes__.run()
+                get_default_watchdog().end(watchdog_token)
 
-        RecurringTask("update_lcd", 5, self.__update_lcd__, self.__logger__)
+                self.__wakeup_event__.wait(
+                    self.__get_seconds_until_next_deadline__())
+        except KeyboardInterrupt:
+            self.request_shutdown("CTRL+C")
+        finally:
+            self.__lifecycle__.shutdown()
 
-        # The main service loop
-        while True:
-            self.__run_servicer__(self.__service_gas_sensor_queue__,
-                                  "Gas sensor queue")
-            self.__relay_controller__.update()
-            self.__run_servicer__(self.__process_pending_text_messages__,
-                                  "Incoming request queue")
-            self.__fona_manager__.update()
+    def request_shutdown(self, reason):
+        """
+        Asks the service loop to stop, and to
+        shut everything down cleanly.
+        Safe to call from a signal handler.
+        """
+
+        self.__lifecycle__.request_shutdown(reason)
 
     def is_gas_detected(self):
         """
@@ -136,38 +175,53 @@ class CommandProcessor(object):
         self.__logger__.log_info_message(phone_number + " is denied")
         return False
 
-    def __init__(self, buddy_configuration, logger):
+    def __init__(self, buddy_configuration, logger, worker_pool=None):
         """
         Initialize the object.
+        If a worker pool is given, it is stopped
+        when the HangarBuddy shuts down.
         """
 
         self.__configuration__ = buddy_configuration
         self.__logger__ = logger
+        self.__worker_pool__ = worker_pool
+        get_default_watchdog().start(buddy_configuration.stall_threshold, logger)
+        self.__wakeup_event__ = WakeupEvent()
+        self.__lifecycle__ = LifecycleManager(logger, self.__wakeup_event__)
+        self.__event_bus__ = EventBus(self.__wakeup_event__)
+        self.__gas_sensor_queue__ = self.__event_bus__.subscribe(GasReadingEvent)
+        self.__messages_read_queue__ = self.__event_bus__.subscribe(MessagesReadEvent)
+        self.__work_lanes__ = PriorityLanes(self.__run_servicer__,
+                                            self.__wakeup_event__)
+        self.__gas_warning_time__ = None
+        self.__gas_to_relay_off_latency__ = Histogram()
         self.__lcd__ = None
         self.__lcd_status_id__ = 0
-        self.__initialize_lcd__()
         self.__is_gas_detected__ = False
         self.__system_start_time__ = datetime.datetime.now()
-        self.__sensors__ = Sensors(buddy_configuration)
-
-        serial_connection = self.__initialize_modem__()
-        if serial_connection is None and not local_debug.is_debug():
+        self.__sensors__ = None
+        self.__fona_manager__ = None
+        self.__relay_controller__ = None
+        self.__startup_status_attempts__ = 0
+        self.__is_startup_status_sent__ = False
+        self.__startup_status_task__ = None
+
+        # The subsystems do not depend on each other,
+        # so bring them up at the same time.
+        startup = StagedStartup(logger)
+        startup.add_stage("LCD", self.__initialize_lcd__)
+        startup.add_stage("Sensors", self.__initialize_sensors__)
+        startup.add_stage("Modem", self.__initialize_fona_manager__)
+        startup.add_stage("Relay", self.__initialize_relay_controller__)
+
+        if not startup.run():
             self.__logger__.log_warning_message(
-                "Unable to initialize serial connection, quiting.")
+                "Unable to start " + ", ".join(startup.get_failed_stages())
+                + ", quiting.")
             sys.exit()
 
-        self.__fona_manager__ = FonaManager(self.__logger__,
-                                            serial_connection,
-                                            self.__configuration__.cell_power_status_pin,
-                                            self.__configuration__.cell_ring_indicator_pin,
-                                            self.__configuration__.utc_offset)
-
-        # create heater relay instance
-        self.__relay_controller__ = RelayManager(buddy_configuration, logger,
-                                                 self.__heater_turned_on_callback__,
-                                                 self.__heater_turned_off_callback__,
-                                                 self.__heater_max_time_off_callback__)
-        self.__gas_sensor_queue__ = MPQueue()
+        self.__initialize_work_lanes__()
+        self.__initialize_lifecycle__()
 
         self.__logger__.log_info_message(
             "Starting SMS monitoring and heater service")
@@ -176,10 +230,19 @@ class CommandProcessor(object):
         self.__logger__.log_info_message("Begin monitoring for SMS messages")
         self.__queue_message_to_all_numbers__("HangarBuddy monitoring started."
                                               + "\n" + self.__get_help_status__())
-        self.__queue_message_to_all_numbers__(self.__get_full_status__())
         self.__lcd__.clear()
         self.__lcd__.write(0, 0, "Ready")
 
+        self.__logger__.log_info_message(
+            "Ready to accept commands. " + startup.describe())
+
+        # The full status needs the battery and signal,
+        # which are read after startup.
+        self.__startup_status_task__ = RecurringTask("send_startup_status", 1,
+                                                     self.__send_startup_status__,
+                                                     self.__logger__,
+                                                     missed_run_policy=SKIP)
+
     def __clear_existing_messages__(self):
         """
         Clear all of the existing messages off tdhe SIM card.
@@ -194,7 +257,8 @@ class CommandProcessor(object):
             for phone_number in self.__configuration__.allowed_phone_numbers:
                 self.__queue_message__(phone_number,
                                        "Old or unprocessed message(s) found on SIM Card."
-                                       + " Deleting...")
+                                       + " Deleting...",
+                                       BROADCAST)
             self.__logger__.log_info_message(
                 str(num_deleted) + " old message cleared from SIM Card")
 
@@ -226,6 +290,9 @@ class CommandProcessor(object):
         Returns the status of the Fona.
         ... both the signal and battery ...
         """
+        if not self.__fona_manager__.has_status():
+            return "CSQ: Checking...\nBAT: Checking..."
+
         signal_strength = self.__fona_manager__.signal_strength()
         battery = self.__fona_manager__.battery_condition()
 
@@ -238,7 +305,7 @@ class CommandProcessor(object):
             status += " LOW BATTERY."
 
         status += "\nBAT:" + str(battery.battery_percent) + "% V:" + \
-            str(battery.get_voltage() / 100)
+            battery.get_volts_text()
 
         return status
 
@@ -287,42 +354,118 @@ class CommandProcessor(object):
             status = str(int(self.__sensors__.current_light_sensor_reading.lux)) + \
                 " LUX of light.\n"
             status += "Hangar is "
-            brightness = "Bright. Lights on?"
+            brightness = self.__get_brightness__()
 
-            # Determine the brightness
-            if self.__sensors__.current_light_sensor_reading.lux <= \
-                    self.__configuration__.hangar_dark:
-                brightness = "dark."
-            elif self.__sensors__.current_light_sensor_reading.lux <= \
-                    self.__configuration__.hangar_dim:
-                brightness = "dim."
-            elif self.__sensors__.current_light_sensor_reading.lux <= \
-                    self.__configuration__.hangar_lit:
-                brightness = "lit."
-
-            status += brightness
+            if brightness == "bright":
+                status += "Bright. Lights on?"
+            else:
+                status += brightness + "."
 
             return status
 
         return "Light sensor not enabled."
 
+    def __get_brightness__(self):
+        """
+        Returns "dark", "dim", "lit", or "bright".
+        """
+
+        lux = self.__sensors__.current_light_sensor_reading.lux
+
+        if lux <= self.__configuration__.hangar_dark:
+            return "dark"
+        elif lux <= self.__configuration__.hangar_dim:
+            return "dim"
+        elif lux <= self.__configuration__.hangar_lit:
+            return "lit"
+
+        return "bright"
+
+    def __get_terse_status__(self):
+        """
+        Returns the fields of the full status in
+        their terse form, in the same order.
+        """
+
+        if self.__relay_controller__ is None:
+            heater = "HTR:N/A"
+        elif self.__relay_controller__.is_relay_on():
+            seconds_until_shutoff = self.__relay_controller__.get_seconds_until_shutoff()
+            heater = "HTR:ON"
+
+            if seconds_until_shutoff is not None:
+                heater += " " + get_terse_time_text(seconds_until_shutoff)
+        else:
+            heater = "HTR:OFF"
+
+        gas_reading = self.__sensors__.current_gas_sensor_reading
+
+        if gas_reading is None or not self.__configuration__.is_mq2_enabled:
+            gas = "GAS:N/A"
+        elif gas_reading.is_gas_detected:
+            gas = "GAS:" + str(gas_reading.current_value) + " DETECTED!"
+        else:
+            gas = "GAS:" + str(gas_reading.current_value)
+
+        if self.__sensors__.current_light_sensor_reading is None:
+            light = "LUX:N/A"
+        else:
+            light = "LUX:" + str(int(self.__sensors__.current_light_sensor_reading.lux)) \
+                + " " + self.__get_brightness__()
+
+        if self.__sensors__.current_temperature_sensor_reading is None:
+            temperature = "T:N/A"
+        else:
+            temperature = "T:" + str(self.__sensors__.current_temperature_sensor_reading) + "F"
+
+        if not self.__fona_manager__.has_status():
+            fona_status = "CSQ:?\nBAT:?"
+        else:
+            signal_strength = self.__fona_manager__.signal_strength()
+            battery = self.__fona_manager__.battery_condition()
+            fona_status = "CSQ:" + str(signal_strength.get_signal_strength()) \
+                + " " + signal_strength.classify_strength() \
+                + "\nBAT:" + str(battery.battery_percent) + "% " \
+                + battery.get_volts_text() + "V"
+
+            if not battery.is_battery_ok():
+                fona_status += " LOW"
+
+        uptime = (datetime.datetime.now() - self.__system_start_time__).total_seconds()
+
+        return [heater, gas, light, temperature, fona_status,
+                "UP:" + get_terse_time_text(uptime)]
+
     def __get_full_status__(self):
         """
         Returns the status of the HangarBuddy.
-        This is the full status text.
+        This is the full status text, in the
+        configured profile.
         """
 
+        renderer = StatusRenderer(self.__configuration__.status_profile)
+
         try:
-            status = self.__get_heater_status__() + "\n"
-            status += self.__get_gas_sensor_status__() + "\n"
-            status += self.__get_light_status__() + "\n"
-            status += self.__get_temp_probe_status__() + "\n"
-            status += self.__get_fona_status__() + "\n"
-            status += self.__get_uptime_status__()
+            verbose_status = [self.__get_heater_status__(),
+                              self.__get_gas_sensor_status__(),
+                              self.__get_light_status__(),
+                              self.__get_temp_probe_status__(),
+                              self.__get_fona_status__(),
+                              self.__get_uptime_status__()]
+
+            for verbose_text, terse_text in zip(verbose_status, self.__get_terse_status__()):
+                renderer.add(verbose_text, terse_text)
+
+            unsent_count, dead_letters = self.__fona_manager__.take_dead_letters()
+
+            if dead_letters:
+                renderer.add(str(unsent_count) + " message(s) not sent.\nLast: "
+                             + dead_letters[-1].describe(),
+                             "UNSENT:" + str(unsent_count))
         except:
-            status += "ERROR"
+            renderer.add("ERROR", "ERROR")
 
-        return status
+        return renderer.render().text
 
     def __get_help_status__(self):
         """
@@ -366,27 +509,30 @@ class CommandProcessor(object):
     #-- Message queing
     ##############################
 
-    def __queue_message__(self, phone_number, message):
+    def __queue_message__(self, phone_number, message, priority=REPLY):
         """
         Puts a request to send a message into the queue.
+        The priority is a modem_scheduler priority.
         """
         if self.__fona_manager__ is not None and phone_number is not None and message is not None:
             self.__logger__.log_info_message(
-                "MSG - " + phone_number + " : " + utilities.escape(message))
+                "MSG - " + phone_number + " : " + utilities.escape(message)
+                + " (" + describe_segments(message) + ")")
             if not self.__configuration__.test_mode:
-                self.__fona_manager__.send_message(phone_number, message)
+                self.__fona_manager__.send_message(phone_number, message,
+                                                   priority=priority)
 
             return True
 
         return False
 
-    def __queue_message_to_all_numbers__(self, message):
+    def __queue_message_to_all_numbers__(self, message, priority=BROADCAST):
         """
         Puts a request to send a message to all numbers into the queue.
         """
 
         for phone_number in self.__configuration__.allowed_phone_numbers:
-            self.__queue_message__(phone_number, message)
+            self.__queue_message__(phone_number, message, priority)
 
         return message
 
@@ -553,7 +699,7 @@ class CommandProcessor(object):
 
         if self.__is_gas_detected__:
             cleared_message = "Gas warning cleared. " + gas_sensor_status
-            self.__queue_message_to_all_numbers__(cleared_message)
+            self.__queue_message_to_all_numbers__(cleared_message, SAFETY)
             self.__logger__.log_info_message(
                 "Turning detected flag off.")
             self.__is_gas_detected__ = False
@@ -568,7 +714,7 @@ class CommandProcessor(object):
             if self.__relay_controller__.is_relay_on():
                 gas_status += "SHUTTING HEATER DOWN"
 
-            self.__queue_message_to_all_numbers__(gas_status)
+            self.__queue_message_to_all_numbers__(gas_status, SAFETY)
             self.__logger__.log_warning_message(
                 "Turning detected flag on.")
             self.__is_gas_detected__ = True
@@ -620,7 +766,9 @@ class CommandProcessor(object):
         elif command_response.get_command() == text.QUIT_COMMAND:
             try:
                 self.__lcd__.write_text("Quiting")
-                exit()
+                self.request_shutdown("QUIT")
+
+                return True
             except:
                 self.__logger__.log_warning_message(
                     "ERROR trying to quit."
@@ -740,15 +888,14 @@ class CommandProcessor(object):
                 status += ", TURNING HEATER OFF."
                 # clear the queue if it has a bunch of no warnings in it
 
+            # The service loop forces the heater off
+            # when it handles the reading.
             self.__logger__.log_warning_message(status)
-            self.__gas_sensor_queue__.put(
-                text.GAS_WARNING + ", level=" + str(current_level))
-            self.__logger__.heater_queue.put(text.HEATER_OFF_COMMAND)
-            self.__queue_message_to_all_numbers__(status)
+            self.__event_bus__.publish(GasReadingEvent(True, current_level))
+            self.__queue_message_to_all_numbers__(status, SAFETY)
         else:
             self.__logger__.log_info_message("Sending OK into queue", False)
-            self.__gas_sensor_queue__.put(
-                text.GAS_OK + ", level=" + str(current_level))
+            self.__event_bus__.publish(GasReadingEvent(False, current_level))
 
     def __monitor_fona_health__(self):
         """
@@ -761,13 +908,35 @@ class CommandProcessor(object):
         self.__logger__.log_info_message("GSM Battery="
                                          + str(cbc.get_percent_battery()) + "% Volts="
                                          + str(cbc.get_voltage()))
-
-        if not cbc.is_battery_ok():
+        self.__logger__.log_info_message("Live threads="
+                                         + str(get_live_thread_count()))
+
+        for task_metrics in get_all_task_metrics():
+            self.__logger__.log_info_message(task_metrics.describe(), False)
+
+        self.__logger__.log_info_message("Gas to relay off latency: "
+                                         + self.__gas_to_relay_off_latency__.describe(),
+                                         False)
+        self.__logger__.log_info_message(self.__fona_manager__.describe_send_metrics(),
+                                         False)
+        self.__logger__.log_info_message(self.__fona_manager__.describe_modem_queue(),
+                                         False)
+
+        # The battery is not known until it has been read once.
+        if self.__fona_manager__.has_status() and not cbc.is_battery_ok():
             low_battery_message = "WARNING: LOW BATTERY for Fona. Currently " + \
                 str(cbc.get_percent_battery()) + "%"
             self.__queue_message_to_all_numbers__(low_battery_message)
             self.__logger__.log_warning_message(low_battery_message)
 
+    def __queue_lcd_update__(self):
+        """
+        Asks the service loop to update the LCD
+        when it has nothing more important to do.
+        """
+
+        self.__work_lanes__.submit(BULK, "LCD", self.__update_lcd__)
+
     def __update_lcd__(self):
         """
         Updates the LCD screen.
@@ -828,6 +997,12 @@ class CommandProcessor(object):
         if local_debug.is_debug():
             return None
 
+        # Start where the modem was left, to save probing for it.
+        baud_rate = load_baud_rate(self.__configuration__.cell_baud_rate_filename)
+
+        if baud_rate is None:
+            baud_rate = self.__configuration__.cell_baud_rate
+
         while retries > 0 and serial_connection is None:
             try:
                 self.__logger__.log_info_message(
@@ -835,7 +1010,7 @@ class CommandProcessor(object):
 
                 serial_connection = serial.Serial(
                     self.__configuration__.cell_serial_port,
-                    self.__configuration__.cell_baud_rate)
+                    baud_rate)
             except:
                 self.__logger__.log_warning_message(
                     "SERIAL DEVICE NOT LOCATED."
@@ -848,8 +1023,144 @@ class CommandProcessor(object):
 
             retries -= 1
 
+        if serial_connection is not None:
+            self.__negotiate_baud_rate__(serial_connection)
+
         return serial_connection
 
+    def __negotiate_baud_rate__(self, serial_connection):
+        """
+        Moves the modem link to the fastest rate it can hold.
+        If the modem cannot be found, the configured rate is
+        used, as it was before negotiating.
+        """
+
+        negotiator = BaudRateNegotiator(serial_connection,
+                                        self.__logger__,
+                                        self.__configuration__.cell_baud_rate_filename)
+
+        try:
+            if negotiator.negotiate(self.__configuration__.cell_target_baud_rate,
+                                    self.__configuration__.is_cell_flow_control_enabled) is not None:
+                return
+        except:
+            self.__logger__.log_warning_message(
+                "Exception negotiating the baud rate:" + str(sys.exc_info()[0]))
+
+        serial_connection.baudrate = self.__configuration__.cell_baud_rate
+
+    def __initialize_work_lanes__(self):
+        """
+        Sets up the prioritized work for the service loop.
+        The order within each lane is the order the work is done.
+        """
+
+        self.__work_lanes__.add_servicer(CRITICAL, "Gas sensor queue",
+                                         self.__service_gas_sensor_queue__,
+                                         lambda: not self.__gas_sensor_queue__.empty())
+        self.__work_lanes__.add_servicer(CRITICAL, "Relay",
+                                         self.__service_relay__,
+                                         self.__relay_controller__.has_pending_commands)
+        self.__work_lanes__.add_servicer(NORMAL, "Incoming request queue",
+                                         self.__process_pending_text_messages__)
+
+        # These only hand the work to the modem thread,
+        # which does it in its own priority order.
+        self.__work_lanes__.add_servicer(NORMAL, "Outgoing messages",
+                                         self.__fona_manager__.send_pending_messages)
+        self.__work_lanes__.add_servicer(BULK, "Fona status",
+                                         self.__fona_manager__.update_status)
+
+    def __initialize_sensors__(self):
+        """
+        Starts the sensors.
+        """
+
+        self.__sensors__ = Sensors(self.__configuration__)
+
+    def __initialize_fona_manager__(self):
+        """
+        Opens the modem and starts the Fona manager.
+        """
+
+        serial_connection = self.__initialize_modem__()
+        if serial_connection is None and not local_debug.is_debug():
+            raise IOError("Unable to initialize serial connection")
+
+        self.__fona_manager__ = FonaManager(self.__logger__,
+                                            serial_connection,
+                                            self.__configuration__.cell_power_status_pin,
+                                            self.__configuration__.cell_ring_indicator_pin,
+                                            self.__configuration__.utc_offset,
+                                            self.__event_bus__,
+                                            self.__configuration__.is_direct_sms_delivery_enabled,
+                                            self.__configuration__.is_pdu_mode_enabled,
+                                            self.__configuration__.outbound_journal_filename)
+
+    def __initialize_relay_controller__(self):
+        """
+        Starts the relay, with the heater off.
+        """
+
+        self.__relay_controller__ = RelayManager(self.__configuration__, self.__logger__,
+                                                 self.__heater_turned_on_callback__,
+                                                 self.__heater_turned_off_callback__,
+                                                 self.__heater_max_time_off_callback__,
+                                                 self.__event_bus__)
+
+    def __send_startup_status__(self):
+        """
+        Sends the full status to everyone once the
+        Fona has read the battery and signal, or gives
+        up waiting and sends what is known.
+        Runs every second until it has sent the status.
+        """
+
+        if self.__is_startup_status_sent__:
+            return
+
+        if not self.__fona_manager__.has_status() \
+                and self.__startup_status_attempts__ < MAXIMUM_STARTUP_STATUS_ATTEMPTS:
+            self.__startup_status_attempts__ += 1
+            return
+
+        self.__is_startup_status_sent__ = True
+        self.__startup_status_task__.cancel()
+        self.__queue_message_to_all_numbers__(self.__get_full_status__())
+
+    def __initialize_lifecycle__(self):
+        """
+        Registers the shutdown steps, in the order they run.
+        The relay goes low first so the heater is safe
+        no matter how the rest of the shutdown goes.
+        """
+
+        self.__lifecycle__.register("Relay", self.__relay_controller__.shutdown)
+        self.__lifecycle__.register("Scheduler",
+                                    lambda: get_default_scheduler().stop(2.0), 3)
+        self.__lifecycle__.register("Outbound messages",
+                                    self.__fona_manager__.shutdown, 12)
+        self.__lifecycle__.register("Sensors", self.__sensors__.close, 2)
+        self.__lifecycle__.register("LCD", self.__close_lcd__, 2)
+
+        if self.__worker_pool__ is not None:
+            self.__lifecycle__.register("Worker pool",
+                                        lambda: self.__worker_pool__.stop(2.0), 3)
+
+        self.__lifecycle__.register("Watchdog", get_default_watchdog().stop, 1)
+
+    def __close_lcd__(self):
+        """
+        Shows that we have stopped, then releases the display.
+        """
+
+        lcd = self.__lcd__
+        self.__lcd__ = None
+
+        if lcd is not None:
+            lcd.write_text("Stopped")
+            lcd.close()
+
     def __initialize_lcd__(self):
         """
         Initializes the display.
@@ -863,43 +1174,90 @@ class CommandProcessor(object):
     #-- Servicers
     ##############################
 
+    def __get_seconds_until_next_deadline__(self):
+        """
+        Returns how long the service loop may sleep
+        before something time based needs to be serviced.
+        """
+
+        seconds_until_deadline = DEFAULT_MAXIMUM_IDLE_SECONDS
+        seconds_until_shutoff = self.__relay_controller__.get_seconds_until_shutoff()
+
+        if seconds_until_shutoff is not None:
+            seconds_until_deadline = min(seconds_until_deadline,
+                                         seconds_until_shutoff)
+
+        # Messages held back to be merged are due to go.
+        seconds_until_send = self.__fona_manager__.get_seconds_until_next_send()
+
+        if seconds_until_send is not None:
+            seconds_until_deadline = min(seconds_until_deadline,
+                                         seconds_until_send)
+
+        return seconds_until_deadline
+
     def __service_gas_sensor_queue__(self):
         """
         Runs the service code for messages coming
         from the gas sensor.
         """
 
-        try:
-            while not self.__gas_sensor_queue__.empty():
-                gas_sensor_status = self.__gas_sensor_queue__.get()
+        for gas_reading in self.__gas_sensor_queue__.drain():
+            if gas_reading.is_gas_detected:
+                gas_sensor_status = text.GAS_WARNING
 
-                if gas_sensor_status is None:
-                    self.__logger__.log_warning_message("Gas sensor was None.")
-                else:
-                    self.__logger__.log_info_message(
-                        "Q:" + gas_sensor_status, False)
+                if self.__gas_warning_time__ is None \
+                        and self.__relay_controller__.is_relay_on():
+                    self.__gas_warning_time__ = gas_reading.created_time
+            else:
+                gas_sensor_status = text.GAS_OK
 
-                if text.GAS_WARNING in gas_sensor_status:
-                    self.__handle_gas_warning__(gas_sensor_status)
-                elif text.GAS_OK in gas_sensor_status:
-                    self.__handle_gas_ok__(gas_sensor_status)
-        except Queue.Empty:
-            pass
+            gas_sensor_status += ", level=" + str(gas_reading.level)
+            self.__logger__.log_info_message("Q:" + gas_sensor_status, False)
+
+            if gas_reading.is_gas_detected:
+                self.__handle_gas_warning__(gas_sensor_status)
+            else:
+                self.__handle_gas_ok__(gas_sensor_status)
 
         return self.__is_gas_detected__
 
+    def __service_relay__(self):
+        """
+        Services the relay, and measures how long it took
+        to turn the heater off after gas was detected.
+        """
+
+        self.__relay_controller__.update()
+
+        if self.__gas_warning_time__ is not None \
+                and not self.__relay_controller__.is_relay_on():
+            latency = utilities.get_monotonic_time() - self.__gas_warning_time__
+            self.__gas_warning_time__ = None
+            self.__gas_to_relay_off_latency__.add(latency)
+            self.__logger__.log_warning_message(
+                "Heater off " + str(round(latency, 2)) + "s after gas detected."
+                + " Worst=" + str(round(self.__gas_to_relay_off_latency__.maximum, 2))
+                + "s")
+
     def __process_pending_text_messages__(self):
         """
         Processes any messages sitting on the sim card.
+        The modem reads them on its own thread, so the
+        loop never waits behind a send in progress.
         """
         # Check to see if the RI pin has been
         # tripped, or is it is time to poll
         # for messages.
-        if not self.__fona_manager__.is_message_waiting():
-            return False
+        if self.__fona_manager__.is_message_waiting():
+            self.__fona_manager__.request_messages()
+
+        # Take the messages the modem has read so far.
+        messages = []
+
+        for messages_read in self.__messages_read_queue__.drain():
+            messages.extend(messages_read.messages)
 
-        # Get the messages from the sim card
-        messages = self.__fona_manager__.get_messages()
         total_message_count = len(messages)
         messages_processed_count = 0
 
@@ -915,6 +1273,9 @@ class CommandProcessor(object):
             sorted_messages = sorted(messages, key=lambda message: message.sent_time)
 
             for message in sorted_messages:
+                # Let a gas warning jump ahead of the remaining messages.
+                self.__work_lanes__.preempt()
+
                 messages_processed_count += 1
                 self.__fona_manager__.delete_message(message)
 
@@ -939,8 +1300,12 @@ class CommandProcessor(object):
                 self.__logger__.log_info_message(response)
 
                 # If the command did something to the unit
-                # stop processing other commands
+                # stop processing other commands. The rest are
+                # handed back, as a delivered message has no
+                # copy on the SIM to read again.
                 if state_changed:
+                    self.__fona_manager__.return_messages(
+                        sorted_messages[messages_processed_count:])
                     break
 
             self.__logger__.log_info_message(
@@ -962,7 +1327,7 @@ class CommandProcessor(object):
             service_callback()
         except KeyboardInterrupt:
             print "Stopping due to CTRL+C"
-            exit()
+            self.request_shutdown("CTRL+C")
         except:
             self.__logger__.log_warning_message(
                 "Exception while servicing " + service_name)
@@ -991,6 +1356,23 @@ def test_valid_commands():
         assert command_response.get_message() == message
 
 
+def test_relay_is_shut_down_first():
+    """
+    The heater is made safe before anything else stops.
+    """
+
+    processor = CommandProcessor.__new__(CommandProcessor)
+    processor.__lifecycle__ = LifecycleManager()
+    processor.__relay_controller__ = RelayManager.__new__(RelayManager)
+    processor.__fona_manager__ = FonaManager.__new__(FonaManager)
+    processor.__sensors__ = Sensors.__new__(Sensors)
+    processor.__worker_pool__ = None
+    processor.__initialize_lifecycle__()
+
+    assert processor.__lifecycle__.get_step_names() \
+        == ["Relay", "Scheduler", "Outbound messages", "Sensors", "LCD", "Watchdog"]
+
+
 #############
 # SELF TEST #
 #############
@@ -1002,6 +1384,7 @@ if __name__ == '__main__':
     print "Starting tests."
 
     doctest.testmod()
+    test_relay_is_shut_down_first()
     CONFIG = configuration.Configuration()
 
     CONTROLLER = CommandProcessor(
@@ -4,6 +4,8 @@
 
 from ConfigParser import SafeConfigParser
 import lib.local_debug as local_debug
+from lib.watchdog import DEFAULT_STALL_THRESHOLD
+from lib.status_renderer import VERBOSE, PROFILES
 
 # read in configuration settings
 
@@ -65,6 +67,8 @@ class Configuration(object):
         self.max_minutes_to_run = self.__config_parser__.getint(
             'SETTINGS', 'MAX_HEATER_TIME')
         self.log_filename = self.get_log_directory() + "hangar_buddy.log"
+        self.cell_baud_rate_filename = self.get_log_directory() + "modem_baud_rate.state"
+        self.outbound_journal_filename = self.get_log_directory() + "outbound_messages.journal"
         self.oldest_message = self.__config_parser__.getint(
             'SETTINGS', 'OLDEST_MESSAGE_TO_PROCESS')
         self.utc_offset = self.__config_parser__.getint(
@@ -76,6 +80,45 @@ class Configuration(object):
         except:
             self.test_mode = False
 
+        try:
+            self.stall_threshold = self.__config_parser__.getint(
+                'SETTINGS', 'STALL_THRESHOLD')
+        except:
+            self.stall_threshold = DEFAULT_STALL_THRESHOLD
+
+        try:
+            self.is_direct_sms_delivery_enabled = self.__config_parser__.getboolean(
+                'SETTINGS', 'DIRECT_SMS_DELIVERY')
+        except:
+            self.is_direct_sms_delivery_enabled = False
+
+        try:
+            self.is_pdu_mode_enabled = self.__config_parser__.getboolean(
+                'SETTINGS', 'PDU_MODE')
+        except:
+            self.is_pdu_mode_enabled = False
+
+        try:
+            self.cell_target_baud_rate = self.__config_parser__.getint(
+                'SETTINGS', 'MODEM_BAUDRATE')
+        except:
+            self.cell_target_baud_rate = int(self.cell_baud_rate)
+
+        try:
+            self.is_cell_flow_control_enabled = self.__config_parser__.getboolean(
+                'SETTINGS', 'HARDWARE_FLOW_CONTROL')
+        except:
+            self.is_cell_flow_control_enabled = False
+
+        try:
+            self.status_profile = self.__config_parser__.get(
+                'SETTINGS', 'STATUS_PROFILE').strip().upper()
+        except:
+            self.status_profile = VERBOSE
+
+        if self.status_profile not in PROFILES:
+            self.status_profile = VERBOSE
+
 
 ##################
 ### UNIT TESTS ###
@@ -5,11 +5,18 @@ the Fona in a thread safe way.
 import sys
 import threading
 import time
-from multiprocessing import Queue as MPQueue
+import lib.utilities as utilities
 import text
 import lib.local_debug as local_debug
 import lib.fona as fona
-from lib.recurring_task import RecurringTask
+import lib.sms_message as sms_message
+from lib.recurring_task import RecurringTask, SKIP
+from lib.event_bus import EventBus
+from lib.events import OutboundMessageEvent, StatusCheckEvent, MessagesReadEvent
+from lib.modem_scheduler import ModemScheduler, SAFETY, REPLY, INBOUND, STATUS
+from lib.sms_coalescer import SmsCoalescer
+from lib.outbound_journal import OutboundJournal
+from lib.retry_scheduler import RetryScheduler, DEADLINE_PASSED
 
 
 class FonaManager(object):
@@ -17,7 +24,9 @@ class FonaManager(object):
     Object to handle the Fona board and abstract
     away all the upkeep tasks associated with the board.
 
-    Keeps message sending & reception on a single thread.
+    Keeps message sending & reception on a single thread,
+    the modem scheduler, which takes the most important
+    work first and never holds the modem for a whole batch.
 
     Handles updating the signal strength, battery state,
     and other monitoring of the device.
@@ -26,6 +35,11 @@ class FonaManager(object):
     CHECK_SIGNAL_INTERVAL = 60  # Once a minute
     CHECK_BATTERY_INTERVAL = 60 * 5  # Every five minutes
     DEFAULT_RETRY_ATTEMPTS = 4
+    DEFAULT_SHUTDOWN_TIMEOUT = 10  # Seconds
+    COALESCE_WINDOW = 0.5  # Seconds to wait for more messages to the same number
+    RETRY_BASE_DELAY = 5.0  # Seconds before the first retry, doubling after that
+    RETRY_MAXIMUM_DELAY = 60 * 5  # Seconds
+    DEFAULT_MESSAGE_DEADLINE = 60 * 30  # Seconds a message is worth sending for
 
     def is_power_on(self):
         """
@@ -36,26 +50,129 @@ class FonaManager(object):
 
     def update(self):
         """
-        Performs all of the processing of receiving,
-        sending, and status....
-        ... on a single thread...
+        Hands any pending sends and status checks
+        to the modem thread. Does not wait for them.
         """
 
         self.__process_status_updates__()
         self.__process_send_messages__()
 
+    def update_status(self):
+        """
+        Queues any pending signal and battery checks.
+        """
+
+        self.__process_status_updates__()
+
+    def send_pending_messages(self):
+        """
+        Queues any pending messages to be sent.
+        """
+
+        self.__process_send_messages__()
+
+    def has_pending_work(self):
+        """
+        Returns True if there are messages to send
+        or status updates to perform.
+        """
+
+        return self.has_pending_messages() or self.has_pending_status_checks()
+
+    def has_pending_messages(self):
+        """
+        Returns True if there are messages waiting to be sent.
+        """
+
+        return not self.__send_message_queue__.empty() \
+            or self.__coalescer__.get_pending_count() > 0 \
+            or self.__retry_scheduler__.get_waiting_count() > 0
+
+    def get_seconds_until_next_send(self):
+        """
+        Returns how long until a message being held
+        for merging, or waiting to be retried, is due
+        to go, or None if there is not one. The service
+        loop should run send_pending_messages() by then.
+        """
+
+        self.__lock__.acquire(True)
+        try:
+            waits = [self.__coalescer__.get_seconds_until_ready(),
+                     self.__retry_scheduler__.get_seconds_until_due()]
+        finally:
+            self.__lock__.release()
+
+        waits = [wait for wait in waits if wait is not None]
+
+        if not waits:
+            return None
+
+        return min(waits)
+
+    def has_pending_status_checks(self):
+        """
+        Returns True if there are signal or battery checks waiting.
+        """
+
+        return not self.__update_status_queue__.empty()
+
+    def shutdown(self, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+        """
+        Sends whatever messages are still queued, giving
+        each message one attempt, including those waiting
+        to be retried, then closes the Fona.
+        Messages that can not be sent before the timeout
+        are logged and dropped.
+        """
+
+        self.__check_battery_task__.cancel()
+        self.__check_signal_task__.cancel()
+        self.__is_shutting_down__ = True
+
+        self.__process_send_messages__(True)
+
+        # Anything dropped is still in the journal,
+        # and is sent at the next start.
+        for command in self.__scheduler__.stop(timeout):
+            self.__logger__.log_warning_message("SHUTDOWN: Dropping " + command.name)
+
+        self.__fona__.close()
+
+        if self.__journal__ is not None:
+            self.__journal__.close(1.0)
+
     def send_message(self,
                      phone_number,
                      text_message,
-                     maximum_number_of_retries=DEFAULT_RETRY_ATTEMPTS):
+                     maximum_number_of_retries=DEFAULT_RETRY_ATTEMPTS,
+                     priority=REPLY,
+                     seconds_until_deadline=DEFAULT_MESSAGE_DEADLINE):
         """
         Queues the message to be sent out.
-        """
-
-        self.__lock__.acquire(True)
-        self.__send_message_queue__.put(
-            [phone_number, text_message, maximum_number_of_retries])
-        self.__lock__.release()
+        The priority is a modem_scheduler priority,
+        such as SAFETY for a gas warning.
+        A message not sent by the deadline is given up on.
+        """
+
+        journal_ids = []
+
+        if self.__journal__ is not None:
+            journal_ids.append(self.__journal__.append(phone_number,
+                                                       text_message,
+                                                       maximum_number_of_retries,
+                                                       priority,
+                                                       priority == SAFETY,
+                                                       self.__get_deadline_time__(
+                                                           seconds_until_deadline)))
+
+        self.__event_bus__.publish(OutboundMessageEvent(phone_number,
+                                                        text_message,
+                                                        maximum_number_of_retries,
+                                                        priority,
+                                                        journal_ids,
+                                                        self.__get_deadline__(
+                                                            seconds_until_deadline)))
 
     def signal_strength(self):
         """
@@ -73,67 +190,194 @@ class FonaManager(object):
 
         return self.__current_battery_state__
 
+    def describe_send_metrics(self):
+        """
+        Returns how long sending has been taking,
+        and how many sends failed, suitable for the log.
+        """
+
+        metrics = "SMS send latency: " + self.__fona__.get_send_latency().describe() \
+            + ", failures=" + str(self.__fona__.get_send_failure_count()) \
+            + ", merged=" + str(self.__coalescer__.get_merged_count()) \
+            + ", saved sends=" + str(self.__coalescer__.get_saved_send_count())
+
+        self.__lock__.acquire(True)
+        try:
+            metrics += ", " + self.__retry_scheduler__.describe()
+        finally:
+            self.__lock__.release()
+
+        if self.__journal__ is not None:
+            metrics += ", journaled=" + str(self.__journal__.get_pending_count())
+
+        return metrics
+
+    def take_dead_letters(self):
+        """
+        Returns how many messages were given up on since
+        the last call, and the last few of them, as
+        retry_scheduler.DeadLetters, oldest first.
+        Each is only returned once.
+        """
+
+        self.__lock__.acquire(True)
+        try:
+            return self.__retry_scheduler__.take_dead_letters()
+        finally:
+            self.__lock__.release()
+
+    def describe_modem_queue(self):
+        """
+        Returns how long work has been waiting for
+        the modem, suitable for the log.
+        """
+
+        return self.__scheduler__.describe()
+
+    def has_status(self):
+        """
+        Returns True once the battery and signal
+        have each been read at least once.
+        """
+
+        return self.__is_battery_state_known__ and self.__is_signal_strength_known__
+
     def is_message_waiting(self):
         """
         Is there a message waiting for us to unpack?
         """
         return self.__fona__.is_message_waiting()
 
+    def request_messages(self):
+        """
+        Queues a read of the waiting messages on the modem
+        thread, unless one is already queued. Does not wait.
+        The messages are published as a MessagesReadEvent.
+        Returns True if a read was queued.
+        """
+
+        self.__lock__.acquire(True)
+        try:
+            if self.__is_read_queued__:
+                return False
+
+            self.__is_read_queued__ = True
+        finally:
+            self.__lock__.release()
+
+        if self.__scheduler__.submit(INBOUND, "get_messages",
+                                     self.__read_messages__) is not None:
+            return True
+
+        self.__lock__.acquire(True)
+        try:
+            self.__is_read_queued__ = False
+        finally:
+            self.__lock__.release()
+
+        return False
+
     def get_messages(self):
         """
-        Gets any messages from the Fona.
+        Gets any messages from the Fona, waiting for
+        the send in progress. The service loop uses
+        request_messages() instead, so it never waits.
+        """
+
+        return self.__scheduler__.call(INBOUND, "get_messages",
+                                       self.__get_messages_now__, [])
+
+    def return_messages(self, messages):
+        """
+        Puts back messages that were taken, but not
+        processed, so the next get_messages() has them.
+        """
+
+        self.__fona__.return_messages(messages)
+
+    def delete_messages(self):
+        """
+        Deletes any messages from the Fona.
+        """
+
+        return self.__scheduler__.call(INBOUND, "delete_messages",
+                                       self.__delete_messages_now__, 0)
+
+    def delete_message(self, message_to_delete):
+        """
+        Queues a message to be deleted from the Fona.
+        Does not wait. A read queued after this sees
+        the message gone.
+        """
+
+        self.__scheduler__.submit(INBOUND, "delete_message",
+                                  lambda: self.__delete_message_now__(message_to_delete))
+
+    def __read_messages__(self):
+        """
+        Reads the waiting messages on the modem thread,
+        and hands them to the service loop.
+        The read is always published, even when empty,
+        so the loop wakes and can queue another if more
+        messages arrived during this one.
         """
 
-        results = []
+        messages = self.__get_messages_now__()
 
         self.__lock__.acquire(True)
         try:
-            results = self.__fona__.get_messages()
+            self.__is_read_queued__ = False
+        finally:
+            self.__lock__.release()
+
+        self.__event_bus__.publish(MessagesReadEvent(messages))
+
+    def __get_messages_now__(self):
+        """
+        Gets any messages, on the modem thread.
+        """
+
+        try:
+            return self.__fona__.get_messages()
         except:
             exception_message = "ERROR fetching messages!"
             print exception_message
             self.__logger__.log_warning_message(exception_message)
-        self.__lock__.release()
 
-        return results
+        return []
 
-    def delete_messages(self):
+    def __delete_messages_now__(self):
         """
-        Deletes any messages from the Fona.
+        Deletes any messages, on the modem thread.
         """
 
-        num_deleted = 0
-
-        self.__lock__.acquire(True)
         try:
-            num_deleted = self.__fona__.delete_messages()
+            return self.__fona__.delete_messages()
         except:
             exception_message = "ERROR deleting messages!"
             print exception_message
             self.__logger__.log_warning_message(exception_message)
-        self.__lock__.release()
 
-        return num_deleted
+        return 0
 
-    def delete_message(self, message_to_delete):
+    def __delete_message_now__(self, message_to_delete):
         """
-        Deletes any messages from the Fona.
+        Deletes one message, on the modem thread.
         """
 
-        self.__lock__.acquire(True)
         try:
             self.__fona__.delete_message(message_to_delete)
         except:
             exception_message = "ERROR deleting message!"
             print exception_message
             self.__logger__.log_warning_message(exception_message)
-        self.__lock__.release()
 
     def __update_battery_state__(self):
         """
         Updates the battery state.
         """
         self.__current_battery_state__ = self.__fona__.get_current_battery_condition()
+        self.__is_battery_state_known__ = True
 
     def __update_signal_strength__(self):
         """
@@ -141,127 +385,315 @@ class FonaManager(object):
         """
 
         self.__current_signal_strength__ = self.__fona__.get_signal_strength()
+        self.__is_signal_strength_known__ = True
 
     def __process_status_updates__(self):
         """
-        Handles updating the cell signal
-        and battery status.
+        Queues the cell signal and battery
+        status checks for the modem thread.
         """
 
-        # Only perform these checks once per
+        # Only perform each check once per
         # update. This lets us clear the thread
         # faster and prevents redundant work.
-        battery_checked = False
-        signal_checked = False
+        checks = set([status_check.check
+                      for status_check in self.__update_status_queue__.drain()])
 
-        self.__lock__.acquire(True)
+        if text.CHECK_BATTERY in checks:
+            self.__scheduler__.submit(STATUS, "check_battery",
+                                      lambda: self.__check_status__(self.__update_battery_state__))
+        if text.CHECK_SIGNAL in checks:
+            self.__scheduler__.submit(STATUS, "check_signal",
+                                      lambda: self.__check_status__(self.__update_signal_strength__))
+
+    def __check_status__(self, update_callback):
+        """
+        Runs a status check on the modem thread.
+        """
 
         try:
-            while not self.__update_status_queue__.empty():
-                command = self.__update_status_queue__.get()
-
-                if text.CHECK_BATTERY in command and not battery_checked:
-                    self.__update_battery_state__()
-                    battery_checked = True
-                if text.CHECK_SIGNAL in command and not signal_checked:
-                    self.__update_signal_strength__()
-                    signal_checked = True
+            update_callback()
         except:
             exception_message = "ERROR updating signal & battery status!"
             print exception_message
             self.__logger__.log_warning_message(exception_message)
 
-        self.__lock__.release()
+    def __process_send_messages__(self, flush=False):
+        """
+        Queues each pending message as its own
+        send, so reads can run in between.
+        New messages are held for a moment first, so
+        those to the same number can go as one.
+        """
+
+        self.__lock__.acquire(True)
+        try:
+            for new_message in self.__send_message_queue__.drain():
+                self.__coalescer__.add(new_message)
 
-    def __process_send_messages__(self):
+            # Messages that failed go first, once
+            # they have waited out their backoff.
+            messages_to_send = self.__retry_scheduler__.take_due(flush) \
+                + self.__coalescer__.take_ready(flush)
+        finally:
+            self.__lock__.release()
+
+        for message_to_send in messages_to_send:
+            self.__scheduler__.submit(message_to_send.priority,
+                                      "send to " + message_to_send.phone_number + ":"
+                                      + message_to_send.text_message,
+                                      lambda message=message_to_send:
+                                      self.__send_queued_message__(message))
+
+    def __send_queued_message__(self, message_to_send):
         """
-        Handles sending any pending messages.
+        Sends a message on the modem thread, and
+        holds it to be retried if that fails.
+        The journal follows along, so a message that
+        is cut off by a restart is sent again.
         """
 
-        messages_to_retry = []
+        self.__lock__.acquire(True)
+        try:
+            is_expired = self.__retry_scheduler__.is_expired(message_to_send)
+
+            if is_expired:
+                self.__retry_scheduler__.add_dead_letter(message_to_send, DEADLINE_PASSED)
+        finally:
+            self.__lock__.release()
+
+        if is_expired:
+            self.__give_up_on_message__(message_to_send)
+
+            return
+
+        if self.__journal__ is not None:
+            self.__journal__.mark_sent(message_to_send.journal_ids)
+
+        if self.__send_message_now__(message_to_send):
+            if self.__journal__ is not None:
+                self.__journal__.mark_acked(message_to_send.journal_ids)
+
+            return
+
+        message_to_send.attempt_count += 1
+        message_to_send.retries_remaining -= 1
+
+        if self.__is_shutting_down__:
+            return
 
         self.__lock__.acquire(True)
         try:
-            while not self.__send_message_queue__.empty():
-                self.__logger__.log_info_message("__send_message_queue__")
-                message_to_send = self.__send_message_queue__.get()
-                self.__logger__.log_info_message(
-                    "done: __send_message_queue__")
-
-                try:
-                    self.__logger__.log_info_message("sending..")
-                    self.__fona__.send_message(
-                        message_to_send[0], message_to_send[1])
-                    self.__logger__.log_info_message("done sending")
-                except:
-                    self.__logger__.log_warning_message(
-                        "Exception servicing outgoing message:" + str(sys.exc_info()[0]))
-
-                    message_to_send[3] -= 1
-                    if message_to_send[3] > 0:
-                        messages_to_retry.append(message_to_send)
-        except:
+            retry_delay = self.__retry_scheduler__.schedule_retry(message_to_send)
+        finally:
+            self.__lock__.release()
+
+        if retry_delay is None:
+            self.__give_up_on_message__(message_to_send)
+
+            return
+
+        self.__logger__.log_warning_message(
+            "Retrying message to " + message_to_send.phone_number + " in "
+            + str(round(retry_delay, 1)) + "s, up to " + str(message_to_send.retries_remaining)
+            + " more retries.")
+
+    def __give_up_on_message__(self, message_to_send):
+        """
+        Logs a message that became a dead letter,
+        and finishes it in the journal.
+        """
+
+        self.__logger__.log_warning_message(
+            "Giving up on message to " + message_to_send.phone_number + " after "
+            + str(message_to_send.attempt_count) + " attempt(s).")
+
+        if self.__journal__ is not None:
+            self.__journal__.mark_dropped(message_to_send.journal_ids)
+
+    def __get_deadline__(self, seconds_until_deadline):
+        """
+        Returns the deadline for a message, or None
+        if it has none.
+        """
+
+        if seconds_until_deadline is None:
+            return None
+
+        return utilities.get_monotonic_time() + seconds_until_deadline
+
+    def __get_deadline_time__(self, seconds_until_deadline):
+        """
+        Returns the deadline for a message as a wall clock
+        time, for the journal, or None if it has none.
+        The monotonic clock does not survive a restart.
+        """
+
+        if seconds_until_deadline is None:
+            return None
+
+        return time.time() + seconds_until_deadline
+
+    def __replay_journal__(self):
+        """
+        Queues the messages that were not sent before
+        the last shutdown, crash, or power loss.
+        """
+
+        entries = self.__journal__.replay()
+
+        if not entries:
+            return
+
+        self.__logger__.log_warning_message(
+            "Sending " + str(len(entries)) + " message(s) left from before the restart.")
+
+        # The deadline counts from when the message was
+        # first queued, so one that is already too late
+        # becomes a dead letter instead of being sent.
+        now = time.time()
+        expired_ids = []
+
+        self.__lock__.acquire(True)
+        try:
+            for entry in entries:
+                seconds_until_deadline = None
+
+                if entry.deadline_time is not None:
+                    seconds_until_deadline = entry.deadline_time - now
+
+                message = OutboundMessageEvent(entry.phone_number,
+                                               entry.text_message,
+                                               entry.retries_remaining,
+                                               entry.priority,
+                                               [entry.journal_id],
+                                               self.__get_deadline__(seconds_until_deadline))
+
+                if seconds_until_deadline is not None and seconds_until_deadline <= 0:
+                    message.attempt_count = entry.attempt_count
+                    self.__retry_scheduler__.add_dead_letter(message, DEADLINE_PASSED)
+                    expired_ids.append(entry.journal_id)
+                else:
+                    self.__coalescer__.add(message)
+        finally:
+            self.__lock__.release()
+
+        if expired_ids:
             self.__logger__.log_warning_message(
-                "Exception servicing outgoing queue:" + str(sys.exc_info()[0]))
+                "Not sending " + str(len(expired_ids)) + " message(s) past their deadline.")
+            self.__journal__.mark_dropped(expired_ids)
 
-        for message_to_retry in messages_to_retry:
+    def __send_message_now__(self, message_to_send):
+        """
+        Sends a single message.
+        Returns True if it was sent.
+        """
+
+        # Nothing to send it with, such as when debugging.
+        if self.__fona__.serial_connection is None:
+            return True
+
+        try:
+            message_reference = self.__fona__.send_message(
+                message_to_send.phone_number, message_to_send.text_message)
+
+            return message_reference is not None
+        except:
             self.__logger__.log_warning_message(
-                "Adding message back for up to" + str(message_to_retry[3]) + " more retries.")
-            self.__send_message_queue__.put(message_to_retry)
+                "Exception servicing outgoing message:" + str(sys.exc_info()[0]))
 
-        self.__lock__.release()
+        return False
 
     def __trigger_check_battery__(self):
         """
         Triggers the battery state to be checked.
         """
 
-        self.__update_status_queue__.put(text.CHECK_BATTERY)
+        self.__event_bus__.publish(StatusCheckEvent(text.CHECK_BATTERY))
 
     def __trigger_check_signal__(self):
         """
         Triggers the signal to be checked.
         """
 
-        self.__update_status_queue__.put(text.CHECK_SIGNAL)
+        self.__event_bus__.publish(StatusCheckEvent(text.CHECK_SIGNAL))
 
     def __init__(self,
                  logger,
                  serial_connection,
                  power_status_pin,
                  ring_indicator_pin,
-                 utc_offset):
+                 utc_offset,
+                 event_bus=None,
+                 direct_delivery=False,
+                 pdu_mode=False,
+                 journal_filename=None):
         """
         Initializes the Fona.
+        With a journal filename, queued messages are kept
+        on disk, and any left from last time are sent.
         """
 
-        fona.TIMEZONE_OFFSET = utc_offset
+        if event_bus is None:
+            event_bus = EventBus()
+
+        sms_message.TIMEZONE_OFFSET = utc_offset
         self.__logger__ = logger
+        self.__event_bus__ = event_bus
         self.__lock__ = threading.Lock()
         self.__fona__ = fona.Fona(logger,
                                   serial_connection,
                                   power_status_pin,
-                                  ring_indicator_pin)
-        self.__current_battery_state__ = None
-        self.__current_signal_strength__ = None
-        self.__update_status_queue__ = MPQueue()
-        self.__send_message_queue__ = MPQueue()
-
-        # Update the status now as we dont
-        # know how long it will be until
-        # the queues are serviced.
-        self.__update_battery_state__()
-        self.__update_signal_strength__()
-
-        RecurringTask("check_battery",
-                      self.CHECK_BATTERY_INTERVAL,
-                      self.__trigger_check_battery__,
-                      self.__logger__)
-
-        RecurringTask("check_signal",
-                      self.CHECK_SIGNAL_INTERVAL,
-                      self.__trigger_check_signal__,
-                      self.__logger__)
+                                  ring_indicator_pin,
+                                  event_bus,
+                                  direct_delivery,
+                                  pdu_mode)
+        self.__current_battery_state__ = fona.BatteryCondition(None)
+        self.__current_signal_strength__ = fona.SignalStrength(None)
+        self.__is_battery_state_known__ = False
+        self.__is_signal_strength_known__ = False
+        self.__update_status_queue__ = event_bus.subscribe(StatusCheckEvent)
+        # A dropped message would not be sent until the
+        # next restart replayed it, so never drop one.
+        self.__send_message_queue__ = event_bus.subscribe(OutboundMessageEvent, None)
+        self.__retry_scheduler__ = RetryScheduler(self.RETRY_BASE_DELAY,
+                                                  self.RETRY_MAXIMUM_DELAY)
+        self.__is_shutting_down__ = False
+        self.__is_read_queued__ = False
+        self.__scheduler__ = ModemScheduler(logger)
+        self.__coalescer__ = SmsCoalescer(self.COALESCE_WINDOW, [SAFETY])
+        self.__journal__ = None
+
+        if journal_filename is not None:
+            try:
+                self.__journal__ = OutboundJournal(journal_filename, logger)
+            except (IOError, OSError):
+                self.__logger__.log_warning_message(
+                    "Unable to open the outbound journal, sending without it:"
+                    + str(sys.exc_info()[1]))
+
+        if self.__journal__ is not None:
+            self.__replay_journal__()
+
+        # Reading the battery and signal is slow, so
+        # do not wait for them here. They are read the
+        # first time the status queue is serviced.
+        self.__trigger_check_battery__()
+        self.__trigger_check_signal__()
+
+        # Only the latest battery and signal matter,
+        # so a missed check is not made up.
+        self.__check_battery_task__ = RecurringTask("check_battery",
+                                                    self.CHECK_BATTERY_INTERVAL,
+                                                    self.__trigger_check_battery__,
+                                                    self.__logger__,
+                                                    missed_run_policy=SKIP)
+
+        self.__check_signal_task__ = RecurringTask("check_signal",
+                                                   self.CHECK_SIGNAL_INTERVAL,
+                                                   self.__trigger_check_signal__,
+                                                   self.__logger__,
+                                                   missed_run_policy=SKIP)
 
 
 if __name__ == '__main__':
@@ -278,12 +710,13 @@ if __name__ == '__main__':
                                SERIAL_CONNECTION,
                                fona.DEFAULT_POWER_STATUS_PIN,
                                fona.DEFAULT_RING_INDICATOR_PIN,
-                               fona.TIMEZONE_OFFSET)
+                               sms_message.TIMEZONE_OFFSET)
 
     if not FONA_MANAGER.is_power_on():
         print "Power is off.."
         exit()
 
+    FONA_MANAGER.update_status()
     BATTERY_CONDITION = FONA_MANAGER.battery_condition()
     FONA_MANAGER.send_message(PHONE_NUMBER,
                               "Time:" + str(time.time()) + "\nPCT:"
@@ -35,6 +35,7 @@ Main entry code for HangarBuddy
 
 import logging
 import logging.handlers
+import signal
 import configuration
 from lib.logger import Logger
 import command_processor
@@ -52,7 +53,19 @@ HANDLER.setFormatter(logging.Formatter(
     '%(asctime)s %(levelname)-8s %(message)s'))
 LOGGER.addHandler(HANDLER)
 
+
+def install_shutdown_handler(processor):
+    """
+    Makes a SIGTERM (such as from "systemctl stop")
+    shut HangarBuddy down cleanly.
+    """
+
+    signal.signal(signal.SIGTERM,
+                  lambda signal_number, frame: processor.request_shutdown("SIGTERM"))
+
+
 if __name__ == '__main__':
     COMMAND_PROCESSOR = command_processor.CommandProcessor(
         CONFIGURATION, Logger(LOGGER))
+    install_shutdown_handler(COMMAND_PROCESSOR)
     COMMAND_PROCESSOR.run_hangar_buddy()
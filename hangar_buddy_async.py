@@ -0,0 +1,30 @@
+"""
+Optional entry point for HangarBuddy that overlaps
+the blocking hardware calls.
+
+The recurring tasks, such as the sensor polling and the LCD
+rotation, are run on a small, bounded pool of worker threads
+instead of one after another, so a command is no longer stuck
+behind a slow light sensor read. The modem has its own thread
+either way.
+
+Start it the same way as hangar_buddy.py:
+    python /home/pi/piWarmer/hangar_buddy_async.py &
+"""
+
+from lib.logger import Logger
+from lib.worker_pool import WorkerPool
+from lib.scheduler import get_default_scheduler
+import command_processor
+from hangar_buddy import CONFIGURATION, LOGGER, install_shutdown_handler
+
+HARDWARE_WORKER_COUNT = 4
+
+if __name__ == '__main__':
+    WORKER_POOL = WorkerPool(Logger(LOGGER), HARDWARE_WORKER_COUNT)
+    get_default_scheduler().set_executor(WORKER_POOL)
+
+    COMMAND_PROCESSOR = command_processor.CommandProcessor(
+        CONFIGURATION, Logger(LOGGER), WORKER_POOL)
+    install_shutdown_handler(COMMAND_PROCESSOR)
+    COMMAND_PROCESSOR.run_hangar_buddy()
@@ -0,0 +1,431 @@
+"""
+Module to run AT commands against a modem as
+transactions: write the command, then read lines
+until the modem gives a final result code.
+"""
+
+import time
+import utilities
+from serial_reader import SerialReader
+
+# How the transaction finished.
+OK = "OK"
+ERROR = "ERROR"
+PROMPT = "PROMPT"  # The modem is waiting for text, such as after AT+CMGS
+TIMEOUT = "TIMEOUT"
+NO_CONNECTION = "NO_CONNECTION"
+
+ERROR_PREFIXES = ["+CMS ERROR", "+CME ERROR"]
+# The line after one of these is message text, even if it reads "OK".
+TEXT_HEADERS = ["+CMGL:", "+CMGR:"]
+FINAL_ERRORS = [ERROR, "NO CARRIER", "NO DIALTONE", "BUSY", "NO ANSWER"]
+
+# Stands in for the "> " prompt, which has no line ending.
+PROMPT_LINE = "> "
+
+DEFAULT_COMMAND_TIMEOUT = 2  # Seconds
+POLL_INTERVAL = 0.005  # Seconds
+
+# Commands that have to wait on the network, or on the SIM.
+COMMAND_TIMEOUTS = {"AT+CMGS": 60,
+                    "AT+CMGL": 10,
+                    "AT+CMGR": 5,
+                    "AT+CMGD": 10,
+                    "AT+CMGDA": 10,
+                    "AT+CPMS": 5,
+                    "AT+COPS": 10,
+                    "AT+CBC": 5}
+
+
+def get_command_timeout(command):
+    """
+    Returns how long to wait for the command to finish.
+
+    >>> get_command_timeout("AT+CSQ")
+    2
+    >>> get_command_timeout('AT+CMGS="2061234567"')
+    60
+    >>> get_command_timeout("AT+COPS?")
+    10
+    """
+
+    command_name = command.strip().upper()
+
+    for separator in ["=", "?"]:
+        command_name = command_name.split(separator)[0]
+
+    return COMMAND_TIMEOUTS.get(command_name, DEFAULT_COMMAND_TIMEOUT)
+
+
+class AtResult(object):
+    """
+    The result of a single AT command.
+    """
+
+    def is_ok(self):
+        """
+        Returns True if the modem answered OK.
+        """
+
+        return self.status == OK
+
+    def is_error(self):
+        """
+        Returns True if the modem answered with an error.
+        """
+
+        return self.status == ERROR
+
+    def is_prompt(self):
+        """
+        Returns True if the modem is waiting for more text.
+        """
+
+        return self.status == PROMPT
+
+    def get_line(self, prefix):
+        """
+        Returns the first response line that starts
+        with the prefix, such as "+CSQ:", or None.
+        """
+
+        for line in self.lines:
+            if line.startswith(prefix):
+                return line
+
+        return None
+
+    def __str__(self):
+        return self.command + " -> " + self.status + " " + str(self.lines) \
+            + " in " + str(round(self.duration, 3)) + "s"
+
+    def __init__(self, command, status, lines, final_line=None, duration=0.0):
+        """
+        Lines holds the response lines, without the echo
+        of the command or the final result code.
+        """
+
+        self.command = command
+        self.status = status
+        self.lines = lines
+        self.final_line = final_line
+        self.duration = duration
+
+
+class PolledResponses(object):
+    """
+    Reads replies straight from the serial port.
+    Used when nothing else is listening to the modem.
+    """
+
+    def get_response(self, timeout):
+        """
+        Returns the next line of a reply, PROMPT_LINE if
+        the modem is waiting for text, or None on timeout.
+        """
+
+        deadline = utilities.get_monotonic_time() + timeout
+
+        while True:
+            line = self.__serial_reader__.read_line()
+
+            if line is not None:
+                return line
+
+            if self.__serial_reader__.take_prompt():
+                return PROMPT_LINE
+
+            if utilities.get_monotonic_time() >= deadline:
+                return None
+
+            if self.__serial_reader__.fill() < 1:
+                time.sleep(POLL_INTERVAL)
+
+    def wait_for_response(self, timeout):
+        """
+        Returns True once there is something to read.
+        """
+
+        return self.__serial_reader__.wait_for_data(timeout)
+
+    def discard(self):
+        """
+        Drops anything nobody read, and returns it.
+        """
+
+        self.__serial_reader__.fill()
+
+        return self.__serial_reader__.take()
+
+    def __init__(self, serial_reader):
+        self.__serial_reader__ = serial_reader
+
+
+class AtCommandEngine(object):
+    """
+    Runs one AT command at a time over a serial connection.
+    The caller is responsible for locking.
+    """
+
+    def execute(self, command, timeout=None):
+        """
+        Sends the command and reads until a final result
+        code, the "> " prompt, or the timeout.
+        Returns an AtResult.
+        """
+
+        if timeout is None:
+            timeout = get_command_timeout(command)
+
+        if self.__serial_connection__ is None:
+            return AtResult(command, NO_CONNECTION, [])
+
+        start_time = utilities.get_monotonic_time()
+
+        self.__discard_stale_input__()
+        self.__serial_connection__.write(command + "\r")
+
+        result = self.__read_response__(command, start_time + timeout)
+        result.duration = utilities.get_monotonic_time() - start_time
+
+        if result.status == TIMEOUT:
+            self.__log__("AT: TIMEOUT " + str(result))
+
+        return result
+
+    def send_text(self, text, timeout):
+        """
+        Sends text after a prompt, such as the body of
+        a text message, and reads the final result code.
+        """
+
+        if self.__serial_connection__ is None:
+            return AtResult(text, NO_CONNECTION, [])
+
+        start_time = utilities.get_monotonic_time()
+
+        self.__serial_connection__.write(text)
+
+        result = self.__read_response__(text, start_time + timeout)
+        result.duration = utilities.get_monotonic_time() - start_time
+
+        return result
+
+    def __init__(self, serial_connection, logger=None, responses=None):
+        """
+        Responses is where the replies are read from, such as
+        a urc_dispatcher.SerialListener. By default they are
+        read straight from the serial connection.
+        """
+
+        if responses is None:
+            responses = PolledResponses(SerialReader(serial_connection))
+
+        self.__serial_connection__ = serial_connection
+        self.__logger__ = logger
+        self.__responses__ = responses
+
+    def __read_response__(self, command, deadline):
+        """
+        Reads lines until the command finishes.
+        """
+
+        lines = []
+        echo = command.strip()
+        is_text_next = False
+
+        while True:
+            line = self.__responses__.get_response(
+                max(0, deadline - utilities.get_monotonic_time()))
+
+            if line is None:
+                return AtResult(command, TIMEOUT, lines)
+
+            if is_text_next:
+                lines.append(line)
+                is_text_next = False
+                continue
+
+            if line == PROMPT_LINE:
+                return AtResult(command, PROMPT, lines)
+
+            if line == echo:
+                continue
+
+            if line == OK:
+                return AtResult(command, OK, lines, line)
+
+            if line in FINAL_ERRORS or self.__is_error_line__(line):
+                return AtResult(command, ERROR, lines, line)
+
+            lines.append(line)
+            is_text_next = self.__is_text_header__(line)
+
+    def __is_text_header__(self, line):
+        """
+        Returns True if the next line is the text of a message.
+        """
+
+        for header in TEXT_HEADERS:
+            if line.startswith(header):
+                return True
+
+        return False
+
+    def __is_error_line__(self, line):
+        """
+        Returns True for the extended errors, such as "+CMS ERROR: 500".
+        """
+
+        for prefix in ERROR_PREFIXES:
+            if line.startswith(prefix):
+                return True
+
+        return False
+
+    def __discard_stale_input__(self):
+        """
+        Drops anything left over from an earlier command,
+        such as a reply that arrived after its timeout,
+        so it is not taken as the reply to this one.
+        """
+
+        stale_input = self.__responses__.discard()
+
+        if stale_input.strip() != "":
+            self.__log__("AT: Discarding " + repr(stale_input))
+
+    def __log__(self, message):
+        """
+        Logs, if there is a logger.
+        """
+
+        if self.__logger__ is not None:
+            self.__logger__.log_info_message(message)
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+class FakeModem(object):
+    """
+    Plays back canned replies, in the way pyserial
+    presents them, for the tests.
+    """
+
+    def write(self, data):
+        self.written += data
+
+        if self.replies:
+            self.waiting += self.replies.pop(0)
+
+        return len(data)
+
+    def inWaiting(self):
+        return len(self.waiting)
+
+    def read(self, size=1):
+        data = self.waiting[:size]
+        self.waiting = self.waiting[size:]
+
+        return data
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.written = ""
+        self.waiting = ""
+
+
+def test_ok_with_echo():
+    """
+    The echo and the final code are not part of the lines.
+    """
+
+    engine = AtCommandEngine(FakeModem(["AT+CSQ\r\r\n+CSQ: 17,0\r\n\r\nOK\r\n"]))
+    result = engine.execute("AT+CSQ")
+
+    assert result.is_ok()
+    assert result.lines == ["+CSQ: 17,0"]
+    assert result.get_line("+CSQ:") == "+CSQ: 17,0"
+    assert result.duration < 0.1
+
+
+def test_errors():
+    """
+    Plain and extended errors both end the command.
+    """
+
+    engine = AtCommandEngine(FakeModem(["\r\nERROR\r\n",
+                                        "\r\n+CMS ERROR: 500\r\n"]))
+
+    assert engine.execute("AT+BAD").is_error()
+
+    result = engine.execute("AT+CMGD=1")
+    assert result.is_error()
+    assert result.final_line == "+CMS ERROR: 500"
+
+
+def test_prompt():
+    """
+    The "> " prompt ends the command without a newline.
+    """
+
+    modem = FakeModem(['\r\n> ', "\r\n+CMGS: 12\r\n\r\nOK\r\n"])
+    engine = AtCommandEngine(modem)
+
+    assert engine.execute('AT+CMGS="2061234567"').is_prompt()
+
+    result = engine.send_text("Hello\x1a", 60)
+    assert result.is_ok()
+    assert result.lines == ["+CMGS: 12"]
+
+
+def test_message_text_is_not_a_result():
+    """
+    A text message that reads "OK" does not end the listing.
+    """
+
+    engine = AtCommandEngine(FakeModem(['\r\n+CMGL: 1,"REC READ","+12061234567","","18/01/20,14:05:03-32"\r\n'
+                                        + 'OK\r\n'
+                                        + '+CMGL: 2,"REC READ","+12061234567","","18/01/20,14:06:03-32"\r\n'
+                                        + 'Status\r\n\r\nOK\r\n']))
+    result = engine.execute('AT+CMGL="ALL"')
+
+    assert result.is_ok()
+    assert len(result.lines) == 4
+    assert result.lines[1] == "OK"
+
+
+def test_timeout_and_stale_input():
+    """
+    A late reply is discarded before the next command.
+    """
+
+    modem = FakeModem([""])
+    engine = AtCommandEngine(modem)
+
+    assert engine.execute("AT", 0.05).status == TIMEOUT
+
+    modem.waiting = "\r\nOK\r\n"
+    modem.replies = ["\r\n+CBC: 0,95,4200\r\n\r\nOK\r\n"]
+    result = engine.execute("AT+CBC")
+
+    assert result.is_ok()
+    assert result.lines == ["+CBC: 0,95,4200"]
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+    test_ok_with_echo()
+    test_errors()
+    test_prompt()
+    test_message_text_is_not_a_result()
+    test_timeout_and_stale_input()
+
+    print "Tests finished"
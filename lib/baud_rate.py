@@ -0,0 +1,325 @@
+"""
+Module to move the modem link to a faster baud rate.
+
+The modem is found at the rate we last used (or the
+configured one), asked to change with AT+IPR, and the
+new rate is only kept once the modem answers at it.
+Anything that goes wrong puts the link back where it was.
+"""
+
+import os
+import time
+from at_command import AtCommandEngine
+
+# The rates the Fona (SIM800) accepts for AT+IPR, fastest first.
+SUPPORTED_BAUD_RATES = [115200, 57600, 38400, 19200, 9600]
+PROBE_TIMEOUT = 0.5  # Seconds
+CONFIRM_ATTEMPTS = 3
+SETTLE_TIME = 0.1  # Seconds for the modem to change rates after its OK
+FLOW_CONTROL_COMMAND = "AT+IFC=2,2"  # RTS/CTS both ways
+NO_FLOW_CONTROL_COMMAND = "AT+IFC=0,0"
+
+
+def load_baud_rate(state_filename):
+    """
+    Returns the rate saved by save_baud_rate(),
+    or None if there is not one.
+    """
+
+    if state_filename is None:
+        return None
+
+    try:
+        with open(state_filename) as state_file:
+            baud_rate = int(state_file.read().strip())
+
+        if baud_rate in SUPPORTED_BAUD_RATES:
+            return baud_rate
+    except:
+        pass
+
+    return None
+
+
+def save_baud_rate(state_filename, baud_rate):
+    """
+    Saves the rate for the next start.
+    The file is replaced whole, so a crash
+    never leaves half a number behind.
+    Returns True if it was saved.
+    """
+
+    if state_filename is None:
+        return False
+
+    temporary_filename = state_filename + ".tmp"
+
+    try:
+        with open(temporary_filename, "w") as state_file:
+            state_file.write(str(baud_rate) + "\n")
+            state_file.flush()
+            os.fsync(state_file.fileno())
+
+        os.rename(temporary_filename, state_filename)
+
+        return True
+    except:
+        return False
+
+
+class BaudRateNegotiator(object):
+    """
+    Finds the modem, and moves the link to the
+    fastest rate that both ends can hold.
+    Must run before anything else reads the port.
+    """
+
+    def negotiate(self, target_baud_rate, use_flow_control=False):
+        """
+        Moves the link to the target rate, or the fastest
+        slower one that works. Returns the rate in use,
+        or None if the modem could not be found at all.
+        """
+
+        current_baud_rate = self.__find_modem__()
+
+        if current_baud_rate is None:
+            self.__log__("BAUD: No answer from the modem at any rate.")
+            return None
+
+        self.__set_flow_control__(use_flow_control)
+
+        for baud_rate in SUPPORTED_BAUD_RATES:
+            if baud_rate > target_baud_rate or baud_rate <= current_baud_rate:
+                continue
+
+            if self.__change_rate__(current_baud_rate, baud_rate):
+                current_baud_rate = baud_rate
+                break
+
+        self.__log__("BAUD: Using " + str(current_baud_rate)
+                     + (" with RTS/CTS" if self.__serial_connection__.rtscts else ""))
+        save_baud_rate(self.__state_filename__, current_baud_rate)
+
+        return current_baud_rate
+
+    def __init__(self, serial_connection, logger=None, state_filename=None):
+        self.__serial_connection__ = serial_connection
+        self.__logger__ = logger
+        self.__state_filename__ = state_filename
+
+    def __find_modem__(self):
+        """
+        Tries the rate the port is open at, the rate
+        saved last time, and then every other rate.
+        Returns the rate the modem answered at.
+        """
+
+        baud_rates = [self.__serial_connection__.baudrate,
+                      load_baud_rate(self.__state_filename__)]
+
+        for baud_rate in baud_rates + SUPPORTED_BAUD_RATES:
+            if baud_rate is None:
+                continue
+
+            self.__set_port_rate__(baud_rate)
+
+            if self.__probe__():
+                return baud_rate
+
+        return None
+
+    def __change_rate__(self, old_baud_rate, new_baud_rate):
+        """
+        Asks the modem to change rates, and follows it.
+        Returns True if it answers at the new rate. If it
+        does not, the link is put back on the old rate.
+        """
+
+        engine = AtCommandEngine(self.__serial_connection__)
+
+        if not engine.execute("AT+IPR=" + str(new_baud_rate), PROBE_TIMEOUT).is_ok():
+            return False
+
+        time.sleep(SETTLE_TIME)
+        self.__set_port_rate__(new_baud_rate)
+
+        for _ in range(CONFIRM_ATTEMPTS):
+            if self.__probe__():
+                return True
+
+        self.__log__("BAUD: No answer at " + str(new_baud_rate)
+                     + ", going back to " + str(old_baud_rate))
+
+        # The modem may have moved, or may not have; tell
+        # it to go back at whichever rate it is listening.
+        for baud_rate in [new_baud_rate, old_baud_rate]:
+            self.__set_port_rate__(baud_rate)
+            engine = AtCommandEngine(self.__serial_connection__)
+
+            if engine.execute("AT+IPR=" + str(old_baud_rate), PROBE_TIMEOUT).is_ok():
+                break
+
+        time.sleep(SETTLE_TIME)
+        self.__set_port_rate__(old_baud_rate)
+
+        return False
+
+    def __set_flow_control__(self, use_flow_control):
+        """
+        Turns RTS/CTS on, or off, at both ends.
+        """
+
+        if use_flow_control:
+            command = FLOW_CONTROL_COMMAND
+        else:
+            command = NO_FLOW_CONTROL_COMMAND
+
+        is_ok = AtCommandEngine(self.__serial_connection__).execute(
+            command, PROBE_TIMEOUT).is_ok()
+
+        if use_flow_control and not is_ok:
+            self.__log__("BAUD: The modem refused RTS/CTS.")
+
+        self.__serial_connection__.rtscts = use_flow_control and is_ok
+
+        # Without the RTS/CTS lines wired, nothing gets through.
+        if self.__serial_connection__.rtscts and not self.__probe__():
+            self.__log__("BAUD: No answer with RTS/CTS, turning it off.")
+            self.__serial_connection__.rtscts = False
+            AtCommandEngine(self.__serial_connection__).execute(
+                NO_FLOW_CONTROL_COMMAND, PROBE_TIMEOUT)
+
+    def __probe__(self):
+        """
+        Returns True if the modem answers a plain AT.
+        """
+
+        return AtCommandEngine(self.__serial_connection__).execute(
+            "AT", PROBE_TIMEOUT).is_ok()
+
+    def __set_port_rate__(self, baud_rate):
+        """
+        Changes the rate at our end, dropping anything
+        that was read at the old one.
+        """
+
+        if self.__serial_connection__.baudrate != baud_rate:
+            self.__serial_connection__.baudrate = baud_rate
+
+        self.__serial_connection__.flushInput()
+
+    def __log__(self, message):
+        """
+        Logs, if there is a logger.
+        """
+
+        if self.__logger__ is not None:
+            self.__logger__.log_info_message(message)
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+class FakeModemPort(object):
+    """
+    A modem on a port. It only understands us when both
+    ends are at the same rate (or it is still autobauding),
+    and its replies are garbled above the fastest working rate.
+    """
+
+    def write(self, data):
+        command = data.strip()
+
+        if self.modem_rate is not None and self.modem_rate != self.baudrate:
+            self.waiting += "\xff\x00"
+            return len(data)
+
+        if self.baudrate > self.fastest_working_rate:
+            self.waiting += "\r\nO\xff\r\n"
+        else:
+            self.waiting += "\r\nOK\r\n"
+
+        if command.startswith("AT+IPR="):
+            self.modem_rate = int(command.partition("=")[2])
+        elif command.startswith("AT+IFC="):
+            self.modem_flow_control = command
+
+        return len(data)
+
+    def inWaiting(self):
+        return len(self.waiting)
+
+    def read(self, size=1):
+        data = self.waiting[:size]
+        self.waiting = self.waiting[size:]
+
+        return data
+
+    def flushInput(self):
+        self.waiting = ""
+
+    def __init__(self, baudrate, fastest_working_rate, modem_rate=None):
+        self.baudrate = baudrate
+        self.fastest_working_rate = fastest_working_rate
+        self.modem_rate = modem_rate
+        self.modem_flow_control = None
+        self.rtscts = False
+        self.waiting = ""
+
+
+def test_negotiates_up_and_saves():
+    """
+    An autobauding modem is moved to the target rate,
+    and the rate is saved for next time.
+    """
+
+    import tempfile
+
+    state_filename = tempfile.mktemp()
+    port = FakeModemPort(9600, 115200)
+
+    assert BaudRateNegotiator(port, state_filename=state_filename).negotiate(115200, True) == 115200
+    assert port.baudrate == 115200
+    assert port.rtscts
+    assert port.modem_flow_control == FLOW_CONTROL_COMMAND
+    assert load_baud_rate(state_filename) == 115200
+
+    os.remove(state_filename)
+
+
+def test_falls_back_to_a_rate_that_works():
+    """
+    A rate the link cannot hold is abandoned for
+    the next one down.
+    """
+
+    port = FakeModemPort(9600, 57600)
+
+    assert BaudRateNegotiator(port).negotiate(115200) == 57600
+    assert port.baudrate == 57600
+    assert port.modem_rate == 57600
+    assert not port.rtscts
+
+
+def test_finds_a_modem_left_at_another_rate():
+    """
+    A modem left at a fixed rate is found there.
+    """
+
+    port = FakeModemPort(9600, 115200, 38400)
+
+    assert BaudRateNegotiator(port).negotiate(38400) == 38400
+    assert BaudRateNegotiator(FakeModemPort(9600, 0, 38400)).negotiate(38400) is None
+
+
+if __name__ == '__main__':
+    print "Starting tests."
+
+    test_negotiates_up_and_saves()
+    test_falls_back_to_a_rate_that_works()
+    test_finds_a_modem_left_at_another_rate()
+
+    print "Tests finished"
@@ -0,0 +1,268 @@
+"""
+Module for a lightweight, in-process publish/subscribe bus.
+
+Events are plain objects, so nothing is pickled,
+there is no pipe, and there is no feeder thread.
+"""
+
+import collections
+import threading
+import utilities
+
+DEFAULT_SUBSCRIPTION_CAPACITY = 64
+
+
+class Event(object):
+    """
+    Base class for everything published on the bus.
+    Subclasses set TOPIC, which is what subscribers filter on.
+    """
+
+    __slots__ = ('created_time',)
+
+    TOPIC = None
+
+    def __init__(self):
+        self.created_time = utilities.get_monotonic_time()
+
+
+class Subscription(object):
+    """
+    A bounded, first-in first-out inbox of events
+    for the topics it was subscribed to.
+
+    When the inbox is full the oldest event is dropped,
+    so a slow consumer always sees the most recent state.
+    With a capacity of None nothing is ever dropped.
+    """
+
+    def get(self):
+        """
+        Returns the oldest event, or None if there are none.
+        """
+
+        try:
+            return self.__events__.popleft()
+        except IndexError:
+            return None
+
+    def drain(self):
+        """
+        Removes and returns all of the pending events, oldest first.
+        """
+
+        events = []
+
+        while True:
+            event = self.get()
+
+            if event is None:
+                return events
+
+            events.append(event)
+
+    def empty(self):
+        """
+        Returns True if there are no pending events.
+        """
+
+        return len(self.__events__) == 0
+
+    def qsize(self):
+        """
+        Returns the number of pending events.
+        """
+
+        return len(self.__events__)
+
+    def get_dropped_count(self):
+        """
+        Returns how many events were dropped because
+        the subscription was full.
+        """
+
+        return self.__dropped_count__
+
+    def __init__(self, topics, capacity=DEFAULT_SUBSCRIPTION_CAPACITY):
+        self.topics = topics
+        self.capacity = capacity
+        self.__lock__ = threading.Lock()
+        self.__events__ = collections.deque()
+        self.__dropped_count__ = 0
+
+    def __deliver__(self, event):
+        """
+        Adds the event to the inbox.
+        """
+
+        self.__lock__.acquire()
+        try:
+            if self.capacity is not None and len(self.__events__) >= self.capacity:
+                self.__events__.popleft()
+                self.__dropped_count__ += 1
+
+            self.__events__.append(event)
+        finally:
+            self.__lock__.release()
+
+
+class EventBus(object):
+    """
+    Routes published events to the subscriptions
+    for the event's topic.
+    """
+
+    def subscribe(self, event_types, capacity=DEFAULT_SUBSCRIPTION_CAPACITY):
+        """
+        Creates a subscription for the given event classes.
+        A capacity of None is unbounded.
+        """
+
+        if not isinstance(event_types, (list, tuple)):
+            event_types = [event_types]
+
+        topics = [event_type.TOPIC for event_type in event_types]
+        subscription = Subscription(topics, capacity)
+
+        self.__lock__.acquire()
+        try:
+            for topic in topics:
+                self.__subscriptions__.setdefault(topic, []).append(subscription)
+        finally:
+            self.__lock__.release()
+
+        return subscription
+
+    def publish(self, event):
+        """
+        Delivers the event to every subscription for its topic,
+        then wakes the service loop.
+        Returns the number of subscriptions that received it.
+        """
+
+        subscriptions = self.__subscriptions__.get(event.TOPIC, [])
+
+        for subscription in subscriptions:
+            subscription.__deliver__(event)
+
+        if self.__wakeup_event__ is not None:
+            self.__wakeup_event__.signal(event.TOPIC)
+
+        return len(subscriptions)
+
+    def __init__(self, wakeup_event=None):
+        """
+        Creates a bus.
+        If a wakeup event is given, it is signaled on every publish.
+        """
+
+        self.__wakeup_event__ = wakeup_event
+        self.__lock__ = threading.Lock()
+        self.__subscriptions__ = {}
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+class __TestEvent__(Event):
+    """
+    Event used by the tests.
+    """
+    __slots__ = ('value',)
+    TOPIC = "test"
+
+    def __init__(self, value):
+        Event.__init__(self)
+        self.value = value
+
+
+def test_topic_filtering():
+    """
+    Only subscribers to the topic receive the event.
+    """
+
+    class OtherEvent(Event):
+        """ A different topic. """
+        __slots__ = ()
+        TOPIC = "other"
+
+    bus = EventBus()
+    test_subscription = bus.subscribe(__TestEvent__)
+    other_subscription = bus.subscribe(OtherEvent)
+
+    assert bus.publish(__TestEvent__(1)) == 1
+    assert test_subscription.get().value == 1
+    assert other_subscription.empty()
+
+
+def test_capacity():
+    """
+    A full subscription drops the oldest event,
+    unless it is unbounded.
+    """
+
+    bus = EventBus()
+    subscription = bus.subscribe(__TestEvent__, 2)
+
+    for value in range(3):
+        bus.publish(__TestEvent__(value))
+
+    assert [event.value for event in subscription.drain()] == [1, 2]
+    assert subscription.get_dropped_count() == 1
+
+    subscription = bus.subscribe(__TestEvent__, None)
+
+    for value in range(DEFAULT_SUBSCRIPTION_CAPACITY + 1):
+        bus.publish(__TestEvent__(value))
+
+    assert subscription.qsize() == DEFAULT_SUBSCRIPTION_CAPACITY + 1
+    assert subscription.get_dropped_count() == 0
+
+
+def __benchmark__(event_count=100000):
+    """
+    Measures the cost of passing an event from a producer
+    to a consumer using a multiprocessing Queue, a Queue.Queue,
+    and the bus.
+    """
+
+    import time
+    import Queue
+    from multiprocessing import Queue as MPQueue
+
+    def time_queue(queue):
+        start_time = time.time()
+        for value in xrange(event_count):
+            queue.put("Gas warning, level=" + str(value))
+            queue.get()
+        return time.time() - start_time
+
+    def time_bus():
+        bus = EventBus()
+        subscription = bus.subscribe(__TestEvent__, event_count)
+        start_time = time.time()
+        for value in xrange(event_count):
+            bus.publish(__TestEvent__(value))
+            subscription.get()
+        return time.time() - start_time
+
+    results = [["multiprocessing.Queue", time_queue(MPQueue())],
+               ["Queue.Queue", time_queue(Queue.Queue())],
+               ["EventBus", time_bus()]]
+
+    for name, elapsed in results:
+        print name + ": " + str(round((elapsed / event_count) * 1000000.0, 2)) \
+            + " usec/event"
+
+
+if __name__ == '__main__':
+    print "Starting tests."
+
+    test_topic_filtering()
+    test_capacity()
+
+    print "Tests finished"
+
+    __benchmark__()
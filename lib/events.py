@@ -0,0 +1,114 @@
+"""
+Module to hold the typed events that the parts
+of the HangarBuddy send each other over the EventBus.
+"""
+
+from event_bus import Event
+
+
+class GasReadingEvent(Event):
+    """
+    A new reading from the gas sensor.
+    """
+
+    __slots__ = ('is_gas_detected', 'level')
+
+    TOPIC = "gas_reading"
+
+    def __init__(self, is_gas_detected, level):
+        Event.__init__(self)
+        self.is_gas_detected = is_gas_detected
+        self.level = level
+
+
+class HeaterCommandEvent(Event):
+    """
+    A request for the relay to change state.
+    The command is text.HEATER_ON_COMMAND,
+    text.HEATER_OFF_COMMAND, or text.MAX_TIME.
+    """
+
+    __slots__ = ('command',)
+
+    TOPIC = "heater_command"
+
+    def __init__(self, command):
+        Event.__init__(self)
+        self.command = command
+
+
+class MessageWaitingEvent(Event):
+    """
+    There may be a text message waiting on the modem.
+    The source says what noticed it ("POLL", "RI:18", ...).
+    """
+
+    __slots__ = ('source',)
+
+    TOPIC = "message_waiting"
+
+    def __init__(self, source):
+        Event.__init__(self)
+        self.source = source
+
+
+class StatusCheckEvent(Event):
+    """
+    A request to refresh a piece of the modem status.
+    The check is text.CHECK_BATTERY or text.CHECK_SIGNAL.
+    """
+
+    __slots__ = ('check',)
+
+    TOPIC = "status_check"
+
+    def __init__(self, check):
+        Event.__init__(self)
+        self.check = check
+
+
+class MessagesReadEvent(Event):
+    """
+    The text messages read from the modem on the
+    modem thread, for the service loop to process.
+    The list may be empty.
+    """
+
+    __slots__ = ('messages',)
+
+    TOPIC = "messages_read"
+
+    def __init__(self, messages):
+        Event.__init__(self)
+        self.messages = messages
+
+
+class OutboundMessageEvent(Event):
+    """
+    A text message that needs to be sent.
+    The priority is a modem_scheduler priority.
+    The journal ids are its records in the outbound
+    journal, more than one once messages are merged.
+    The deadline is the monotonic time after which it
+    is not worth sending, or None to send it whenever.
+    """
+
+    __slots__ = ('phone_number', 'text_message', 'retries_remaining', 'priority',
+                 'journal_ids', 'deadline', 'attempt_count')
+
+    TOPIC = "outbound_message"
+
+    def __init__(self, phone_number, text_message, retries_remaining, priority,
+                 journal_ids=None, deadline=None):
+        Event.__init__(self)
+
+        if journal_ids is None:
+            journal_ids = []
+
+        self.phone_number = phone_number
+        self.text_message = text_message
+        self.retries_remaining = retries_remaining
+        self.priority = priority
+        self.journal_ids = journal_ids
+        self.deadline = deadline
+        self.attempt_count = 0
@@ -1,25 +1,60 @@
 """
 Module to help with tha AdaFruit Fona modules
 """
+import sys
 import time
 import threading
-from multiprocessing import Queue as MPQueue
+import collections
 import datetime
 import local_debug
 import utilities
 from logger import Logger
+from recurring_task import RecurringTask, COALESCE
+from event_bus import EventBus
+from events import MessageWaitingEvent
+import at_command
+from at_command import AtCommandEngine, AtResult
+from task_metrics import Histogram
+from modem_session import ModemSession
+from sms_pdu import DeliverPdu, MultipartAssembler, encode_submit_pdus
+from sms_message import SmsMessage, parse_message_listing, create_delivered_message, \
+    create_stored_message, create_pdu_message
+from serial_reader import DEFAULT_QUIET_INTERVAL
+from urc_dispatcher import SerialListener, UrcDispatcher, LISTEN_TIMEOUT, \
+    NewMessageUrc, MessageUrc, RingUrc, StatusReportUrc, UnderVoltageUrc, ModemStatusUrc
 
 if not local_debug.is_debug():
     import RPi.GPIO as GPIO
 
-SECONDS_TO_WAIT_AFTER_SEND = 5
 BATTERY_CRITICAL = 40
 BATTERY_WARNING = 60
 DEFAULT_RESPONSE_READ_TIMEOUT = 5
 
 DEFAULT_RING_INDICATOR_PIN = 18  # (Physical... GPIO24)
 DEFAULT_POWER_STATUS_PIN = 16  # (Physical ..GPIO23)
-TIMEZONE_OFFSET = 8
+POLL_FOR_MESSAGES_INTERVAL = 60
+
+# Ends the text of a message, or abandons it.
+CTRL_Z = '\x1a'
+ESCAPE = '\x1b'
+
+# The settings everything else relies on.
+ECHO_OFF_COMMAND = "ATE0"
+TEXT_MODE_COMMAND = "AT+CMGF=1"
+PDU_MODE_COMMAND = "AT+CMGF=0"
+SIM_STORAGE_COMMAND = 'AT+CPMS="SM","SM","SM"'
+
+# New messages are handed straight to us as +CMT, and never stored.
+DIRECT_DELIVERY_COMMAND = "AT+CNMI=2,2,0,0,0"
+# New messages are stored on the SIM, and announced with +CMTI.
+STORED_DELIVERY_COMMAND = "AT+CNMI=2,1,0,0,0"
+# Parts of a long message that never finish arriving are dropped.
+MULTIPART_TIMEOUT_HOURS = 24
+
+# Wake up reasons. Only the poll means the whole SIM has to be listed.
+DIRECT_DELIVERY_REASON = "CMT"
+NEW_MESSAGE_REASON = "CMTI:"
+RING_INDICATOR_REASON = "RI:"
 
 
 class BatteryCondition(object):
@@ -39,6 +74,19 @@ class BatteryCondition(object):
         """
         return self.battery_voltage
 
+    def get_volts_text(self):
+        """
+        Returns the voltage in volts, as the status shows it.
+        The voltage is kept in hundredths of a volt.
+
+        >>> BatteryCondition("+CBC: 0,95,4200").get_volts_text()
+        '4.2'
+        >>> BatteryCondition("+CBC: 0,60,3712").get_volts_text()
+        '3.71'
+        """
+
+        return str(round(self.get_voltage() / 100.0, 2))
+
     def is_battery_ok(self):
         """
         Is the battery OK?
@@ -129,81 +177,6 @@ class SignalStrength(object):
             self.bit_error_rate = 0
 
 
-class SmsMessage(object):
-    """
-    Class to abstract a text message.
-    """
-
-    def get_sender_number(self):
-        """
-        Gets the sender's number.
-        """
-        if self.is_message_ok():
-            return utilities.get_cleaned_phone_number(self.sender_number)
-
-        return None
-
-    def is_message_ok(self):
-        """
-        Is the message valid?
-        """
-        return not self.error_state
-
-    def minutes_waiting(self):
-        """
-        How many hours between being sent
-        and received.
-        """
-
-        return (self.received_time
-                - (self.sent_time + datetime.timedelta(hours=TIMEZONE_OFFSET))).days * 24 * 60
-
-    def message_sent_time_utc(self):
-        """
-        When was the message sent in UTC time?
-        The SIM card returns time as Local...
-        """
-
-        return (self.sent_time + datetime.timedelta(hours=TIMEZONE_OFFSET))
-
-    def __init__(self,
-                 message_header,
-                 message_text):
-        """
-        Create the object.
-        """
-        self.message_id = None
-        self.sender_number = None
-        self.message_status = None
-        self.message_text = None
-        self.received_time = datetime.datetime.now()
-        self.sent_time = None
-
-        try:
-            metadata_list = message_header.split(",")
-            message_id = metadata_list[0]
-            message_id = message_id.rpartition(":")[2].strip()
-            message_status = metadata_list[1]
-            sender_number = metadata_list[2]
-            message_date = metadata_list[4].replace('"', '')
-            date_tokens = message_date.split('/')
-            message_time = metadata_list[5].split('-')[0]
-            time_tokens = message_time.split(':')
-
-            self.message_id = message_id
-            self.sent_time = datetime.datetime.combine(
-                datetime.datetime(
-                    int("20" + date_tokens[0]), int(date_tokens[1]), int(date_tokens[2])),
-                datetime.time(
-                    int(time_tokens[0]), int(time_tokens[1]), int(time_tokens[2])))
-            self.sender_number = sender_number
-            self.message_status = message_status
-            self.message_text = message_text
-            self.error_state = False
-        except:
-            self.error_state = True
-
-
 class Fona(object):
     """
     Class that send messages with an Adafruit Fona
@@ -236,84 +209,160 @@ class Fona(object):
         Uses the GPIO pin to see if a message is waiting.
         """
 
-        return not self.__message_waiting_queue__.empty()
+        return not self.__message_waiting_subscription__.empty()
 
     def get_carrier(self):
         """
         Returns the carrier.
         """
-        return self.__send_command__("AT+COPS?")
+        return self.__send_command__("AT+COPS?").lines
 
     def get_signal_strength(self):
         """
         Returns an object representing the signal strength.
         """
         command_result = self.__send_command__("AT+CSQ")
-        if command_result is None or len(command_result) < 2:
-            command_result = None
-        else:
-            command_result = command_result[1]
 
-        return SignalStrength(command_result)
+        return SignalStrength(command_result.get_line("+CSQ:"))
 
     def get_current_battery_condition(self):
         """
         Returns an object representing the current battery state.
         """
         self.__logger__.log_info_message("Sending CBC command")
-        time.sleep(5)
         command_result = self.__send_command__("AT+CBC")
 
-        for result in command_result:
-            if "CBC:" in result:
-                return BatteryCondition(result)
-
-        return BatteryCondition(None)
+        return BatteryCondition(command_result.get_line("+CBC:"))
 
     def get_module_name(self):
         """
         Returns the name of the GSM module.
         """
-        return self.__send_command__("ATI")
+        return self.__send_command__("ATI").lines
 
     def get_sim_card_number(self):
         """
         Returns the id of the sim card.
         """
-        return self.__send_command__("AT+CCID")
+        return self.__send_command__("AT+CCID").lines
 
     def send_message(self, message_num, text):
         """
         Sends a message to the specified phone numbers.
+        Waits for the modem's "> " prompt, and then for it
+        to confirm the message was handed to the network.
+        Returns the message reference, or None if it was not sent.
         """
 
         cleaned_number = utilities.get_cleaned_phone_number(message_num)
 
         if cleaned_number is None or text is None:
-            return
+            return None
 
-        self.__logger__.log_info_message("Setting receiving number...")
-        self.__set_sms_mode__()
-        self.__write_to_fona__('\r\r\n')
-        self.__logger__.log_info_message("Wait for resp:")
-        if self.__wait_for_command_response__:
-            self.__logger__.log_info_message(self.__read_from_fona__(5))
-        self.__write_to_fona__('AT+CMGS="' + cleaned_number + '"')
-        self.__logger__.log_info_message("Wait for resp 2:")
-        self.__wait_for_command_response__()
-        self.__logger__.log_info_message(self.__read_from_fona__(5))
-        self.__write_to_fona__('\r')
-        self.__wait_for_command_response__()
-        self.__logger__.log_info_message(self.__read_from_fona__(5))
-        self.__logger__.log_info_message(self.__write_to_fona__(text + '\x1a'))
-        self.__wait_for_command_response__()
-
-        self.__logger__.log_info_message(self.__read_from_fona__(2))
-        self.__logger__.log_info_message("Check phone")
+        start_time = utilities.get_monotonic_time()
 
-        return True
+        self.__configure_modem__()
+
+        if self.__is_pdu_mode__:
+            send_result = self.__send_pdu_message__(cleaned_number, text)
+        else:
+            send_result = self.__send_with_prompt__('AT+CMGS="' + cleaned_number + '"', text)
+
+        send_duration = utilities.get_monotonic_time() - start_time
+
+        try:
+            message_reference = int(send_result.get_line("+CMGS:").partition(":")[2])
+        except:
+            message_reference = None
+
+        if not send_result.is_ok() or message_reference is None:
+            self.__send_failure_count__ += 1
+            self.__logger__.log_warning_message(
+                "Message to " + cleaned_number + " was not sent: " + str(send_result))
+
+            return None
+
+        self.__send_latency__.add(send_duration)
+        self.__logger__.log_info_message(
+            "Message to " + cleaned_number + " sent as " + str(message_reference)
+            + " in " + str(round(send_duration, 3)) + "s")
+
+        return message_reference
+
+    def get_send_latency(self):
+        """
+        Returns the Histogram of how long each
+        message that was sent took to send.
+        """
+
+        return self.__send_latency__
+
+    def get_send_failure_count(self):
+        """
+        Returns how many messages could not be sent.
+        """
+
+        return self.__send_failure_count__
+
+    def is_direct_delivery_enabled(self):
+        """
+        Returns True if new messages are handed to us
+        as +CMT instead of being stored on the SIM.
+        """
+
+        return self.__is_direct_delivery_enabled__
 
     def get_messages(self):
+        """
+        Returns the messages that were delivered straight
+        to us, and reads the new text messages on the SIM card.
+        Only the messages announced by +CMTI are read, so a
+        delivered message costs no commands at all, and a stored
+        one costs a single AT+CMGR however full the SIM is.
+        """
+
+        # The reasons come first, so every message whose
+        # reason was taken is taken with it.
+        reasons = self.__clear_messages_waiting_queue__()
+        messages = self.__take_delivered_messages__()
+        announced_indexes = self.__take_announced_indexes__()
+
+        if self.__is_listing_needed__(reasons):
+            if self.__get_stored_message_count__() == 0:
+                return messages
+
+            return messages + self.__read_stored_messages__()
+
+        return messages + self.__read_announced_messages__(announced_indexes)
+
+    def return_messages(self, messages):
+        """
+        Puts back messages that were taken, but not processed.
+        A delivered message has no copy on the SIM, so it is
+        kept here and handed out first by the next get_messages().
+        A stored message is still on the SIM, so its indexes are
+        announced again, and the next get_messages() reads it
+        without waiting for the poll to list the SIM.
+        """
+
+        delivered_messages = [message for message in messages
+                              if message.message_id is None]
+        stored_indexes = []
+
+        for message in messages:
+            if message.message_id is not None:
+                stored_indexes += [int(message_id) for message_id
+                                   in [message.message_id] + message.part_ids]
+
+        if delivered_messages:
+            self.__returned_messages__.extendleft(reversed(delivered_messages))
+            self.__signal_message_waiting__(DIRECT_DELIVERY_REASON)
+
+        if stored_indexes:
+            self.__announced_indexes__.extendleft(reversed(stored_indexes))
+            self.__signal_message_waiting__(NEW_MESSAGE_REASON + str(stored_indexes[0]))
+
+    def __read_stored_messages__(self):
         """
         Reads text messages on the SIM card and returns
         a list of messages with three fields: id, num, message.
@@ -324,44 +373,97 @@ class Fona(object):
 
         # put into SMS mode
 
-        self.__set_sms_mode__()
-        # get all text messages currently on SIM Card
-        self.serial_connection.write('AT+CMGL="ALL"\r')
-        time.sleep(3)
-        messages = []
-        while self.serial_connection.inWaiting() > 0:
-            message_header = self.serial_connection.readline().strip()
-            if "+CMGL:" in message_header:
-                message_text = self.serial_connection.readline().strip()
-
-                new_message = SmsMessage(message_header,
-                                         message_text)
-                messages.append(new_message)
+        self.__configure_modem__()
 
-                time.sleep(1)
+        if self.__is_pdu_mode__:
+            return self.__list_stored_pdu_messages__()
 
-        self.__clear_messages_waiting_queue__()
+        # get all text messages currently on SIM Card
+        message_lines = self.__send_command__('AT+CMGL="ALL"').lines
 
-        return messages
+        return parse_message_listing("\n".join(message_lines))
 
     def delete_message(self, message_to_delete):
         """
         Deletes a message with the given Id.
+        Delivered messages were never stored, so there
+        is nothing to delete.
         """
+
+        if message_to_delete.message_id is None:
+            return
+
         self.__send_command__("AT+CMGD=" + str(message_to_delete.message_id))
 
+        for part_id in message_to_delete.part_ids:
+            self.__send_command__("AT+CMGD=" + str(part_id))
+
     def delete_messages(self):
-        """ Deletes any messages. """
-        messages = self.get_messages()
-        messages_deleted = 0
-        for message_to_delete in messages:
-            messages_deleted += 1
+        """
+        Deletes any messages.
+        Returns how many there were.
+        """
+
+        self.__clear_messages_waiting_queue__()
+        self.__take_announced_indexes__()
+        messages_deleted = len(self.__take_delivered_messages__())
+        stored_count = self.__get_stored_message_count__()
+
+        if stored_count is None:
+            stored_messages = self.__read_stored_messages__()
+            stored_count = len(stored_messages)
+        else:
+            stored_messages = None
+
+        if stored_count == 0 or self.__delete_stored_messages__():
+            return messages_deleted + stored_count
+
+        # Neither bulk delete is supported; one at a time it is.
+        if stored_messages is None:
+            stored_messages = self.__read_stored_messages__()
+
+        for message_to_delete in stored_messages:
             self.delete_message(message_to_delete)
 
-        if local_debug.is_debug():
-            self.__clear_messages_waiting_queue__()
+        return messages_deleted + len(stored_messages)
+
+    def close(self):
+        """
+        Stops polling for messages, releases the ring
+        indicator, and closes the serial connection.
+        """
+
+        self.__poll_for_messages_task__.cancel()
+
+        if self.__use_gpio_pins__() and not local_debug.is_debug():
+            GPIO.remove_event_detect(self.ring_indicator_pin)
 
-        return messages_deleted
+        # Nobody will be listening for +CMT, so have messages
+        # kept on the SIM for the next start instead of lost.
+        if self.__is_direct_delivery_enabled__:
+            self.__modem_session__.configure(STORED_DELIVERY_COMMAND)
+            self.__is_direct_delivery_enabled__ = False
+
+        self.__serial_listener__.stop(LISTEN_TIMEOUT * 2)
+
+        if self.serial_connection is not None:
+            self.__modem_access_lock__.acquire(True)
+            try:
+                self.serial_connection.close()
+                self.serial_connection = None
+                self.__at_engine__ = AtCommandEngine(None, self.__logger__)
+            finally:
+                self.__modem_access_lock__.release()
+
+    def add_urc_handler(self, urc_type, handler):
+        """
+        Calls the handler with every URC of the type,
+        such as urc_dispatcher.ModemStatusUrc.
+        Handlers run on the listener thread and must
+        not send commands to the Fona.
+        """
+
+        self.__urc_dispatcher__.add_handler(urc_type, handler)
 
     def simple_terminal(self):
         """
@@ -393,28 +495,76 @@ class Fona(object):
                  logger,
                  serial_connection,
                  power_status_pin,
-                 ring_indicator_pin):
+                 ring_indicator_pin,
+                 event_bus=None,
+                 direct_delivery=False,
+                 pdu_mode=False):
+
+        if event_bus is None:
+            event_bus = EventBus()
 
         self.__logger__ = logger
+        self.__event_bus__ = event_bus
         self.__modem_access_lock__ = threading.Lock()
         self.serial_connection = serial_connection
         self.power_status_pin = power_status_pin
         self.ring_indicator_pin = ring_indicator_pin
+        self.__message_waiting_subscription__ = self.__event_bus__.subscribe(
+            MessageWaitingEvent)
+        self.__send_latency__ = Histogram()
+        self.__send_failure_count__ = 0
+        self.__delivered_messages__ = collections.deque()
+        self.__returned_messages__ = collections.deque()
+        self.__announced_indexes__ = collections.deque()
+        self.__is_direct_delivery_enabled__ = False
+        self.__are_new_messages_announced__ = False
+        self.__new_message_indication_command__ = None
+        self.__error_reporting_command__ = "AT+CMEE=0"
+        self.__is_pdu_mode__ = pdu_mode
+        self.__multipart_assembler__ = MultipartAssembler()
+        self.__concatenation_reference__ = 0
+
+        if pdu_mode:
+            self.__message_format_command__ = PDU_MODE_COMMAND
+        else:
+            self.__message_format_command__ = TEXT_MODE_COMMAND
 
         if self.serial_connection is not None:
             self.serial_connection.flushInput()
             self.serial_connection.flushOutput()
 
+        # The listener is the only thing that reads from the modem.
+        # It hands URCs to the dispatcher, and replies to the engine.
+        self.__urc_dispatcher__ = UrcDispatcher(logger)
+        self.__serial_listener__ = SerialListener(serial_connection,
+                                                  self.__urc_dispatcher__,
+                                                  logger,
+                                                  read_failure_handler=self.__on_read_failure__)
+        self.__at_engine__ = AtCommandEngine(serial_connection, logger,
+                                             self.__serial_listener__)
+        self.__modem_session__ = ModemSession(self.__send_command__)
+        self.__initialize_urc_handlers__()
+        self.__serial_listener__.start()
+
         self.__send_command__("AT")
-        # self.send_command("AE0")
-        self.__disable_verbose_errors__()
-        self.__set_sms_mode__()
+        self.__configure_modem__()
+
+        if direct_delivery:
+            self.__enable_direct_delivery__()
+
+        if not self.__is_direct_delivery_enabled__:
+            self.__enable_stored_delivery__()
 
         self.__read_from_fona__(10)
 
-        self.__message_waiting_queue__ = MPQueue()
         self.__initialize_gpio_pins__()
-        self.__poll_for_messages__()
+        # A missed poll runs once right away, so a
+        # command is not left waiting for the next one.
+        self.__poll_for_messages_task__ = RecurringTask("poll_for_messages",
+                                                        POLL_FOR_MESSAGES_INTERVAL,
+                                                        self.__poll_for_messages__,
+                                                        self.__logger__,
+                                                        missed_run_policy=COALESCE)
 
     def __use_gpio_pins__(self):
         """
@@ -454,15 +604,109 @@ class Fona(object):
         """
         Check for messages every 60 seconds.
         """
-        self.__message_waiting_queue__.put("POLL")
-        threading.Timer(60, self.__poll_for_messages__).start()
+        self.__signal_message_waiting__("POLL")
 
     def __ring_indicator_pulsed__(self, io_pin):
         """
         The RI went from LOW to HIGH.
         That means a message.
         """
-        self.__message_waiting_queue__.put("RI:" + str(io_pin))
+        self.__signal_message_waiting__(RING_INDICATOR_REASON + str(io_pin))
+
+    def __initialize_urc_handlers__(self):
+        """
+        Reacts to what the modem tells us on its own.
+        """
+
+        self.add_urc_handler(NewMessageUrc, self.__on_new_message__)
+        self.add_urc_handler(MessageUrc, self.__on_message__)
+        self.add_urc_handler(RingUrc, self.__on_ring__)
+        self.add_urc_handler(StatusReportUrc, self.__on_status_report__)
+        self.add_urc_handler(UnderVoltageUrc, self.__on_under_voltage__)
+        self.add_urc_handler(ModemStatusUrc, self.__on_modem_status__)
+
+    def __on_new_message__(self, urc):
+        """
+        +CMTI: A message was stored on the SIM.
+        Its index is kept so only it is read.
+        """
+
+        self.__announced_indexes__.append(urc.index)
+        self.__signal_message_waiting__(NEW_MESSAGE_REASON + str(urc.index))
+
+    def __on_message__(self, urc):
+        """
+        +CMT: A message was delivered without being stored.
+        It is kept until the next get_messages().
+        """
+
+        self.__logger__.log_info_message("URC: " + urc.line + " " + str(urc.text))
+        self.__delivered_messages__.append(urc)
+        self.__signal_message_waiting__(DIRECT_DELIVERY_REASON)
+
+    def __on_ring__(self, urc):
+        """
+        RING: A voice call, which we do not answer.
+        """
+
+        self.__logger__.log_info_message("URC: " + urc.line)
+
+    def __on_status_report__(self, urc):
+        """
+        +CDS: A delivery report for a message we sent.
+        """
+
+        self.__logger__.log_info_message(
+            "URC: Delivery report for " + str(urc.message_reference))
+
+    def __on_under_voltage__(self, urc):
+        """
+        The modem's supply is out of range.
+        """
+
+        self.__logger__.log_warning_message("URC: " + urc.line)
+
+    def __on_modem_status__(self, urc):
+        """
+        The modem started, restarted, or is turning off.
+        Either way, it no longer has our settings.
+        """
+
+        self.__logger__.log_warning_message("URC: " + urc.line)
+        self.__modem_session__.invalidate()
+
+    def __on_read_failure__(self, error_text):
+        """
+        The serial port keeps failing to read, so the
+        modem may have been unplugged. Reopens the port,
+        and has the settings sent again in case the modem
+        restarted. Called on the URC listener thread.
+        """
+
+        self.__logger__.log_warning_message(
+            "Serial port keeps failing to read:" + error_text + ", reopening it.")
+
+        self.__modem_access_lock__.acquire(True)
+        try:
+            if self.serial_connection is None:
+                return
+
+            try:
+                self.serial_connection.close()
+                self.serial_connection.open()
+            except:
+                self.__logger__.log_warning_message(
+                    "Unable to reopen the serial port:" + str(sys.exc_info()[1]))
+        finally:
+            self.__modem_access_lock__.release()
+
+        self.__modem_session__.invalidate()
+
+    def __signal_message_waiting__(self, reason):
+        """
+        Flags that there may be a message waiting.
+        """
+        self.__event_bus__.publish(MessageWaitingEvent(reason))
 
     def __write_to_fona__(self, text):
         """
@@ -476,142 +720,428 @@ class Fona(object):
         num_bytes_written = self.serial_connection.write(text)
         self.serial_connection.flush()
 
-        self.__logger__.log_info_message("Checking return")
         self.__logger__.log_info_message("Wrote " + str(num_bytes_written) +
                                          ", expected " + str(len(text)))
 
-        self.__wait_for_command_response__()
-
-        self.__logger__.log_info_message(
-            "Done with wait_for_command_repsonse()")
-
         return num_bytes_written
 
     def __read_from_fona__(self, response_timeout=2):
         """
         Read back from the Fona in a safe manner.
         """
-        read_buffer = ""
-        start_time = time.time()
-
         if self.serial_connection is None:
             return "NOCON"
 
         self.__logger__.log_info_message("   starting read")
-        while self.serial_connection.inWaiting() > 0:
-            read_buffer += self.serial_connection.read(1)
-            time_elapsed = time.time() - start_time
-            if time_elapsed > response_timeout:
-                self.__logger__.log_warning_message("TIMEOUT")
+        read_lines = []
+        deadline = utilities.get_monotonic_time() + response_timeout
+
+        while utilities.get_monotonic_time() < deadline:
+            line = self.__serial_listener__.get_response(DEFAULT_QUIET_INTERVAL)
+
+            if line is None:
                 break
 
+            read_lines.append(line)
+
+        read_buffer = "\n".join(read_lines)
         self.__logger__.log_info_message("   done")
         self.__logger__.log_info_message("BUFFER:" + read_buffer)
         return read_buffer
 
-    def __send_command__(self, com, add_eol=True):
-        """ send a command to the modem """
+    def __send_command__(self, command, timeout=None):
+        """
+        Sends a command to the modem and waits for
+        its final result code.
+        Returns an AtResult.
+        """
+
         self.__modem_access_lock__.acquire(True)
 
         try:
-            command = com
-            if add_eol:
-                command += '\r\r\n '
+            command_result = self.__at_engine__.execute(command, timeout)
+            self.__logger__.log_info_message(str(command_result))
 
-            if self.serial_connection is not None:
-                self.serial_connection.write(command)
-                time.sleep(2)
+            # A modem that stops answering may have been power cycled.
+            if command_result.status == at_command.TIMEOUT:
+                self.__modem_session__.invalidate()
 
-            ret = []
+            return command_result
+        except:
+            self.__logger__.log_warning_message(
+                "Exception sending " + command + ":" + str(sys.exc_info()[0]))
+        finally:
+            self.__modem_access_lock__.release()
 
-            # "Starting read/wait"
-            while self.serial_connection is not None and self.serial_connection.inWaiting() > 0:
-                msg = self.serial_connection.readline().strip()
-                msg = msg.replace("\r", "")
-                msg = msg.replace("\n", "")
-                if msg != "":
-                    self.__logger__.log_info_message(msg)
-                    ret.append(msg)
+        return AtResult(command, at_command.ERROR, [])
 
-            self.__modem_access_lock__.release()
-            return ret
+    def __send_pdu_message__(self, phone_number, text):
+        """
+        Sends the text in PDU mode, in as many parts as it takes.
+        Returns the AtResult of the last part sent.
+        """
+
+        self.__concatenation_reference__ = (self.__concatenation_reference__ + 1) % 256
+        send_result = None
+
+        for pdu_hex, pdu_length in encode_submit_pdus(phone_number, text,
+                                                      self.__concatenation_reference__):
+            send_result = self.__send_with_prompt__("AT+CMGS=" + str(pdu_length), pdu_hex)
+
+            if not send_result.is_ok():
+                break
+
+        return send_result
+
+    def __send_with_prompt__(self, command, text):
+        """
+        Runs AT+CMGS and sends the text once the modem
+        prompts for it. The lock is held throughout so that
+        no other command lands in the middle of the text.
+        Returns the AtResult of the send.
+        """
+
+        timeout = at_command.get_command_timeout(command)
+
+        self.__modem_access_lock__.acquire(True)
+
+        try:
+            command_result = self.__at_engine__.execute(command, timeout)
+
+            if not command_result.is_prompt():
+                # The prompt may still be on its way,
+                # and would swallow the next command.
+                self.__at_engine__.send_text(ESCAPE, DEFAULT_QUIET_INTERVAL)
+
+                return command_result
+
+            return self.__at_engine__.send_text(text + CTRL_Z, timeout)
         except:
+            self.__logger__.log_warning_message(
+                "Exception sending " + command + ":" + str(sys.exc_info()[0]))
+        finally:
             self.__modem_access_lock__.release()
 
-        return []
+        return AtResult(command, at_command.ERROR, [])
+
+    def __configure_modem__(self):
+        """
+        Puts every setting we rely on in place.
+        A setting the modem already has costs nothing,
+        so this is called before using the modem, and
+        puts things back after the modem restarts.
+        Returns True if every setting is in place.
+        """
+
+        if self.serial_connection is None:
+            return False
+
+        is_configured = True
+        commands = [ECHO_OFF_COMMAND,
+                    self.__error_reporting_command__,
+                    self.__message_format_command__,
+                    SIM_STORAGE_COMMAND]
+
+        if self.__new_message_indication_command__ is not None:
+            commands.append(self.__new_message_indication_command__)
+
+        for command in commands:
+            is_configured = self.__modem_session__.configure(command) and is_configured
+
+        return is_configured
 
     def __disable_verbose_errors__(self):
         """
         Disables verbose errors.
         Required for AT+CMGS to work.
         """
-        return self.__send_command__("AT+CMEE=0")
+        self.__error_reporting_command__ = "AT+CMEE=0"
+        return self.__modem_session__.configure(self.__error_reporting_command__)
 
     def __enable_verbose_errors__(self):
         """
         Enables trouble shooting errors.
         """
-        return self.__send_command__("AT+CMEE=2")
+        self.__error_reporting_command__ = "AT+CMEE=2"
+        return self.__modem_session__.configure(self.__error_reporting_command__)
+
+    def __enable_direct_delivery__(self):
+        """
+        Has new messages handed to us as +CMT instead of
+        being stored on the SIM. With the default message
+        service (AT+CSMS=0) the modem acknowledges them to
+        the network itself, so there is no AT+CNMA to send.
+        Returns True if the modem accepted it.
+        """
+
+        self.__is_direct_delivery_enabled__ = \
+            self.__modem_session__.configure(DIRECT_DELIVERY_COMMAND)
+
+        if not self.__is_direct_delivery_enabled__:
+            self.__logger__.log_warning_message(
+                "Direct message delivery refused, reading messages from the SIM.")
+
+        self.__are_new_messages_announced__ = self.__is_direct_delivery_enabled__
 
-    def __set_sms_mode__(self):
+        if self.__is_direct_delivery_enabled__:
+            self.__new_message_indication_command__ = DIRECT_DELIVERY_COMMAND
+
+        return self.__is_direct_delivery_enabled__
+
+    def __enable_stored_delivery__(self):
         """
-        Puts the card into SMS mode.
+        Has new messages stored on the SIM and announced
+        with +CMTI, so we know which index to read.
+        Returns True if the modem accepted it.
         """
-        return self.__send_command__("AT+CMGF=1")
 
-    def __read_until_text__(self, text):
+        self.__are_new_messages_announced__ = \
+            self.__modem_session__.configure(STORED_DELIVERY_COMMAND)
+
+        if not self.__are_new_messages_announced__:
+            self.__logger__.log_warning_message(
+                "New message indications refused, listing the SIM for every message.")
+        else:
+            self.__new_message_indication_command__ = STORED_DELIVERY_COMMAND
+
+        return self.__are_new_messages_announced__
+
+    def __take_announced_indexes__(self):
         """
-        Reads from the fona until the text is found.
+        Removes and returns the indexes announced by +CMTI,
+        in order and without repeats.
         """
 
-        read_text = ""
-        start_time = time.time()
+        indexes = []
 
-        while text not in read_text:
-            self.__wait_for_command_response__()
-            read_text += self.__read_from_fona__(2)
-            elapsed_time = time.time() - start_time
+        while self.__announced_indexes__:
+            index = self.__announced_indexes__.popleft()
 
-            if elapsed_time > 10:
-                self.__logger__.log_warning_message("TIMEOUT")
-                break
+            if index not in indexes:
+                indexes.append(index)
+
+        return indexes
+
+    def __read_announced_messages__(self, indexes):
+        """
+        Reads just the messages at the indexes.
+        An index that is empty by now is skipped.
+        """
+
+        if self.serial_connection is None or not indexes:
+            return []
+
+        self.__configure_modem__()
+        messages = []
+        indexed_pdus = []
+
+        for index in indexes:
+            message_lines = self.__send_command__("AT+CMGR=" + str(index)).lines
+
+            if len(message_lines) < 2 or not message_lines[0].startswith("+CMGR:"):
+                continue
 
-        return read_text
+            if self.__is_pdu_mode__:
+                indexed_pdus.append((index, message_lines[1]))
+            else:
+                messages.append(create_stored_message(index, message_lines[0], message_lines[1]))
+
+        return messages + self.__create_pdu_messages__(indexed_pdus)
 
-    def __wait_for_command_response__(self):
+    def __list_stored_pdu_messages__(self):
         """
-        Waits until the command has a response
+        Reads every message on the SIM, in PDU mode.
+        """
+
+        # 4 is "ALL" in PDU mode.
+        message_lines = self.__send_command__("AT+CMGL=4").lines
+        indexed_pdus = []
+
+        for line_index, message_header in enumerate(message_lines):
+            if message_header.startswith("+CMGL:") and line_index + 1 < len(message_lines):
+                # +CMGL: <index>,<status>,[<alpha>],<length>
+                message_index = int(message_header.partition(":")[2].split(",")[0])
+                indexed_pdus.append((message_index, message_lines[line_index + 1]))
+
+        return self.__create_pdu_messages__(indexed_pdus)
+
+    def __create_pdu_messages__(self, indexed_pdus):
+        """
+        Decodes (index, PDU) pairs into messages. The parts
+        of a long message are held until they have all
+        arrived, and then come back as one message.
+        """
+
+        messages = []
+
+        for message_index, pdu_hex in indexed_pdus:
+            try:
+                message_part = DeliverPdu(pdu_hex, message_index)
+            except:
+                # Such as a message we saved to send.
+                self.__logger__.log_info_message(
+                    "Skipping PDU " + str(message_index) + ":" + str(sys.exc_info()[1]))
+                continue
+
+            parts = self.__multipart_assembler__.add(message_part)
+
+            if parts is not None:
+                messages.append(create_pdu_message(parts))
+
+        self.__multipart_assembler__.expire(
+            datetime.datetime.utcnow() - datetime.timedelta(hours=MULTIPART_TIMEOUT_HOURS))
+
+        return messages
+
+    def __get_stored_message_count__(self):
+        """
+        Asks how many messages are on the SIM, without reading them.
+        Returns None if the modem would not say.
         """
 
         if self.serial_connection is None:
-            return False
+            return 0
 
-        start_time = time.time()
-        while time.time() - start_time < 2 and self.serial_connection.inWaiting() < 1:
-            time.sleep(0.5)
+        storage_line = self.__send_command__("AT+CPMS?").get_line("+CPMS:")
 
-        return self.serial_connection.inWaiting() > 0
+        try:
+            # +CPMS: "SM",2,30,"SM",2,30,"SM",2,30
+            return int(storage_line.partition(":")[2].split(",")[1])
+        except:
+            return None
+
+    def __delete_stored_messages__(self):
+        """
+        Deletes every message on the SIM in one command.
+        Returns False if the modem supports neither form.
+        """
+
+        if self.__send_command__("AT+CMGD=1,4").is_ok():
+            return True
+
+        return self.__send_command__('AT+CMGDA="DEL ALL"').is_ok()
+
+    def __take_delivered_messages__(self):
+        """
+        Removes and returns the messages delivered as +CMT,
+        after any that were returned unprocessed.
+        """
+
+        returned_messages = []
+        urcs = []
+
+        while self.__returned_messages__:
+            returned_messages.append(self.__returned_messages__.popleft())
+
+        while self.__delivered_messages__:
+            urcs.append(self.__delivered_messages__.popleft())
+
+        if self.__is_pdu_mode__:
+            return returned_messages \
+                + self.__create_pdu_messages__([(None, urc.text) for urc in urcs])
+
+        return returned_messages \
+            + [create_delivered_message(urc.line, urc.text) for urc in urcs]
+
+    def __is_listing_needed__(self, reasons):
+        """
+        Returns True if the whole SIM has to be listed.
+        That is only for the regular poll, which also catches
+        anything stored before startup or while we were not
+        listening, unless the modem will not announce new
+        messages at all. The ring indicator pulses for every
+        message, and is followed by the +CMT or +CMTI.
+        """
+
+        if not self.__are_new_messages_announced__:
+            return True
+
+        for reason in reasons:
+            if reason != DIRECT_DELIVERY_REASON \
+                    and not reason.startswith(NEW_MESSAGE_REASON) \
+                    and not reason.startswith(RING_INDICATOR_REASON):
+                return True
+
+        return False
 
     def __clear_messages_waiting_queue__(self):
         """
         Clears the queue that tells us if we should check for
-        messages.
+        messages. Returns why we were told to check.
         """
 
-        events_cleared = 0
-        while not self.__message_waiting_queue__.empty():
-            self.__logger__.log_info_message("Clearing queue.")
-            event = self.__message_waiting_queue__.get()
-            events_cleared += 1
-            self.__logger__.log_info_message("Q:" + event)
+        reasons = []
+        for event in self.__message_waiting_subscription__.drain():
+            reasons.append(event.source)
+            self.__logger__.log_info_message("Q:" + event.source)
+
+        return reasons
+
+
+##############
+# UNIT TESTS #
+##############
+
 
-        return events_cleared
+def test_unprocessed_delivered_messages_are_returned():
+    """
+    Two messages delivered in one batch, where only the
+    first is processed. The second has no copy on the SIM,
+    so it must come back from the next get_messages().
+    A stored message that is returned is announced again,
+    ahead of the ones announced since.
+    """
+
+    import logging
+
+    fona = Fona(Logger(logging.getLogger("test")), None, None, None)
+
+    try:
+        for text in ["ON", "OFF"]:
+            urc = MessageUrc('+CMT: "+12061234567","","18/01/20,14:05:03-32"')
+            urc.text = text
+            fona.__on_message__(urc)
+
+        messages = fona.get_messages()
+
+        assert [message.message_text for message in messages] == ["ON", "OFF"]
+        assert not fona.is_message_waiting()
+
+        fona.return_messages(messages[1:])
+
+        assert fona.is_message_waiting()
+
+        messages = fona.get_messages()
+
+        assert [message.message_text for message in messages] == ["OFF"]
+        assert messages[0].message_id is None
+        assert fona.get_messages() == []
+
+        fona.__on_new_message__(NewMessageUrc('+CMTI: "SM",5'))
+        fona.__clear_messages_waiting_queue__()
+        fona.return_messages([SmsMessage("3", message_text="OFF"),
+                              SmsMessage("4", message_text="ON")])
+
+        assert fona.is_message_waiting()
+        assert fona.__clear_messages_waiting_queue__() == [NEW_MESSAGE_REASON + "3"]
+        assert fona.__take_announced_indexes__() == [3, 4, 5]
+    finally:
+        fona.close()
 
 
 if __name__ == '__main__':
     import serial
     import logging
 
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+    test_unprocessed_delivered_messages_are_returned()
+
+    print "Tests finished"
+
     if not local_debug.is_debug():
         PHONE_NUMBER = "2067654321"  # input("Phone number>")
     else:
@@ -647,7 +1177,7 @@ if __name__ == '__main__':
             print "Message waiting.."
 
             for message in FONA.get_messages():
-                print "ID:" + message.message_id
+                print "ID:" + str(message.message_id)
                 print "SENT:" + str(message.sent_time)
                 print "Num:" + message.sender_number
                 print "Stat:" + message.message_status
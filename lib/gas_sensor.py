@@ -116,6 +116,17 @@ class GasSensor(object):
 
         return GasSensorResult(self.is_gas_detected, self.current_value)
 
+    def close(self):
+        """
+        Releases the ic2 bus.
+        """
+
+        self.enabled = False
+
+        if self.ic2_bus is not None:
+            self.ic2_bus.close()
+            self.ic2_bus = None
+
 
 if __name__ == '__main__':
     SENSOR = GasSensor()
@@ -0,0 +1,173 @@
+"""
+Module to own the shutdown of everything running in
+the background, so that a QUIT, a restart, or a stop
+from the service manager finishes in a bounded time.
+"""
+
+import sys
+import threading
+import utilities
+
+DEFAULT_STEP_TIMEOUT = 5  # Seconds
+DEFAULT_SHUTDOWN_TIMEOUT = 20  # Seconds
+
+
+class LifecycleManager(object):
+    """
+    Keeps an ordered list of shutdown steps and runs
+    them once, each with its own time limit, so that
+    one stuck step can not hang the whole shutdown.
+    """
+
+    def register(self, step_name, stop_callback, timeout=DEFAULT_STEP_TIMEOUT):
+        """
+        Adds a shutdown step.
+        Steps are run in the order they are registered.
+        """
+
+        self.__steps__.append([step_name, stop_callback, timeout])
+
+    def get_step_names(self):
+        """
+        Returns the names of the shutdown steps, in the order they run.
+        """
+
+        return [step[0] for step in self.__steps__]
+
+    def request_shutdown(self, reason):
+        """
+        Asks the service loop to stop.
+        Safe to call from any thread, or from a signal handler.
+        """
+
+        if self.__shutdown_reason__ is None:
+            self.__shutdown_reason__ = reason
+
+        self.__shutdown_requested__.set()
+
+        if self.__wakeup_event__ is not None:
+            self.__wakeup_event__.signal("SHUTDOWN")
+
+    def is_shutdown_requested(self):
+        """
+        Returns True once a shutdown has been asked for.
+        """
+
+        return self.__shutdown_requested__.is_set()
+
+    def shutdown(self, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+        """
+        Runs every shutdown step, in order.
+        Only the first call does anything.
+        Returns True if every step finished in time.
+        """
+
+        self.__lock__.acquire()
+        try:
+            if self.__is_shut_down__:
+                return True
+
+            self.__is_shut_down__ = True
+        finally:
+            self.__lock__.release()
+
+        self.__shutdown_requested__.set()
+        self.__log__("SHUTDOWN: " + str(self.__shutdown_reason__))
+
+        all_steps_finished = True
+        deadline = utilities.get_monotonic_time() + timeout
+
+        for step_name, stop_callback, step_timeout in self.__steps__:
+            time_left = deadline - utilities.get_monotonic_time()
+
+            if time_left <= 0:
+                self.__log__("SHUTDOWN: Out of time, skipping " + step_name)
+                all_steps_finished = False
+                continue
+
+            all_steps_finished &= self.__run_step__(step_name,
+                                                    stop_callback,
+                                                    min(step_timeout, time_left))
+
+        return all_steps_finished
+
+    def __init__(self, logger=None, wakeup_event=None):
+        self.__logger__ = logger
+        self.__wakeup_event__ = wakeup_event
+        self.__steps__ = []
+        self.__lock__ = threading.Lock()
+        self.__shutdown_requested__ = threading.Event()
+        self.__shutdown_reason__ = None
+        self.__is_shut_down__ = False
+
+    def __run_step__(self, step_name, stop_callback, timeout):
+        """
+        Runs a step on its own thread and waits
+        no longer than the timeout for it.
+        """
+
+        def run_stop_callback():
+            try:
+                stop_callback()
+            except:
+                self.__log__("SHUTDOWN: " + step_name + " failed:"
+                             + str(sys.exc_info()[0]))
+
+        start_time = utilities.get_monotonic_time()
+        step_thread = threading.Thread(name="shutdown_" + step_name,
+                                       target=run_stop_callback)
+        step_thread.daemon = True
+        step_thread.start()
+        step_thread.join(timeout)
+
+        elapsed = round(utilities.get_monotonic_time() - start_time, 2)
+
+        if step_thread.is_alive():
+            self.__log__("SHUTDOWN: " + step_name + " did not finish in "
+                         + str(timeout) + "s")
+            return False
+
+        self.__log__("SHUTDOWN: " + step_name + " took " + str(elapsed) + "s")
+
+        return True
+
+    def __log__(self, message):
+        """
+        Logs, if there is a logger.
+        """
+
+        if self.__logger__ is not None:
+            self.__logger__.log_warning_message(message)
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+def test_steps_run_in_order():
+    """
+    Steps run in the order they were registered, a stuck
+    step is given up on, and only the first shutdown counts.
+    """
+
+    calls = []
+    lifecycle = LifecycleManager()
+    lifecycle.register("First", lambda: calls.append("First"))
+    lifecycle.register("Stuck", threading.Event().wait, 0.1)
+    lifecycle.register("Last", lambda: calls.append("Last"))
+
+    assert lifecycle.get_step_names() == ["First", "Stuck", "Last"]
+    assert not lifecycle.shutdown()
+    assert calls == ["First", "Last"]
+    assert lifecycle.is_shutdown_requested()
+    assert lifecycle.shutdown()
+    assert calls == ["First", "Last"]
+
+
+if __name__ == '__main__':
+    print "Starting tests."
+
+    test_steps_run_in_order()
+
+    print "Tests finished"
@@ -205,6 +205,19 @@ class LightSensor(object):
             ENABLE_POWEROFF
         )
 
+    def close(self):
+        """
+        Powers the sensor down and releases the i2c bus.
+        """
+
+        try:
+            self.disable()
+        finally:
+            self.enabled = False
+
+            if not local_debug.is_debug():
+                self.bus.close()
+
     def get_full_luminosity(self):
         self.enable()
         # not sure if we need it "// Wait x ms for ADC to complete"
@@ -0,0 +1,327 @@
+"""
+Module to run everything that talks to the modem on
+a single thread, most important work first.
+
+Sends are queued one message at a time, so a long
+broadcast never holds the modem for more than one
+send before a waiting command is read.
+"""
+
+import collections
+import sys
+import threading
+import utilities
+import watchdog
+from task_metrics import Histogram
+
+SAFETY = 0  # Gas warnings
+REPLY = 1  # Answers to a command
+INBOUND = 2  # Reading and deleting incoming commands
+STATUS = 3  # Battery and signal polls
+BROADCAST = 4  # Everything else sent to every number
+
+PRIORITIES = [SAFETY, REPLY, INBOUND, STATUS, BROADCAST]
+PRIORITY_NAMES = {SAFETY: "SAFETY",
+                  REPLY: "REPLY",
+                  INBOUND: "INBOUND",
+                  STATUS: "STATUS",
+                  BROADCAST: "BROADCAST"}
+
+# After one of these, a waiting read goes before the next send.
+SEND_PRIORITIES = [SAFETY, REPLY, BROADCAST]
+
+CALL_POLL_INTERVAL = 1.0  # Seconds. Keeps a waiting caller interruptible.
+
+
+class ScheduledCommand(object):
+    """
+    A piece of modem work waiting for, or done by, the scheduler.
+    """
+
+    def wait(self, timeout=None):
+        """
+        Waits for the work to be done.
+        Returns True if it has been.
+        """
+
+        return self.__done__.wait(timeout)
+
+    def is_done(self):
+        """
+        Returns True once the work has run.
+        """
+
+        return self.__done__.is_set()
+
+    def __init__(self, priority, name, work):
+        self.priority = priority
+        self.name = name
+        self.work = work
+        self.result = None
+        self.queued_time = utilities.get_monotonic_time()
+        self.__done__ = threading.Event()
+
+    def __finish__(self, result):
+        """
+        Records the result and wakes anyone waiting.
+        """
+
+        self.result = result
+        self.__done__.set()
+
+
+class ModemScheduler(object):
+    """
+    A single thread that does all of the modem work, taking
+    the highest priority first, and the oldest first within
+    a priority. Safety work always goes first; otherwise a
+    waiting read goes ahead of the next send, so incoming
+    commands are not starved by outgoing texts.
+    """
+
+    def submit(self, priority, name, work):
+        """
+        Queues the work and returns its ScheduledCommand,
+        or None if the scheduler has been stopped.
+        """
+
+        command = ScheduledCommand(priority, name, work)
+
+        self.__condition__.acquire()
+        try:
+            if self.__is_stopped__:
+                return None
+
+            self.__queues__[priority].append(command)
+            self.__condition__.notify()
+        finally:
+            self.__condition__.release()
+
+        return command
+
+    def call(self, priority, name, work, default=None):
+        """
+        Queues the work, waits for it, and returns what it
+        returned. Returns the default if the work never ran.
+        Work already on the scheduler thread is run right away.
+        """
+
+        if threading.current_thread() is self.__thread__:
+            return work()
+
+        command = self.submit(priority, name, work)
+
+        if command is None:
+            return default
+
+        while not command.wait(CALL_POLL_INTERVAL):
+            if not self.__thread__.is_alive():
+                break
+
+        if not command.is_done():
+            return default
+
+        return command.result
+
+    def get_pending_count(self, priority=None):
+        """
+        Returns how much work is waiting, at the
+        priority or at every priority.
+        """
+
+        self.__condition__.acquire()
+        try:
+            if priority is not None:
+                return len(self.__queues__[priority])
+
+            return sum(len(queue) for queue in self.__queues__.values())
+        finally:
+            self.__condition__.release()
+
+    def stop(self, timeout=None):
+        """
+        Stops taking new work, runs what is already queued
+        until the timeout, and stops the thread.
+        Returns the ScheduledCommands that never ran.
+        """
+
+        self.__condition__.acquire()
+        try:
+            self.__is_stopped__ = True
+            self.__condition__.notify()
+        finally:
+            self.__condition__.release()
+
+        if self.__thread__ is not threading.current_thread():
+            self.__thread__.join(timeout)
+
+        self.__condition__.acquire()
+        try:
+            dropped_commands = []
+
+            for priority in PRIORITIES:
+                dropped_commands.extend(self.__queues__[priority])
+                self.__queues__[priority].clear()
+
+            return dropped_commands
+        finally:
+            self.__condition__.release()
+
+    def describe(self):
+        """
+        Returns how long work has waited for the
+        modem at each priority, suitable for the log.
+        """
+
+        return "Modem queue waits: " + ", ".join(
+            [PRIORITY_NAMES[priority] + " " + self.__queue_waits__[priority].describe()
+             for priority in PRIORITIES])
+
+    def __init__(self, logger=None, name="modem_scheduler"):
+        """
+        Creates the scheduler and starts its thread.
+        """
+
+        self.__logger__ = logger
+        self.__condition__ = threading.Condition()
+        self.__queues__ = {}
+        self.__queue_waits__ = {}
+        self.__is_stopped__ = False
+        self.__is_read_owed__ = False
+
+        for priority in PRIORITIES:
+            self.__queues__[priority] = collections.deque()
+            self.__queue_waits__[priority] = Histogram()
+
+        self.__thread__ = threading.Thread(name=name, target=self.__run__)
+        self.__thread__.daemon = True
+        self.__thread__.start()
+
+    def __run__(self):
+        """
+        The scheduler thread. Runs until it is stopped
+        and everything queued has been done.
+        """
+
+        while True:
+            command = self.__take_next__()
+
+            if command is None:
+                return
+
+            self.__queue_waits__[command.priority].add(
+                utilities.get_monotonic_time() - command.queued_time)
+
+            result = None
+            watchdog_token = watchdog.get_default_watchdog().begin("modem:" + command.name)
+
+            try:
+                result = command.work()
+            except:
+                self.__log__("Exception in modem work " + command.name + ":"
+                             + str(sys.exc_info()[0]))
+
+            watchdog.get_default_watchdog().end(watchdog_token)
+
+            if command.priority in SEND_PRIORITIES:
+                self.__is_read_owed__ = True
+            elif command.priority == INBOUND:
+                self.__is_read_owed__ = False
+
+            command.__finish__(result)
+
+    def __take_next__(self):
+        """
+        Waits for, removes, and returns the next work to do.
+        Returns None once stopped with nothing left.
+        """
+
+        self.__condition__.acquire()
+        try:
+            while True:
+                if self.__queues__[SAFETY]:
+                    return self.__queues__[SAFETY].popleft()
+
+                if self.__is_read_owed__ and self.__queues__[INBOUND]:
+                    return self.__queues__[INBOUND].popleft()
+
+                for priority in PRIORITIES:
+                    if self.__queues__[priority]:
+                        return self.__queues__[priority].popleft()
+
+                if self.__is_stopped__:
+                    return None
+
+                self.__condition__.wait()
+        finally:
+            self.__condition__.release()
+
+    def __log__(self, message):
+        """
+        Logs, if there is a logger.
+        """
+
+        if self.__logger__ is not None:
+            self.__logger__.log_warning_message(message)
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+def test_priority_order_and_fair_reads():
+    """
+    Safety goes first, and each send is followed
+    by a waiting read before the next send.
+    """
+
+    order = []
+    gate = threading.Event()
+    scheduler = ModemScheduler()
+
+    # Hold the thread while the rest is queued.
+    scheduler.submit(STATUS, "gate", gate.wait)
+
+    for index in range(3):
+        scheduler.submit(BROADCAST, "broadcast", lambda index=index: order.append("B" + str(index)))
+
+    scheduler.submit(REPLY, "reply", lambda: order.append("R"))
+    scheduler.submit(INBOUND, "read", lambda: order.append("I0"))
+    scheduler.submit(INBOUND, "read", lambda: order.append("I1"))
+    scheduler.submit(STATUS, "status", lambda: order.append("S"))
+    scheduler.submit(SAFETY, "gas", lambda: order.append("G"))
+    gate.set()
+
+    assert scheduler.call(BROADCAST, "last", lambda: len(order)) == 8
+    assert order == ["G", "I0", "R", "I1", "S", "B0", "B1", "B2"]
+    assert scheduler.stop(1.0) == []
+
+
+def test_call_and_stop():
+    """
+    A call returns the work's result, work from the
+    scheduler thread runs inline, and nothing is
+    taken once stopped.
+    """
+
+    scheduler = ModemScheduler()
+
+    assert scheduler.call(INBOUND, "read", lambda: 42) == 42
+    assert scheduler.call(INBOUND, "nested",
+                          lambda: scheduler.call(INBOUND, "inner", lambda: "inline")) == "inline"
+    assert scheduler.call(INBOUND, "raises", lambda: 1 / 0, "default") is None
+
+    scheduler.stop(1.0)
+
+    assert scheduler.submit(REPLY, "late", lambda: None) is None
+    assert scheduler.call(REPLY, "late", lambda: 1, "default") == "default"
+
+
+if __name__ == '__main__':
+    print "Starting tests."
+
+    test_priority_order_and_fair_reads()
+    test_call_and_stop()
+
+    print "Tests finished"
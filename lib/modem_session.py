@@ -0,0 +1,176 @@
+"""
+Module to remember how the modem has been configured,
+so that a setting is only sent when it would change
+something, instead of before every command.
+"""
+
+import threading
+
+
+def split_setting(command):
+    """
+    Splits a configuration command into the setting
+    it changes and the value it sets.
+
+    >>> split_setting("AT+CMGF=1")
+    ('AT+CMGF', '1')
+    >>> split_setting("ATE0")
+    ('ATE', '0')
+    """
+
+    setting, separator, value = command.partition("=")
+
+    if separator == "":
+        # Basic commands, such as ATE0, have no "=".
+        setting = command.rstrip("0123456789")
+        value = command[len(setting):]
+
+    return setting, value
+
+
+class ModemSession(object):
+    """
+    The modem's settings as we last left them.
+    Anything not known is sent; anything known to be
+    set already costs nothing.
+    """
+
+    def configure(self, command):
+        """
+        Makes sure the setting is in place, such as "AT+CMGF=1".
+        The command is only sent if the setting is unknown
+        or different. Returns True if the setting is in place.
+        """
+
+        setting, value = split_setting(command)
+
+        self.__lock__.acquire()
+        try:
+            if self.__settings__.get(setting) == value:
+                self.__saved_command_count__ += 1
+                return True
+
+            generation = self.__generation__
+        finally:
+            self.__lock__.release()
+
+        is_ok = self.__send_command__(command).is_ok()
+
+        self.__lock__.acquire()
+        try:
+            # A reset while the command was out means the
+            # setting may already have been lost again.
+            if is_ok and generation == self.__generation__:
+                self.__settings__[setting] = value
+            else:
+                self.__settings__.pop(setting, None)
+        finally:
+            self.__lock__.release()
+
+        return is_ok
+
+    def get_setting(self, setting):
+        """
+        Returns the value last set, such as "1" for
+        "AT+CMGF", or None if it is not known.
+        """
+
+        self.__lock__.acquire()
+        try:
+            return self.__settings__.get(setting)
+        finally:
+            self.__lock__.release()
+
+    def invalidate(self):
+        """
+        Forgets every setting, such as when the
+        modem has restarted and lost them.
+        Safe to call from the URC listener.
+        """
+
+        self.__lock__.acquire()
+        try:
+            self.__settings__.clear()
+            self.__generation__ += 1
+        finally:
+            self.__lock__.release()
+
+    def get_saved_command_count(self):
+        """
+        Returns how many commands did not have to be sent.
+        """
+
+        return self.__saved_command_count__
+
+    def __init__(self, send_command):
+        """
+        Send_command runs a command and returns an at_command.AtResult.
+        """
+
+        self.__send_command__ = send_command
+        self.__lock__ = threading.Lock()
+        self.__settings__ = {}
+        self.__generation__ = 0
+        self.__saved_command_count__ = 0
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+def test_known_settings_are_not_sent():
+    """
+    Only the first of the same setting is sent,
+    and a change is always sent.
+    """
+
+    from at_command import AtResult, OK
+
+    sent = []
+    session = ModemSession(lambda command: sent.append(command) or AtResult(command, OK, []))
+
+    assert session.configure("AT+CMGF=1")
+    assert session.configure("AT+CMGF=1")
+    assert session.configure("AT+CMGF=0")
+    assert session.configure("ATE0")
+    assert session.configure("ATE0")
+
+    assert sent == ["AT+CMGF=1", "AT+CMGF=0", "ATE0"]
+    assert session.get_setting("AT+CMGF") == "0"
+    assert session.get_saved_command_count() == 2
+
+
+def test_failures_and_resets_are_not_remembered():
+    """
+    A refused setting is tried again, and so is
+    everything after the modem restarts.
+    """
+
+    from at_command import AtResult, OK, ERROR
+
+    sent = []
+    results = [ERROR, OK, OK]
+    session = ModemSession(lambda command: sent.append(command)
+                           or AtResult(command, results.pop(0), []))
+
+    assert not session.configure("AT+CNMI=2,2,0,0,0")
+    assert session.configure("AT+CNMI=2,2,0,0,0")
+
+    session.invalidate()
+    assert session.get_setting("AT+CNMI") is None
+    assert session.configure("AT+CNMI=2,2,0,0,0")
+
+    assert len(sent) == 3
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+    test_known_settings_are_not_sent()
+    test_failures_and_resets_are_not_remembered()
+
+    print "Tests finished"
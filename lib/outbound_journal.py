@@ -0,0 +1,559 @@
+"""
+Module to keep the outgoing text messages on disk
+until the modem has taken them, so a crash, a restart,
+or a power blip does not lose a queued gas warning.
+
+The journal is append only, one JSON record per line:
+    ["Q", id, queued_time, phone_number, text, retries, priority, deadline_time]
+    ["S", id]  handed to the modem
+    ["A", id]  the modem took it
+    ["X", id]  given up on
+Anything queued without an "A" or "X" is sent again
+at the next start. Appends are only written to the
+file; a flusher thread fsyncs them in batches, and
+rewrites the file without the finished messages once
+enough of them have built up.
+"""
+
+import collections
+import json
+import os
+import sys
+import threading
+import time
+import utilities
+from sms_pdu import to_utf8
+
+QUEUED = "Q"
+SENT = "S"
+ACKED = "A"
+DROPPED = "X"
+
+DEFAULT_SYNC_INTERVAL = 0.2  # Seconds of appends that share one fsync
+DEFAULT_COMPACT_LINE_COUNT = 1000  # Lines before finished messages are removed
+MAXIMUM_REPLAY_AGE = 24 * 60 * 60  # Seconds. Older messages are not sent again.
+
+
+class JournalEntry(object):
+    """
+    A message that has not been finished with.
+    """
+
+    __slots__ = ["journal_id",
+                 "queued_time",
+                 "phone_number",
+                 "text_message",
+                 "retries_remaining",
+                 "priority",
+                 "deadline_time",
+                 "attempt_count"]
+
+    def to_record(self):
+        """
+        Returns the "Q" record for the entry.
+        """
+
+        return [QUEUED, self.journal_id, self.queued_time, self.phone_number,
+                self.text_message, self.retries_remaining, self.priority,
+                self.deadline_time]
+
+    def __init__(self, journal_id, queued_time, phone_number, text_message,
+                 retries_remaining, priority, deadline_time=None):
+        self.journal_id = journal_id
+        self.queued_time = queued_time
+        self.phone_number = phone_number
+        self.text_message = text_message
+        self.retries_remaining = retries_remaining
+        self.priority = priority
+        self.deadline_time = deadline_time
+        self.attempt_count = 0
+
+
+class OutboundJournal(object):
+    """
+    An on-disk log of the outgoing messages.
+    Safe to use from any thread.
+    """
+
+    def replay(self):
+        """
+        Returns the JournalEntry of every message that was
+        not finished with the last time, oldest first.
+        A message that was handed to the modem may have
+        been sent already, so it has one less retry.
+        """
+
+        self.__lock__.acquire()
+        try:
+            entries = list(self.__replayed_entries__)
+            self.__replayed_entries__ = []
+        finally:
+            self.__lock__.release()
+
+        for entry in entries:
+            entry.retries_remaining = max(1, entry.retries_remaining - entry.attempt_count)
+
+        return entries
+
+    def append(self, phone_number, text_message, retries_remaining, priority,
+               is_urgent=False, deadline_time=None):
+        """
+        Records a new message, and returns its journal id.
+        An urgent message is synced without waiting for
+        others to share the fsync. The deadline is a
+        time.time(), or None if the message has none.
+        """
+
+        self.__lock__.acquire()
+        try:
+            journal_id = self.__next_id__
+            self.__next_id__ += 1
+
+            entry = JournalEntry(journal_id, time.time(), phone_number, text_message,
+                                 retries_remaining, priority, deadline_time)
+            self.__live_entries__[journal_id] = entry
+            self.__write__(entry.to_record(), is_urgent)
+        finally:
+            self.__lock__.release()
+
+        return journal_id
+
+    def mark_sent(self, journal_ids):
+        """
+        Records that the messages were handed to the modem.
+        """
+
+        self.__mark__(SENT, journal_ids)
+
+    def mark_acked(self, journal_ids):
+        """
+        Records that the modem took the messages.
+        """
+
+        self.__mark__(ACKED, journal_ids)
+
+    def mark_dropped(self, journal_ids):
+        """
+        Records that the messages were given up on.
+        """
+
+        self.__mark__(DROPPED, journal_ids)
+
+    def get_pending_count(self):
+        """
+        Returns how many messages are not finished with.
+        """
+
+        return len(self.__live_entries__)
+
+    def get_sync_count(self):
+        """
+        Returns how many fsyncs have been done.
+        """
+
+        return self.__sync_count__
+
+    def close(self, timeout=None):
+        """
+        Syncs anything not yet on disk, and closes the file.
+        """
+
+        self.__lock__.acquire()
+        try:
+            self.__is_closed__ = True
+            self.__condition__.notify()
+        finally:
+            self.__lock__.release()
+
+        if self.__thread__ is not threading.current_thread():
+            self.__thread__.join(timeout)
+
+    def __init__(self,
+                 filename,
+                 logger=None,
+                 sync_interval=DEFAULT_SYNC_INTERVAL,
+                 compact_line_count=DEFAULT_COMPACT_LINE_COUNT):
+        """
+        Opens the journal, reading back what was left
+        last time, and starts the flusher thread.
+        """
+
+        self.__filename__ = filename
+        self.__logger__ = logger
+        self.__sync_interval__ = sync_interval
+        self.__compact_line_count__ = compact_line_count
+        self.__lock__ = threading.Lock()
+        self.__condition__ = threading.Condition(self.__lock__)
+        self.__live_entries__ = collections.OrderedDict()
+        self.__next_id__ = 1
+        self.__line_count__ = 0
+        self.__unsynced_count__ = 0
+        self.__sync_count__ = 0
+        self.__is_urgent__ = False
+        self.__is_closed__ = False
+
+        self.__load__()
+        self.__replayed_entries__ = list(self.__live_entries__.values())
+
+        # Start from a file with only the live messages in it.
+        self.__file__ = None
+        self.__compact__()
+
+        self.__thread__ = threading.Thread(name="outbound_journal", target=self.__run__)
+        self.__thread__.daemon = True
+        self.__thread__.start()
+
+    def __load__(self):
+        """
+        Reads the journal back into the live entries.
+        A line cut short by a crash is skipped.
+        """
+
+        try:
+            journal_file = open(self.__filename__)
+        except IOError:
+            return
+
+        oldest_time = time.time() - MAXIMUM_REPLAY_AGE
+        stale_count = 0
+
+        with journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                    record_type = record[0]
+                    journal_id = int(record[1])
+                except:
+                    continue
+
+                self.__next_id__ = max(self.__next_id__, journal_id + 1)
+
+                if record_type == QUEUED:
+                    entry = JournalEntry(journal_id, record[2],
+                                         to_utf8(record[3]),
+                                         to_utf8(record[4]),
+                                         record[5], record[6],
+                                         record[7] if len(record) > 7 else None)
+
+                    if entry.queued_time < oldest_time:
+                        stale_count += 1
+                    else:
+                        self.__live_entries__[journal_id] = entry
+                elif record_type == SENT and journal_id in self.__live_entries__:
+                    self.__live_entries__[journal_id].attempt_count += 1
+                elif record_type in [ACKED, DROPPED]:
+                    self.__live_entries__.pop(journal_id, None)
+
+        if stale_count > 0:
+            self.__log__("JOURNAL: Not sending " + str(stale_count)
+                         + " message(s) queued over a day ago.")
+
+    def __mark__(self, record_type, journal_ids):
+        """
+        Writes a marker for each of the messages.
+        """
+
+        self.__lock__.acquire()
+        try:
+            for journal_id in journal_ids:
+                if journal_id not in self.__live_entries__:
+                    continue
+
+                if record_type == SENT:
+                    self.__live_entries__[journal_id].attempt_count += 1
+                else:
+                    del self.__live_entries__[journal_id]
+
+                self.__write__([record_type, journal_id], False)
+        finally:
+            self.__lock__.release()
+
+    def __write__(self, record, is_urgent):
+        """
+        Appends a record. The flusher is only woken for
+        the first record of a batch, or an urgent one.
+        The caller must hold the lock.
+        """
+
+        if self.__file__ is None:
+            return
+
+        self.__file__.write(json.dumps(record) + "\n")
+        self.__line_count__ += 1
+        self.__unsynced_count__ += 1
+        self.__is_urgent__ = self.__is_urgent__ or is_urgent
+
+        if self.__unsynced_count__ == 1 or is_urgent:
+            self.__condition__.notify()
+
+    def __run__(self):
+        """
+        The flusher thread. Waits for appends, gives
+        others a moment to join them, then syncs them
+        all with one fsync.
+        """
+
+        while True:
+            self.__lock__.acquire()
+            try:
+                while self.__unsynced_count__ == 0 and not self.__is_closed__:
+                    self.__condition__.wait()
+
+                if not self.__is_urgent__ and not self.__is_closed__:
+                    self.__condition__.wait(self.__sync_interval__)
+
+                is_closed = self.__is_closed__
+            finally:
+                self.__lock__.release()
+
+            self.__sync__()
+
+            if self.__line_count__ >= self.__compact_line_count__ \
+                    and len(self.__live_entries__) * 2 < self.__line_count__:
+                self.__compact__()
+
+            if is_closed:
+                self.__lock__.acquire()
+                try:
+                    if self.__file__ is not None:
+                        self.__file__.close()
+                        self.__file__ = None
+                finally:
+                    self.__lock__.release()
+
+                return
+
+    def __sync__(self):
+        """
+        Makes everything written so far durable.
+        Appends can carry on while the fsync runs.
+        """
+
+        self.__lock__.acquire()
+        try:
+            if self.__unsynced_count__ == 0:
+                return
+
+            self.__file__.flush()
+            file_descriptor = self.__file__.fileno()
+            self.__unsynced_count__ = 0
+            self.__is_urgent__ = False
+        finally:
+            self.__lock__.release()
+
+        try:
+            os.fsync(file_descriptor)
+            self.__sync_count__ += 1
+        except:
+            self.__log__("JOURNAL: Unable to sync:" + str(sys.exc_info()[1]))
+
+    def __compact__(self):
+        """
+        Replaces the journal with one that only holds the
+        live messages. The new file is written and synced
+        before it replaces the old one, so a crash leaves
+        one or the other.
+        """
+
+        temporary_filename = self.__filename__ + ".tmp"
+
+        self.__lock__.acquire()
+        try:
+            try:
+                with open(temporary_filename, "w") as journal_file:
+                    for entry in self.__live_entries__.values():
+                        journal_file.write(json.dumps(entry.to_record()) + "\n")
+
+                        for _ in range(entry.attempt_count):
+                            journal_file.write(json.dumps([SENT, entry.journal_id]) + "\n")
+
+                    journal_file.flush()
+                    os.fsync(journal_file.fileno())
+
+                os.rename(temporary_filename, self.__filename__)
+            except:
+                self.__log__("JOURNAL: Unable to compact:" + str(sys.exc_info()[1]))
+
+                if self.__file__ is not None:
+                    return
+
+            if self.__file__ is not None:
+                self.__file__.close()
+                self.__file__ = None
+
+            try:
+                self.__file__ = open(self.__filename__, "a")
+            except IOError:
+                self.__log__("JOURNAL: Unable to open, messages are not being kept:"
+                             + str(sys.exc_info()[1]))
+
+                return
+
+            self.__line_count__ = len(self.__live_entries__)
+            self.__unsynced_count__ = 0
+        finally:
+            self.__lock__.release()
+
+    def __log__(self, message):
+        """
+        Logs, if there is a logger.
+        """
+
+        if self.__logger__ is not None:
+            self.__logger__.log_warning_message(message)
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+def test_unfinished_messages_are_replayed():
+    """
+    Only messages without an "A" or "X" come back,
+    in order, and a torn last line is ignored.
+    """
+
+    import tempfile
+
+    filename = tempfile.mktemp()
+    journal = OutboundJournal(filename)
+
+    first_id = journal.append("2061234567", "GAS DETECTED", 4, 0, True, 1234.5)
+    second_id = journal.append("2061234567", "Heater is ON.", 4, 1)
+    third_id = journal.append("2067654321", "Heater is ON.", 4, 1)
+    journal.mark_sent([first_id, second_id])
+    journal.mark_acked([second_id])
+    journal.mark_dropped([third_id])
+    journal.close()
+
+    with open(filename, "a") as journal_file:
+        journal_file.write('["Q", 9, 1')
+
+    journal = OutboundJournal(filename)
+    entries = journal.replay()
+
+    assert [entry.journal_id for entry in entries] == [first_id]
+    assert entries[0].text_message == "GAS DETECTED"
+    assert entries[0].retries_remaining == 3
+    assert entries[0].deadline_time == 1234.5
+    assert journal.replay() == []
+    assert journal.append("2061234567", "Heater is OFF.", 4, 1) == third_id + 1
+
+    journal.close()
+    os.remove(filename)
+
+
+def test_compaction():
+    """
+    The journal is rewritten without finished
+    messages, and still replays the live ones.
+    """
+
+    import tempfile
+
+    filename = tempfile.mktemp()
+    journal = OutboundJournal(filename, compact_line_count=50)
+
+    for index in range(100):
+        journal_id = journal.append("2061234567", "Status " + str(index), 4, 4)
+
+        if index < 99:
+            journal.mark_acked([journal_id])
+
+    journal.close()
+
+    with open(filename) as journal_file:
+        assert len(journal_file.readlines()) < 100
+
+    journal = OutboundJournal(filename)
+
+    assert [entry.text_message for entry in journal.replay()] == ["Status 99"]
+
+    journal.close()
+    os.remove(filename)
+
+
+def test_unwritable_journal():
+    """
+    A journal that cannot be written is not kept,
+    but the messages can still be queued.
+    """
+
+    import tempfile
+
+    journal = OutboundJournal(os.path.join(tempfile.mktemp(), "outbound_messages.journal"))
+
+    assert journal.append("2061234567", "GAS DETECTED", 4, 0, True) == 1
+    assert journal.replay() == []
+
+    journal.close(1.0)
+
+
+######################
+# JOURNAL BENCHMARK  #
+######################
+
+
+def __run_benchmark__(directory, message_count=2000):
+    """
+    Times appending messages (and acking them) with the
+    batched fsyncs, against an fsync after every record.
+    Run it with a directory on the SD card to see what the
+    Pi will do: python outbound_journal.py /home/pi/piWarmer/logs
+    """
+
+    from task_metrics import Histogram
+
+    def time_appends(journal, sync_every_record):
+        latency = Histogram([0.00001, 0.00005, 0.0001, 0.0005, 0.001,
+                             0.005, 0.01, 0.05, 0.1, 0.5])
+        start_time = utilities.get_monotonic_time()
+
+        for index in range(message_count):
+            append_start = utilities.get_monotonic_time()
+            journal_id = journal.append("2061234567", "Heater is OFF. " + str(index), 4, 4)
+
+            if sync_every_record:
+                journal.__sync__()
+
+            latency.add(utilities.get_monotonic_time() - append_start)
+            journal.mark_acked([journal_id])
+
+            if sync_every_record:
+                journal.__sync__()
+
+        journal.close()
+
+        return utilities.get_monotonic_time() - start_time, latency
+
+    for name, sync_every_record in [("fsync every record", True),
+                                    ("batched fsync", False)]:
+        filename = os.path.join(directory, "journal_benchmark.journal")
+        journal = OutboundJournal(filename)
+        total_time, latency = time_appends(journal, sync_every_record)
+
+        print name + ": " + str(int(message_count / total_time)) + " messages/s, append avg=" \
+            + str(round(latency.get_mean() * 1000000.0, 1)) + "us p99<=" \
+            + str(latency.get_percentile(99) * 1000000.0) + "us, fsyncs=" \
+            + str(journal.get_sync_count())
+
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    print "Starting tests."
+
+    test_unfinished_messages_are_replayed()
+    test_compaction()
+    test_unwritable_journal()
+
+    print "Tests finished"
+
+    print "Starting benchmark."
+
+    __run_benchmark__(sys.argv[1] if len(sys.argv) > 1 else tempfile.gettempdir())
+
+    print "Benchmark finished"
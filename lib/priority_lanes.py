@@ -0,0 +1,182 @@
+"""
+Module to prioritize the work done by the service loop,
+so safety work is never stuck behind modem traffic.
+"""
+
+import collections
+
+CRITICAL = 0  # Gas warnings and forcing the heater off
+NORMAL = 1  # SMS commands, replies, and status
+BULK = 2  # LCD updates, logging, and status polling
+
+LANE_NAMES = {CRITICAL: "CRITICAL", NORMAL: "NORMAL", BULK: "BULK"}
+
+
+class PriorityLanes(object):
+    """
+    Three lanes of work for the service loop.
+
+    Servicers are called on every pass of their lane.
+    One-shot work items are submitted from any thread.
+
+    Long running servicers should call preempt()
+    between steps so critical work can run right away.
+    """
+
+    def add_servicer(self, lane, name, servicer, has_work=None):
+        """
+        Adds a servicer that is called on every pass of the lane.
+        has_work tells preempt() if there is something
+        waiting for the servicer. If it is None the servicer
+        is only run on the normal pass.
+        """
+
+        self.__servicers__[lane].append([name, servicer, has_work])
+
+    def submit(self, lane, name, work):
+        """
+        Queues a one-shot piece of work and wakes the service loop.
+        """
+
+        self.__work__[lane].append([name, work])
+
+        if self.__wakeup_event__ is not None:
+            self.__wakeup_event__.signal(LANE_NAMES[lane] + ":" + name)
+
+    def has_critical_work(self):
+        """
+        Returns True if there is critical work waiting.
+        """
+
+        if self.__work__[CRITICAL]:
+            return True
+
+        for servicer in self.__servicers__[CRITICAL]:
+            has_work = servicer[2]
+
+            if has_work is not None and has_work():
+                return True
+
+        return False
+
+    def preempt(self):
+        """
+        Runs the critical lane if it has work waiting.
+        Safe to call from the middle of a long batch of work
+        on the service loop thread.
+        Returns True if critical work was run.
+        """
+
+        if self.__in_critical__ or not self.has_critical_work():
+            return False
+
+        self.__run_lane__(CRITICAL)
+
+        return True
+
+    def run(self):
+        """
+        Runs one pass of every lane, highest priority first.
+        Critical work is checked for before every normal
+        and bulk step.
+        """
+
+        self.__run_lane__(CRITICAL)
+
+        for name, servicer, _ in self.__servicers__[NORMAL]:
+            self.preempt()
+            self.__run_servicer__(servicer, name)
+
+        self.preempt()
+
+        for name, work in self.__take_work__(NORMAL):
+            self.preempt()
+            self.__run_servicer__(work, name)
+
+        for name, servicer, _ in self.__servicers__[BULK]:
+            self.preempt()
+            self.__run_servicer__(servicer, name)
+
+        for name, work in self.__take_work__(BULK):
+            self.preempt()
+            self.__run_servicer__(work, name)
+
+    def __init__(self, servicer_runner, wakeup_event=None):
+        """
+        The servicer runner is called with (callback, name)
+        and is responsible for handling any errors.
+        """
+
+        self.__run_servicer__ = servicer_runner
+        self.__wakeup_event__ = wakeup_event
+        self.__servicers__ = {CRITICAL: [], NORMAL: [], BULK: []}
+        self.__work__ = {CRITICAL: collections.deque(),
+                         NORMAL: collections.deque(),
+                         BULK: collections.deque()}
+        self.__in_critical__ = False
+
+    def __take_work__(self, lane):
+        """
+        Removes and returns the one-shot work for a lane.
+        """
+
+        work_items = []
+        lane_work = self.__work__[lane]
+
+        while True:
+            try:
+                work_items.append(lane_work.popleft())
+            except IndexError:
+                return work_items
+
+    def __run_lane__(self, lane):
+        """
+        Runs the servicers and one-shot work for a lane.
+        """
+
+        if lane == CRITICAL:
+            self.__in_critical__ = True
+
+        try:
+            for name, servicer, _ in self.__servicers__[lane]:
+                self.__run_servicer__(servicer, name)
+
+            for name, work in self.__take_work__(lane):
+                self.__run_servicer__(work, name)
+        finally:
+            if lane == CRITICAL:
+                self.__in_critical__ = False
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+def test_critical_preempts_normal():
+    """
+    Critical work submitted by a normal servicer
+    runs before the next normal servicer.
+    """
+
+    calls = []
+    lanes = PriorityLanes(lambda callback, name: callback())
+
+    def first_normal():
+        calls.append("first")
+        lanes.submit(CRITICAL, "gas", lambda: calls.append("gas"))
+
+    lanes.add_servicer(NORMAL, "first", first_normal)
+    lanes.add_servicer(NORMAL, "second", lambda: calls.append("second"))
+    lanes.submit(BULK, "lcd", lambda: calls.append("lcd"))
+    lanes.run()
+
+    assert calls == ["first", "gas", "second", "lcd"]
+
+
+if __name__ == '__main__':
+    print "Starting tests."
+
+    test_critical_preempts_normal()
+
+    print "Tests finished"
@@ -2,16 +2,54 @@
 Module to handle tasks that occur on a regularly scheduled interval.
 """
 
-import threading
 import sys
 import time
+import threading
+import scheduler
+import utilities
+import watchdog
+from task_metrics import TaskMetrics
 
 FUNCTION_A_COUNT = 0
 FUNCTION_B_COUNT = 0
 
+# What to do when a task falls behind its schedule.
+# SKIP drops the missed runs and waits for the next slot.
+# COALESCE runs once right away for all of the missed runs.
+# CATCH_UP runs once for every missed run, back to back.
+SKIP = "SKIP"
+COALESCE = "COALESCE"
+CATCH_UP = "CATCH_UP"
+DEFAULT_MISSED_RUN_POLICY = COALESCE
+
+# Never run more than this many missed runs back to back.
+MAXIMUM_CATCH_UP_RUNS = 10
+
+__ALL_TASKS__ = []
+__ALL_TASKS_LOCK__ = threading.Lock()
+
+
+def get_all_task_metrics():
+    """
+    Returns the metrics for every task that has not been cancelled.
+    """
+
+    __ALL_TASKS_LOCK__.acquire()
+    try:
+        return [task.get_metrics() for task in __ALL_TASKS__]
+    finally:
+        __ALL_TASKS_LOCK__.release()
+
 class RecurringTask(object):
     """
     Object to control and handle a recurring task.
+
+    All of the tasks share a single scheduler thread
+    instead of starting a new timer thread on every run.
+
+    Runs are anchored to the time the task started,
+    so the time a callback takes does not push
+    every later run back.
     """
 
     def is_running(self):
@@ -21,13 +59,32 @@ class RecurringTask(object):
 
         return self.__task_callback__ is not None and self.__is_running__
 
+    def get_metrics(self):
+        """
+        Returns the TaskMetrics (drift, duration,
+        overruns, and exceptions) for the task.
+        """
+
+        return self.__metrics__
+
+    def is_cancelled(self):
+        """
+        Returns True if the task has been cancelled.
+        """
+
+        return self.__is_cancelled__
+
     def start(self):
         """
         Starts the task if it is not already running.
+        The first run happens immediately on the calling thread.
         """
-        if self.__task_callback__ is not None and not self.__is_running__:
+        if self.__task_callback__ is not None \
+                and not self.__is_running__ \
+                and not self.__is_cancelled__:
             self.__is_running__ = True
-            self.__run_task__()
+            self.__next_run_time__ = utilities.get_monotonic_time()
+            self.run()
 
             return True
 
@@ -40,39 +97,264 @@ class RecurringTask(object):
 
         if self.is_running():
             self.__is_running__ = False
+            self.__scheduler__.remove(self)
+
+    def resume(self):
+        """
+        Resumes a paused task.
+        The next run happens on the scheduler thread
+        one interval from now.
+        """
+
+        if self.__task_callback__ is not None \
+                and not self.__is_running__ \
+                and not self.__is_cancelled__:
+            self.__is_running__ = True
+            self.__next_run_time__ = utilities.get_monotonic_time()
+            self.__schedule_next_run__()
+
+            return True
+
+        return False
 
-    def __run_task__(self):
+    def cancel(self):
         """
-        Runs the callback.
+        Stops the task for good.
+        A cancelled task can not be started again.
+        """
+
+        self.__is_cancelled__ = True
+        self.__is_running__ = False
+        self.__scheduler__.remove(self)
+
+        __ALL_TASKS_LOCK__.acquire()
+        try:
+            if self in __ALL_TASKS__:
+                __ALL_TASKS__.remove(self)
+        finally:
+            __ALL_TASKS_LOCK__.release()
+
+    def run(self):
+        """
+        Runs the callback, then schedules the next run.
+        Called by the scheduler.
         """
 
         if not self.__is_running__:
             return False
 
+        start_time = utilities.get_monotonic_time()
+        scheduled_time = self.__next_run_time__
+        watchdog_token = watchdog.get_default_watchdog().begin(self.__task_name__)
+
         try:
             self.__task_callback__()
         except:
-            if self.__logger__ is not None:
-                error_mesage = "EX(" + self.__task_name__ + ")=" + sys.exc_info()[0]
-                self.__logger__.info(error_mesage)
+            self.__metrics__.record_exception()
+            self.__log_exception__()
+
+        watchdog.get_default_watchdog().end(watchdog_token)
+
+        self.__metrics__.record_run(start_time - scheduled_time,
+                                    utilities.get_monotonic_time() - start_time,
+                                    self.__task_interval__)
 
         if self.__is_running__:
-            threading.Timer(int(self.__task_interval__), self.__run_task__).start()
+            self.__schedule_next_run__()
+
+        return True
+
+    def __schedule_next_run__(self):
+        """
+        Hands the next run to the scheduler.
+        The next run is one interval after the last scheduled
+        run, not after the callback finished. If that time
+        has already passed, the missed run policy decides.
+        """
+
+        current_time = utilities.get_monotonic_time()
+        next_run_time = self.__next_run_time__ + self.__task_interval__
+
+        if next_run_time < current_time and self.__task_interval__ > 0:
+            missed_runs = int((current_time - next_run_time)
+                              / self.__task_interval__) + 1
+
+            if self.__missed_run_policy__ == SKIP:
+                next_run_time += missed_runs * self.__task_interval__
+            elif self.__missed_run_policy__ == CATCH_UP:
+                if missed_runs > MAXIMUM_CATCH_UP_RUNS:
+                    next_run_time += (missed_runs - MAXIMUM_CATCH_UP_RUNS) \
+                        * self.__task_interval__
+            else:
+                # Run now, but stay on the original schedule.
+                next_run_time += (missed_runs - 1) * self.__task_interval__
+
+        self.__next_run_time__ = self.__scheduler__.add_at(self, next_run_time)
+
+    def __log_exception__(self):
+        """
+        Logs that the callback raised.
+        The logger may be a lib.logger.Logger or
+        a logger from the logging module.
+        """
+
+        if self.__logger__ is None:
+            return
+
+        error_message = "EX(" + self.__task_name__ + ")=" \
+            + str(sys.exc_info()[0])
 
-    def __init__(self, task_name, task_interval, task_callback, logger=None):
+        try:
+            if hasattr(self.__logger__, "log_warning_message"):
+                self.__logger__.log_warning_message(error_message)
+            else:
+                self.__logger__.info(error_message)
+        except:
+            pass
+
+    def __init__(self, task_name, task_interval, task_callback, logger=None,
+                 task_scheduler=None, missed_run_policy=DEFAULT_MISSED_RUN_POLICY):
         """
         Creates a new reocurring task.
         The call back is called at the given time schedule.
+        The missed run policy is SKIP, COALESCE, or CATCH_UP.
         """
 
+        if task_scheduler is None:
+            task_scheduler = scheduler.get_default_scheduler()
+
         self.__task_name__ = task_name
-        self.__task_interval__ = task_interval
+        self.__task_interval__ = float(task_interval)
         self.__task_callback__ = task_callback
         self.__logger__ = logger
+        self.__scheduler__ = task_scheduler
+        self.__missed_run_policy__ = missed_run_policy
         self.__is_running__ = False
+        self.__is_cancelled__ = False
+        self.__next_run_time__ = None
+        self.__metrics__ = TaskMetrics(task_name)
+
+        __ALL_TASKS_LOCK__.acquire()
+        try:
+            __ALL_TASKS__.append(self)
+        finally:
+            __ALL_TASKS_LOCK__.release()
 
         self.start()
 
+##############
+# UNIT TESTS #
+##############
+
+
+class __FakeClock__(object):
+    """
+    Stands in for utilities.get_monotonic_time().
+    """
+
+    def __call__(self):
+        return self.now
+
+    def __init__(self, now):
+        self.now = now
+
+
+class __FakeScheduler__(object):
+    """
+    Records when each run was scheduled for, instead of running it.
+    """
+
+    def add_at(self, job, run_time):
+        self.run_times.append(run_time)
+
+        return run_time
+
+    def remove(self, job):
+        pass
+
+    def __init__(self):
+        self.run_times = []
+
+
+def __run_with_fake_clock__(test):
+    """
+    Calls the test with a fake clock in place of the real one.
+    """
+
+    real_get_monotonic_time = utilities.get_monotonic_time
+    clock = __FakeClock__(100.0)
+    utilities.get_monotonic_time = clock
+
+    try:
+        test(clock)
+    finally:
+        utilities.get_monotonic_time = real_get_monotonic_time
+
+
+def __run_due__(task, task_scheduler, clock, until_time):
+    """
+    Plays the part of the scheduler thread, running the
+    task at each scheduled time up to the given time.
+    A run that is already due starts at the current time.
+    """
+
+    while task_scheduler.run_times[-1] <= until_time:
+        clock.now = max(clock.now, task_scheduler.run_times[-1])
+        task.run()
+
+
+def test_anchored_cadence_does_not_drift(clock):
+    """
+    A callback that takes three seconds of a ten second
+    interval does not push the later runs back.
+    """
+
+    def slow_callback():
+        clock.now += 3.0
+
+    task_scheduler = __FakeScheduler__()
+    task = RecurringTask("test_cadence", 10, slow_callback, None, task_scheduler)
+    __run_due__(task, task_scheduler, clock, 150.0)
+    task.cancel()
+
+    assert task_scheduler.run_times == [110.0, 120.0, 130.0, 140.0, 150.0, 160.0]
+    assert task.get_metrics().start_drift.maximum == 0.0
+
+
+def test_missed_run_policies(clock):
+    """
+    After a stall through three slots, SKIP waits for the
+    next slot, COALESCE runs once right away, and CATCH_UP
+    runs every missed slot back to back, up to the limit.
+    """
+
+    expected_run_times = {SKIP: [110.0, 140.0],
+                          COALESCE: [110.0, 130.0, 140.0],
+                          CATCH_UP: [110.0, 120.0, 130.0, 140.0]}
+
+    for policy in [SKIP, COALESCE, CATCH_UP]:
+        clock.now = 100.0
+        task_scheduler = __FakeScheduler__()
+        task = RecurringTask("test_" + policy, 10, lambda: None, None, task_scheduler,
+                             policy)
+        clock.now = 135.0
+        __run_due__(task, task_scheduler, clock, 135.0)
+        task.cancel()
+
+        assert task_scheduler.run_times == expected_run_times[policy], policy
+        assert clock.now == 135.0
+
+    clock.now = 100.0
+    task_scheduler = __FakeScheduler__()
+    task = RecurringTask("test_catch_up_limit", 1, lambda: None, None, task_scheduler,
+                         CATCH_UP)
+    clock.now = 200.5
+    task.run()
+    task.cancel()
+
+    assert task_scheduler.run_times[-1] == 200.0 - MAXIMUM_CATCH_UP_RUNS + 1
+
+
 class timer_test(object):
     def __init__(self):
         self.a = 0
@@ -91,11 +373,18 @@ class timer_test(object):
             raise KeyboardInterrupt
 
 if __name__ == '__main__':
+    print "Starting tests."
+
+    __run_with_fake_clock__(test_anchored_cadence_does_not_drift)
+    __run_with_fake_clock__(test_missed_run_policies)
+
+    print "Tests finished"
 
     TEST = timer_test()
 
     while True:
         print "A:" + str(TEST.a)
         print "B:" + str(TEST.b)
+        print "Threads:" + str(scheduler.get_live_thread_count())
 
         time.sleep(1)
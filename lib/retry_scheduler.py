@@ -0,0 +1,329 @@
+"""
+Module to hold the text messages whose send failed
+until they are due to be tried again, waiting longer
+after each failure, and to keep the messages that
+were given up on so they can be reported.
+
+A dead modem fails every send right away. Without
+the backoff, each failure would go straight back on
+the modem thread and hold it from everything else.
+"""
+
+import collections
+import datetime
+import heapq
+import random
+import utilities
+from task_metrics import Histogram
+
+DEFAULT_BASE_DELAY = 5.0  # Seconds before the first retry
+DEFAULT_MAXIMUM_DELAY = 60.0 * 5  # Seconds. The backoff stops growing here.
+DEFAULT_DEAD_LETTER_LIMIT = 10  # How many given up messages are kept
+RETRY_DELAY_BUCKET_LIMITS = [1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0]
+
+# Why a message was given up on.
+RETRIES_EXHAUSTED = "no retries left"
+DEADLINE_PASSED = "too late"
+
+
+def get_backoff_delay(attempt_count, base_delay, maximum_delay, random_fraction):
+    """
+    Returns the seconds to wait after the given number
+    of failed attempts. The delay doubles after each
+    failure, up to the maximum, and the top half of it
+    is random, so messages that failed together are not
+    all tried again together.
+
+    >>> get_backoff_delay(1, 5.0, 300.0, 0.0)
+    2.5
+    >>> get_backoff_delay(1, 5.0, 300.0, 1.0)
+    5.0
+    >>> get_backoff_delay(3, 5.0, 300.0, 1.0)
+    20.0
+    >>> get_backoff_delay(40, 5.0, 300.0, 0.5)
+    225.0
+    """
+
+    delay = min(maximum_delay, base_delay * (2 ** min(max(0, attempt_count - 1), 30)))
+
+    return delay / 2.0 + delay / 2.0 * random_fraction
+
+
+class DeadLetter(object):
+    """
+    A message that was given up on.
+    """
+
+    __slots__ = ["phone_number",
+                 "text_message",
+                 "reason",
+                 "attempt_count",
+                 "dead_time"]
+
+    def describe(self):
+        """
+        Returns a short description, suitable
+        for a status reply or the log.
+        """
+
+        return "To " + str(self.phone_number) + " at " + self.dead_time.strftime("%H:%M") \
+            + " (" + self.reason + ", " + str(self.attempt_count) + " tries): " \
+            + self.text_message.split("\n")[0][:20]
+
+    def __init__(self, message, reason):
+        self.phone_number = message.phone_number
+        self.text_message = message.text_message
+        self.reason = reason
+        self.attempt_count = message.attempt_count
+        self.dead_time = datetime.datetime.now()
+
+
+class RetryScheduler(object):
+    """
+    Holds failed OutboundMessageEvents until their next
+    attempt is due, and keeps the last few messages that
+    ran out of retries or time.
+    The caller is responsible for locking.
+    """
+
+    def schedule_retry(self, message):
+        """
+        Holds a message whose attempt just failed.
+        Returns the seconds until it is tried again, or None
+        if it was given up on and made a dead letter.
+        """
+
+        if message.retries_remaining < 1:
+            self.add_dead_letter(message, RETRIES_EXHAUSTED)
+
+            return None
+
+        delay = get_backoff_delay(message.attempt_count,
+                                  self.__base_delay__,
+                                  self.__maximum_delay__,
+                                  self.__random__.random())
+        due_time = utilities.get_monotonic_time() + delay
+
+        if message.deadline is not None and due_time > message.deadline:
+            self.add_dead_letter(message, DEADLINE_PASSED)
+
+            return None
+
+        heapq.heappush(self.__waiting__, (due_time, self.__sequence__, message))
+        self.__sequence__ += 1
+        self.__retry_count__ += 1
+        self.__retry_delays__.add(delay)
+
+        return delay
+
+    def is_expired(self, message):
+        """
+        Returns True if the message's deadline has passed.
+        """
+
+        return message.deadline is not None \
+            and utilities.get_monotonic_time() >= message.deadline
+
+    def add_dead_letter(self, message, reason):
+        """
+        Keeps a message that was given up on.
+        The oldest are forgotten past the limit,
+        but still counted.
+        """
+
+        self.__dead_letters__.append(DeadLetter(message, reason))
+        self.__dead_letter_count__ += 1
+        self.__unreported_count__ += 1
+
+    def take_due(self, flush=False):
+        """
+        Removes and returns the messages due to be tried
+        again, oldest due first. With flush, all of them.
+        """
+
+        now = utilities.get_monotonic_time()
+        due_messages = []
+
+        while self.__waiting__ and (flush or self.__waiting__[0][0] <= now):
+            due_messages.append(heapq.heappop(self.__waiting__)[2])
+
+        return due_messages
+
+    def get_seconds_until_due(self):
+        """
+        Returns how long until a retry is due,
+        or None if nothing is waiting.
+        """
+
+        if not self.__waiting__:
+            return None
+
+        return max(0.0, self.__waiting__[0][0] - utilities.get_monotonic_time())
+
+    def get_waiting_count(self):
+        """
+        Returns how many messages are waiting to be tried again.
+        """
+
+        return len(self.__waiting__)
+
+    def get_dead_letters(self):
+        """
+        Returns the kept dead letters, oldest first.
+        """
+
+        return list(self.__dead_letters__)
+
+    def take_dead_letters(self):
+        """
+        Returns how many messages were given up on since
+        the last time, and the last few of them, oldest
+        first. They are then forgotten, so each is only
+        reported once.
+        """
+
+        report = (self.__unreported_count__, list(self.__dead_letters__))
+        self.__dead_letters__.clear()
+        self.__unreported_count__ = 0
+
+        return report
+
+    def get_dead_letter_count(self):
+        """
+        Returns how many messages have been given up on.
+        """
+
+        return self.__dead_letter_count__
+
+    def get_retry_count(self):
+        """
+        Returns how many retries have been scheduled.
+        """
+
+        return self.__retry_count__
+
+    def describe(self):
+        """
+        Returns the retry volume, suitable for the log.
+        """
+
+        return "retries=" + str(self.__retry_count__) \
+            + ", waiting=" + str(len(self.__waiting__)) \
+            + ", dead letters=" + str(self.__dead_letter_count__) \
+            + ", retry delay " + self.__retry_delays__.describe()
+
+    def __init__(self,
+                 base_delay=DEFAULT_BASE_DELAY,
+                 maximum_delay=DEFAULT_MAXIMUM_DELAY,
+                 dead_letter_limit=DEFAULT_DEAD_LETTER_LIMIT,
+                 random_source=None):
+        """
+        The random source is only given by the tests.
+        """
+
+        if random_source is None:
+            random_source = random.Random()
+
+        self.__base_delay__ = base_delay
+        self.__maximum_delay__ = maximum_delay
+        self.__random__ = random_source
+        self.__waiting__ = []
+        self.__sequence__ = 0
+        self.__dead_letters__ = collections.deque(maxlen=dead_letter_limit)
+        self.__dead_letter_count__ = 0
+        self.__unreported_count__ = 0
+        self.__retry_count__ = 0
+        self.__retry_delays__ = Histogram(RETRY_DELAY_BUCKET_LIMITS)
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+def test_retries_back_off_until_exhausted():
+    """
+    A message is held for longer after each failure,
+    and becomes a dead letter when out of retries.
+    """
+
+    from events import OutboundMessageEvent
+
+    retry_scheduler = RetryScheduler(60.0, 600.0, 2, random.Random(1))
+    message = OutboundMessageEvent("2061234567", "Heater turned ON.", 3, 4)
+    delays = []
+
+    for _ in range(2):
+        message.attempt_count += 1
+        message.retries_remaining -= 1
+        delays.append(retry_scheduler.schedule_retry(message))
+
+        assert retry_scheduler.take_due() == []
+        assert retry_scheduler.get_seconds_until_due() > 29
+        assert retry_scheduler.take_due(True) == [message]
+
+    assert 30.0 <= delays[0] <= 60.0
+    assert 60.0 <= delays[1] <= 120.0
+
+    message.attempt_count += 1
+    message.retries_remaining -= 1
+
+    assert retry_scheduler.schedule_retry(message) is None
+    assert retry_scheduler.get_waiting_count() == 0
+    assert retry_scheduler.get_retry_count() == 2
+    assert retry_scheduler.get_dead_letters()[0].reason == RETRIES_EXHAUSTED
+    assert retry_scheduler.get_dead_letters()[0].attempt_count == 3
+
+
+def test_deadlines():
+    """
+    A retry that would land past the deadline is not
+    made, and the dead letters are kept up to the limit,
+    and reported once.
+    """
+
+    from events import OutboundMessageEvent
+
+    retry_scheduler = RetryScheduler(0.0, 0.0, 2)
+    message = OutboundMessageEvent("2061234567", "ON", 4, 1)
+    message.attempt_count = 1
+
+    assert retry_scheduler.schedule_retry(message) == 0.0
+    assert retry_scheduler.take_due() == [message]
+
+    retry_scheduler = RetryScheduler(60.0, 60.0, 2)
+
+    for index in range(3):
+        message = OutboundMessageEvent("2061234567", "Message " + str(index), 4, 1,
+                                       deadline=utilities.get_monotonic_time() + 1.0)
+        message.attempt_count = 1
+
+        assert not retry_scheduler.is_expired(message)
+        assert retry_scheduler.schedule_retry(message) is None
+
+    message.deadline = utilities.get_monotonic_time() - 1.0
+
+    assert retry_scheduler.is_expired(message)
+    assert [dead_letter.text_message for dead_letter in retry_scheduler.get_dead_letters()] \
+        == ["Message 1", "Message 2"]
+    assert retry_scheduler.get_dead_letter_count() == 3
+    assert retry_scheduler.get_dead_letters()[0].describe().endswith("(too late, 1 tries): Message 1")
+
+    unreported_count, dead_letters = retry_scheduler.take_dead_letters()
+
+    assert unreported_count == 3
+    assert [dead_letter.text_message for dead_letter in dead_letters] == ["Message 1", "Message 2"]
+    assert retry_scheduler.take_dead_letters() == (0, [])
+    assert retry_scheduler.get_dead_letter_count() == 3
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+    test_retries_back_off_until_exhausted()
+    test_deadlines()
+
+    print "Tests finished"
@@ -0,0 +1,232 @@
+"""
+Module to run all of the recurring jobs from a single thread.
+
+Replaces starting a new threading.Timer (and a new OS thread)
+on every tick of every recurring task.
+"""
+
+import heapq
+import itertools
+import threading
+import utilities
+
+
+def get_live_thread_count():
+    """
+    Returns how many threads are alive in the process.
+    Used to confirm we are not churning threads.
+    """
+
+    return threading.active_count()
+
+
+class Scheduler(object):
+    """
+    Runs jobs at a deadline from one thread,
+    using a heap ordered by a monotonic clock.
+
+    A job is any object with a run() method.
+    A job is not scheduled again until its run() re-adds it,
+    so a job never overlaps itself, even on an executor.
+    """
+
+    def add(self, job, delay_in_seconds):
+        """
+        Schedules the job to run after the given delay.
+        Replaces any existing schedule for the job.
+        Returns the monotonic time the job is due.
+        """
+
+        return self.add_at(job, utilities.get_monotonic_time() + delay_in_seconds)
+
+    def add_at(self, job, run_time):
+        """
+        Schedules the job to run at the given monotonic time.
+        A time in the past runs as soon as possible.
+        Replaces any existing schedule for the job.
+        Returns the monotonic time the job is due.
+        """
+
+        self.__condition__.acquire()
+        try:
+            if self.__is_stopped__:
+                return run_time
+
+            entry = [run_time,
+                     next(self.__sequence__),
+                     job]
+            self.__cancel_entry__(job)
+            self.__entries__[job] = entry
+            heapq.heappush(self.__heap__, entry)
+            self.__start_thread__()
+            self.__condition__.notify()
+
+            return entry[0]
+        finally:
+            self.__condition__.release()
+
+    def remove(self, job):
+        """
+        Removes any pending run of the job.
+        Returns True if the job was scheduled.
+        """
+
+        self.__condition__.acquire()
+        try:
+            return self.__cancel_entry__(job)
+        finally:
+            self.__condition__.release()
+
+    def is_scheduled(self, job):
+        """
+        Returns True if the job has a pending run.
+        """
+
+        return job in self.__entries__
+
+    def set_executor(self, executor):
+        """
+        Hands due jobs to the executor (such as a WorkerPool)
+        instead of running them on the scheduler thread,
+        so a slow job does not hold up the others.
+        Pass None to run jobs on the scheduler thread again.
+        """
+
+        self.__executor__ = executor
+
+    def stop(self, timeout=None):
+        """
+        Stops the scheduler thread and drops every pending job.
+        The scheduler can not be restarted.
+        """
+
+        self.__condition__.acquire()
+        try:
+            self.__is_stopped__ = True
+            self.__heap__ = []
+            self.__entries__ = {}
+            self.__condition__.notify_all()
+            scheduler_thread = self.__thread__
+        finally:
+            self.__condition__.release()
+
+        if scheduler_thread is not None \
+                and scheduler_thread is not threading.current_thread():
+            scheduler_thread.join(timeout)
+
+    def get_job_count(self):
+        """
+        Returns the number of jobs waiting to run.
+        """
+
+        return len(self.__entries__)
+
+    def __init__(self, name="scheduler"):
+        """
+        Creates a scheduler. The thread is only started
+        once the first job is added.
+        """
+
+        self.__thread_name__ = name
+        self.__condition__ = threading.Condition(threading.Lock())
+        self.__heap__ = []
+        self.__entries__ = {}
+        self.__sequence__ = itertools.count()
+        self.__thread__ = None
+        self.__executor__ = None
+        self.__is_stopped__ = False
+
+    def __cancel_entry__(self, job):
+        """
+        Marks the heap entry for the job as dead.
+        Must be called with the condition held.
+        """
+
+        entry = self.__entries__.pop(job, None)
+
+        if entry is None:
+            return False
+
+        entry[2] = None
+
+        return True
+
+    def __start_thread__(self):
+        """
+        Starts the scheduler thread if needed.
+        Must be called with the condition held.
+        """
+
+        if self.__thread__ is not None:
+            return
+
+        self.__thread__ = threading.Thread(name=self.__thread_name__,
+                                           target=self.__run__)
+        self.__thread__.daemon = True
+        self.__thread__.start()
+
+    def __get_next_job__(self):
+        """
+        Blocks until a job is due, then returns it.
+        Returns None once the scheduler is stopped.
+        """
+
+        self.__condition__.acquire()
+        try:
+            while not self.__is_stopped__:
+                while self.__heap__ and self.__heap__[0][2] is None:
+                    heapq.heappop(self.__heap__)
+
+                if not self.__heap__:
+                    self.__condition__.wait()
+                    continue
+
+                time_until_due = self.__heap__[0][0] - utilities.get_monotonic_time()
+
+                if time_until_due > 0:
+                    self.__condition__.wait(time_until_due)
+                    continue
+
+                entry = heapq.heappop(self.__heap__)
+                job = entry[2]
+                del self.__entries__[job]
+
+                return job
+
+            return None
+        finally:
+            self.__condition__.release()
+
+    def __run__(self):
+        """
+        The scheduler thread.
+        Jobs are responsible for their own error handling,
+        but a failing job must never stop the thread.
+        """
+
+        while True:
+            job = self.__get_next_job__()
+
+            if job is None:
+                return
+
+            executor = self.__executor__
+
+            if executor is not None and executor.submit(job.run):
+                continue
+
+            try:
+                job.run()
+            except:
+                pass
+
+
+__DEFAULT_SCHEDULER__ = Scheduler()
+
+
+def get_default_scheduler():
+    """
+    Returns the scheduler shared by all of the recurring tasks.
+    """
+
+    return __DEFAULT_SCHEDULER__
@@ -0,0 +1,417 @@
+"""
+Module to read from the modem in bulk.
+
+Everything that is waiting on the serial port is read
+in one call into a single, reused buffer, and lines are
+found in place instead of building strings byte by byte.
+"""
+
+import time
+import utilities
+
+DEFAULT_CAPACITY = 4096  # Bytes. The buffer grows if it has to.
+DEFAULT_QUIET_INTERVAL = 0.05  # Seconds without new data that ends a read
+POLL_INTERVAL = 0.005  # Seconds
+
+
+class SerialReader(object):
+    """
+    A receive buffer for a serial connection.
+    All of the readers of the modem share one of these,
+    so that bytes read by one are never lost to another.
+    The caller is responsible for locking.
+    """
+
+    def fill(self):
+        """
+        Reads everything that is waiting into the buffer.
+        Returns how many bytes were read.
+        """
+
+        if self.__serial_connection__ is None:
+            return 0
+
+        bytes_waiting = self.__serial_connection__.inWaiting()
+
+        if bytes_waiting < 1:
+            return 0
+
+        self.__make_room__(bytes_waiting)
+
+        if self.__readinto__ is not None:
+            bytes_read = self.__readinto__(
+                memoryview(self.__buffer__)[self.__end__:self.__end__ + bytes_waiting])
+        else:
+            data = self.__serial_connection__.read(bytes_waiting)
+            bytes_read = len(data)
+            self.__buffer__[self.__end__:self.__end__ + bytes_read] = data
+
+        self.__end__ += bytes_read
+
+        return bytes_read
+
+    def feed(self, data):
+        """
+        Adds bytes that were read some other way,
+        such as by a blocking read(1).
+        """
+
+        self.__make_room__(len(data))
+        self.__buffer__[self.__end__:self.__end__ + len(data)] = data
+        self.__end__ += len(data)
+
+    def wait_for_data(self, timeout):
+        """
+        Waits until there is something in the buffer.
+        Returns True if there is.
+        """
+
+        deadline = utilities.get_monotonic_time() + timeout
+
+        while self.__end__ == self.__start__:
+            if self.fill() > 0:
+                return True
+
+            if utilities.get_monotonic_time() >= deadline \
+                    or self.__serial_connection__ is None:
+                return False
+
+            time.sleep(POLL_INTERVAL)
+
+        return True
+
+    def read_line(self):
+        """
+        Returns the next non-empty line, without the line
+        ending, or None if there is not a whole line buffered.
+        """
+
+        while True:
+            end_of_line = self.__buffer__.find("\n", self.__start__, self.__end__)
+
+            if end_of_line < 0:
+                return None
+
+            line = str(self.__buffer__[self.__start__:end_of_line]).strip()
+            self.__start__ = end_of_line + 1
+
+            if line != "":
+                return line
+
+    def read_available(self, timeout, quiet_interval=DEFAULT_QUIET_INTERVAL):
+        """
+        Reads until nothing new has arrived for the quiet
+        interval, or the timeout, so a reply that arrives
+        in pieces is read whole.
+        Returns what was read.
+        """
+
+        last_data_time = utilities.get_monotonic_time()
+        deadline = last_data_time + timeout
+
+        while self.__serial_connection__ is not None \
+                and utilities.get_monotonic_time() < deadline:
+            if self.fill() > 0:
+                last_data_time = utilities.get_monotonic_time()
+            elif utilities.get_monotonic_time() - last_data_time >= quiet_interval:
+                break
+            else:
+                time.sleep(POLL_INTERVAL)
+
+        return self.take()
+
+    def read_until(self, text, timeout):
+        """
+        Reads until the text arrives, or the timeout.
+        Returns everything up to and including the text,
+        or everything read if the text never came.
+        """
+
+        deadline = utilities.get_monotonic_time() + timeout
+        search_start = self.__start__
+
+        while True:
+            found_at = self.__buffer__.find(text, search_start, self.__end__)
+
+            if found_at >= 0:
+                return self.take(found_at + len(text) - self.__start__)
+
+            # The text may straddle the next read.
+            search_start = max(self.__start__, self.__end__ - len(text) + 1)
+
+            if utilities.get_monotonic_time() >= deadline \
+                    or self.__serial_connection__ is None:
+                return self.take()
+
+            if self.fill() < 1:
+                time.sleep(POLL_INTERVAL)
+
+    def take_prompt(self, prompt=">"):
+        """
+        Consumes a prompt that is not followed by a newline,
+        such as the "> " after AT+CMGS.
+        Returns True if the prompt was waiting.
+        """
+
+        position = self.__start__
+
+        while position < self.__end__ and self.__buffer__[position] in (10, 13):
+            position += 1
+
+        if self.__buffer__.startswith(prompt, position, self.__end__):
+            self.take()
+            return True
+
+        return False
+
+    def take(self, byte_count=None):
+        """
+        Removes and returns the buffered bytes, or the
+        first byte_count of them.
+        """
+
+        if byte_count is None:
+            byte_count = self.__end__ - self.__start__
+
+        taken = str(self.__buffer__[self.__start__:self.__start__ + byte_count])
+        self.__start__ += len(taken)
+
+        if self.__start__ == self.__end__:
+            self.__start__ = 0
+            self.__end__ = 0
+
+        return taken
+
+    def get_buffered_count(self):
+        """
+        Returns how many bytes are waiting in the buffer.
+        """
+
+        return self.__end__ - self.__start__
+
+    def __init__(self, serial_connection, capacity=DEFAULT_CAPACITY):
+        self.__serial_connection__ = serial_connection
+        self.__readinto__ = getattr(serial_connection, "readinto", None)
+        self.__buffer__ = bytearray(capacity)
+        self.__start__ = 0
+        self.__end__ = 0
+
+    def __make_room__(self, byte_count):
+        """
+        Makes sure byte_count more bytes fit after the
+        end of the buffered data, moving the data to the
+        front, or growing the buffer, only when it has to.
+        """
+
+        if self.__end__ + byte_count <= len(self.__buffer__):
+            return
+
+        buffered_count = self.__end__ - self.__start__
+
+        if self.__start__ > 0:
+            self.__buffer__[0:buffered_count] = self.__buffer__[self.__start__:self.__end__]
+            self.__start__ = 0
+            self.__end__ = buffered_count
+
+        if self.__end__ + byte_count > len(self.__buffer__):
+            self.__buffer__.extend(
+                bytearray(max(byte_count, len(self.__buffer__))))
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+class FakeSerial(object):
+    """
+    Hands back the data in the chunks given, one
+    chunk each time the reader looks.
+    """
+
+    def inWaiting(self):
+        if not self.waiting and self.chunks:
+            self.waiting = self.chunks.pop(0)
+
+        return len(self.waiting)
+
+    def read(self, size=1):
+        data = self.waiting[:size]
+        self.waiting = self.waiting[size:]
+
+        return data
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.waiting = ""
+
+
+def test_lines_across_reads():
+    """
+    A line split over two reads is only returned once whole.
+    """
+
+    reader = SerialReader(FakeSerial(["+CSQ: 1", "7,0\r\n\r\nOK\r\n"]))
+
+    reader.fill()
+    assert reader.read_line() is None
+
+    reader.fill()
+    assert reader.read_line() == "+CSQ: 17,0"
+    assert reader.read_line() == "OK"
+    assert reader.read_line() is None
+    assert reader.get_buffered_count() == 0
+
+
+def test_buffer_grows_and_compacts():
+    """
+    More data than the capacity is kept, in order.
+    """
+
+    reader = SerialReader(FakeSerial(["a" * 10 + "\r\n", "b" * 30 + "\r\n"]), 16)
+
+    reader.fill()
+    assert reader.read_line() == "a" * 10
+
+    reader.fill()
+    assert reader.read_line() == "b" * 30
+
+
+def test_read_until_and_prompt():
+    """
+    read_until stops at the text, and the prompt is
+    found without a newline after it.
+    """
+
+    reader = SerialReader(FakeSerial(["\r\n+CMGS: 4\r\n", "\r\nOK\r\n", "\r\n> "]))
+
+    assert reader.read_until("OK", 1) == "\r\n+CMGS: 4\r\n\r\nOK"
+    assert not reader.take_prompt()
+
+    reader.fill()
+    assert reader.take_prompt()
+    assert reader.get_buffered_count() == 0
+
+
+def test_read_available_waits_for_pieces():
+    """
+    A short gap between pieces does not end the read,
+    and nothing arriving ends it after the quiet interval.
+    """
+
+    reader = SerialReader(FakeSerial(["first ", "", "second"]))
+
+    assert reader.read_available(1) == "first second"
+    assert reader.read_available(1, 0.01) == ""
+
+
+######################
+# SERIAL BENCHMARK   #
+######################
+
+
+def __run_benchmark__(total_bytes=1 << 20):
+    """
+    Pushes a stream of CMGL style lines through a pty
+    and compares reading it a byte at a time (the old
+    __read_from_fona__) with the SerialReader.
+    """
+
+    import fcntl
+    import os
+    import pty
+    import struct
+    import termios
+    import threading
+    import tty
+
+    class PtySerial(object):
+        """
+        Just enough of pyserial over a pty.
+        """
+
+        def inWaiting(self):
+            return struct.unpack('i', fcntl.ioctl(self.fd, termios.FIONREAD, '\0\0\0\0'))[0]
+
+        def read(self, size=1):
+            return os.read(self.fd, size)
+
+        def __init__(self, fd):
+            self.fd = fd
+
+    line = '+CMGL: 1,"REC UNREAD","+12061234567","","18/01/20,14:05:03-32"\r\n' \
+        + 'Status\r\n'
+
+    def run_case(read_all):
+        master, slave = pty.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+
+        def write_stream():
+            for _ in range(total_bytes / len(line)):
+                os.write(master, line)
+
+        writer = threading.Thread(target=write_stream)
+        writer.daemon = True
+
+        cpu_start = time.clock()
+        wall_start = utilities.get_monotonic_time()
+        writer.start()
+        byte_count = read_all(PtySerial(slave), (total_bytes / len(line)) * len(line))
+        wall_time = utilities.get_monotonic_time() - wall_start
+        cpu_time = time.clock() - cpu_start
+        writer.join()
+        os.close(master)
+        os.close(slave)
+
+        return byte_count, wall_time, cpu_time
+
+    def read_byte_at_a_time(serial_connection, expected):
+        read_buffer = ""
+        lines = 0
+
+        while len(read_buffer) < expected:
+            while serial_connection.inWaiting() > 0:
+                read_buffer += serial_connection.read(1)
+
+        for _ in read_buffer.splitlines():
+            lines += 1
+
+        return len(read_buffer)
+
+    def read_buffered(serial_connection, expected):
+        reader = SerialReader(serial_connection)
+        received = 0
+        lines = 0
+
+        while received < expected:
+            received += reader.fill()
+
+            while reader.read_line() is not None:
+                lines += 1
+
+        return received
+
+    for name, read_all in [("byte at a time", read_byte_at_a_time),
+                           ("SerialReader", read_buffered)]:
+        byte_count, wall_time, cpu_time = run_case(read_all)
+        print name + ": " \
+            + str(int(byte_count / wall_time / 1024)) + " KB/s, " \
+            + str(round(cpu_time * 1000000.0 / (byte_count / 1024.0), 1)) + " us CPU/KB"
+
+
+if __name__ == '__main__':
+    print "Starting tests."
+
+    test_lines_across_reads()
+    test_buffer_grows_and_compacts()
+    test_read_until_and_prompt()
+    test_read_available_waits_for_pieces()
+
+    print "Tests finished"
+
+    print "Starting benchmark."
+
+    __run_benchmark__()
+
+    print "Benchmark finished"
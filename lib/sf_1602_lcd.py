@@ -139,6 +139,17 @@ class LcdDisplay(object):
         self.send_command(0x01)  # Clear Screen
 
 
+    def close(self):
+        """
+        Releases the SMBUS.
+        """
+
+        self.enable = False
+
+        if getattr(self, "__smbus__", None) is not None:
+            self.__smbus__.close()
+            self.__smbus__ = None
+
     def openlight(self):  # Enable the backlight
         """
         Turns on the backlight.
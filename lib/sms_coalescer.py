@@ -0,0 +1,261 @@
+"""
+Module to merge the text messages queued for the same
+number within a short window, so that one event (such
+as a command reply followed by "Heater turned ON")
+costs one send instead of several.
+"""
+
+import utilities
+from events import OutboundMessageEvent
+from sms_pdu import get_segment_count
+
+DEFAULT_WINDOW = 0.5  # Seconds a message may wait for others to the same number
+SEPARATOR = "\n"
+
+
+def pack_texts(texts):
+    """
+    Joins consecutive texts, in order, into as few
+    single segment messages as they fit in.
+    A text that needs more than one segment by
+    itself is left alone.
+    Returns a list of lists of the indexes of the
+    texts that go together.
+
+    >>> pack_texts(["a" * 100, "b" * 50, "c" * 20, "d" * 200, "e"])
+    [[0, 1], [2], [3], [4]]
+    >>> pack_texts(["ON", "Heater turned ON."])
+    [[0, 1]]
+    """
+
+    groups = []
+    group_text = None
+
+    for index, text in enumerate(texts):
+        if group_text is not None:
+            joined_text = group_text + SEPARATOR + text
+
+            if get_segment_count(joined_text) == 1:
+                groups[-1].append(index)
+                group_text = joined_text
+                continue
+
+        groups.append([index])
+        group_text = text if get_segment_count(text) == 1 else None
+
+    return groups
+
+
+class SmsCoalescer(object):
+    """
+    Holds outgoing messages for up to the window, and
+    then hands them back merged per number.
+    Messages at a priority that must not wait,
+    such as a gas warning, are handed back right away,
+    along with anything else waiting for that number.
+    The caller is responsible for locking.
+    """
+
+    def add(self, message):
+        """
+        Holds an OutboundMessageEvent.
+        """
+
+        if message.phone_number not in self.__pending__:
+            self.__pending__[message.phone_number] = []
+            self.__phone_numbers__.append(message.phone_number)
+
+        self.__pending__[message.phone_number].append(message)
+
+    def take_ready(self, flush=False):
+        """
+        Removes and returns the messages that have waited
+        long enough, merged, in the order they were added.
+        With flush, everything is returned.
+        """
+
+        now = utilities.get_monotonic_time()
+        ready_messages = []
+
+        for phone_number in list(self.__phone_numbers__):
+            messages = self.__pending__[phone_number]
+
+            if not flush and not self.__is_ready__(messages, now):
+                continue
+
+            del self.__pending__[phone_number]
+            self.__phone_numbers__.remove(phone_number)
+            ready_messages.extend(self.__merge__(messages))
+
+        return ready_messages
+
+    def get_seconds_until_ready(self):
+        """
+        Returns how long until something is ready,
+        or None if nothing is waiting.
+        """
+
+        if not self.__phone_numbers__:
+            return None
+
+        now = utilities.get_monotonic_time()
+
+        return max(0.0, min([self.__pending__[phone_number][0].created_time
+                             + self.__window__ - now
+                             for phone_number in self.__phone_numbers__]))
+
+    def get_pending_count(self):
+        """
+        Returns how many messages are being held.
+        """
+
+        return sum(len(messages) for messages in self.__pending__.values())
+
+    def get_merged_count(self):
+        """
+        Returns how many messages were sent as
+        part of a merged message.
+        """
+
+        return self.__merged_count__
+
+    def get_saved_send_count(self):
+        """
+        Returns how many sends merging has saved.
+        """
+
+        return self.__saved_send_count__
+
+    def __init__(self, window=DEFAULT_WINDOW, immediate_priorities=None):
+        """
+        Messages at one of the immediate priorities never wait.
+        """
+
+        if immediate_priorities is None:
+            immediate_priorities = []
+
+        self.__window__ = window
+        self.__immediate_priorities__ = immediate_priorities
+        self.__pending__ = {}
+        self.__phone_numbers__ = []
+        self.__merged_count__ = 0
+        self.__saved_send_count__ = 0
+
+    def __is_ready__(self, messages, now):
+        """
+        Returns True if the messages for a number should go.
+        """
+
+        if now - messages[0].created_time >= self.__window__:
+            return True
+
+        for message in messages:
+            if message.priority in self.__immediate_priorities__:
+                return True
+
+        return False
+
+    def __merge__(self, messages):
+        """
+        Merges the messages for one number into as few
+        sends as will hold them. A merged message goes at
+        the most urgent priority of its parts, is
+        retried as often and as late as the most patient
+        part, and stands for all of their journal records.
+        """
+
+        merged_messages = []
+
+        for group in pack_texts([message.text_message for message in messages]):
+            if len(group) == 1:
+                merged_messages.append(messages[group[0]])
+                continue
+
+            parts = [messages[index] for index in group]
+            deadlines = [part.deadline for part in parts]
+            merged_messages.append(OutboundMessageEvent(
+                parts[0].phone_number,
+                SEPARATOR.join([part.text_message for part in parts]),
+                max([part.retries_remaining for part in parts]),
+                min([part.priority for part in parts]),
+                sum([part.journal_ids for part in parts], []),
+                None if None in deadlines else max(deadlines)))
+
+            self.__merged_count__ += len(parts)
+            self.__saved_send_count__ += len(parts) - 1
+
+        return merged_messages
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+def test_messages_wait_and_merge():
+    """
+    Messages for the same number are held for the
+    window, then merged in order. Other numbers
+    are kept apart.
+    """
+
+    coalescer = SmsCoalescer(60)
+
+    coalescer.add(OutboundMessageEvent("2061234567", "Heater is ON.", 4, 1, [7]))
+    coalescer.add(OutboundMessageEvent("2067654321", "Heater turned ON.", 4, 4))
+    coalescer.add(OutboundMessageEvent("2061234567", "Heater turned ON.", 2, 4, [9], 30.0))
+
+    assert coalescer.take_ready() == []
+    assert coalescer.get_pending_count() == 3
+    assert coalescer.get_seconds_until_ready() > 59
+
+    messages = coalescer.take_ready(True)
+
+    assert [message.text_message for message in messages] \
+        == ["Heater is ON.\nHeater turned ON.", "Heater turned ON."]
+    assert messages[0].priority == 1
+    assert messages[0].retries_remaining == 4
+    assert messages[0].journal_ids == [7, 9]
+    assert messages[0].deadline is None
+    assert messages[1].deadline is None
+    assert coalescer.get_merged_count() == 2
+    assert coalescer.get_saved_send_count() == 1
+    assert coalescer.get_seconds_until_ready() is None
+
+
+def test_immediate_messages_do_not_wait():
+    """
+    A message at an immediate priority takes
+    everything for its number with it.
+    """
+
+    coalescer = SmsCoalescer(60, [0])
+
+    coalescer.add(OutboundMessageEvent("2061234567", "Heater turned OFF.", 4, 4))
+    coalescer.add(OutboundMessageEvent("2067654321", "Heater turned OFF.", 4, 4))
+    coalescer.add(OutboundMessageEvent("2061234567", "GAS DETECTED", 4, 0))
+
+    messages = coalescer.take_ready()
+
+    assert len(messages) == 1
+    assert messages[0].priority == 0
+    assert coalescer.get_pending_count() == 1
+
+    coalescer = SmsCoalescer(0)
+    coalescer.add(OutboundMessageEvent("2061234567", "x" * 200, 4, 4))
+    coalescer.add(OutboundMessageEvent("2061234567", "y", 4, 4))
+
+    assert len(coalescer.take_ready()) == 2
+    assert coalescer.get_saved_send_count() == 0
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+    test_messages_wait_and_merge()
+    test_immediate_messages_do_not_wait()
+
+    print "Tests finished"
@@ -0,0 +1,369 @@
+"""
+Module to hold the text messages read from the modem,
+and to parse the modem's text mode replies into them.
+
+A whole AT+CMGL listing is parsed in one pass with a
+single compiled pattern, and the time each message was
+sent is only worked out if something asks for it.
+"""
+
+import datetime
+import re
+import utilities
+
+# The SIM gives times in local time, this many hours from UTC.
+TIMEZONE_OFFSET = 8
+
+# +CMGL: 1,"REC UNREAD","+12061234567","","18/01/20,14:05:03-32"
+# followed by the text of the message on the next line.
+# The name field is optional, and may be left out entirely.
+LISTING_PATTERN = re.compile(
+    r'^\+CMGL: (\d+),"([^"]*)","([^"]*)",(?:"[^"]*")?,"([^"]*)"[^\n]*\n([^\n]*)$',
+    re.MULTILINE)
+# +CMGR: "REC UNREAD","+12061234567","","18/01/20,14:05:03-32"
+STORED_HEADER_PATTERN = re.compile(r'^\+CMGR: "([^"]*)","([^"]*)",(?:"[^"]*")?,"([^"]*)"')
+# +CMT: "+12061234567","","18/01/20,14:05:03-32"
+DELIVERED_HEADER_PATTERN = re.compile(r'^\+CMT: "([^"]*)",(?:"[^"]*")?,"([^"]*)"')
+
+
+def parse_sent_time(sent_time_text):
+    """
+    Turns the modem's "yy/MM/dd,hh:mm:ss+zz" into a
+    datetime, or None if it can not be read.
+
+    >>> parse_sent_time("18/01/20,14:05:03-32")
+    datetime.datetime(2018, 1, 20, 14, 5, 3)
+    >>> parse_sent_time("garbage") is None
+    True
+    """
+
+    try:
+        return datetime.datetime(2000 + int(sent_time_text[0:2]),
+                                 int(sent_time_text[3:5]),
+                                 int(sent_time_text[6:8]),
+                                 int(sent_time_text[9:11]),
+                                 int(sent_time_text[12:14]),
+                                 int(sent_time_text[15:17]))
+    except:
+        return None
+
+
+class SmsMessage(object):
+    """
+    Class to abstract a text message.
+    Slotted, as a busy SIM can hold a lot of them.
+    """
+
+    __slots__ = ["message_id",
+                 "sender_number",
+                 "message_status",
+                 "message_text",
+                 "received_time",
+                 "sent_time_utc",
+                 "part_ids",
+                 "__sent_time_text__",
+                 "__sent_time__"]
+
+    def get_sender_number(self):
+        """
+        Gets the sender's number.
+        """
+        if self.is_message_ok():
+            return utilities.get_cleaned_phone_number(self.sender_number)
+
+        return None
+
+    def is_message_ok(self):
+        """
+        Is the message valid?
+        """
+        return self.sender_number is not None and self.sent_time is not None
+
+    def minutes_waiting(self):
+        """
+        How many hours between being sent
+        and received.
+        """
+
+        return (self.received_time
+                - self.message_sent_time_utc()).days * 24 * 60
+
+    def message_sent_time_utc(self):
+        """
+        When was the message sent in UTC time?
+        The SIM card returns time as Local...
+        A PDU says which time zone, so that is used when known.
+        """
+
+        if self.sent_time_utc is not None:
+            return self.sent_time_utc
+
+        return (self.sent_time + datetime.timedelta(hours=TIMEZONE_OFFSET))
+
+    @property
+    def sent_time(self):
+        """
+        When the message was sent, in the SIM's local time.
+        Only worked out the first time it is asked for.
+        """
+
+        if self.__sent_time_text__ is not None:
+            self.__sent_time__ = parse_sent_time(self.__sent_time_text__)
+            self.__sent_time_text__ = None
+
+        return self.__sent_time__
+
+    @sent_time.setter
+    def sent_time(self, sent_time):
+        self.__sent_time__ = sent_time
+        self.__sent_time_text__ = None
+
+    def __init__(self,
+                 message_id=None,
+                 message_status=None,
+                 sender_number=None,
+                 sent_time_text=None,
+                 message_text=None,
+                 received_time=None):
+        """
+        Create the object.
+        """
+
+        if received_time is None:
+            received_time = datetime.datetime.now()
+
+        self.message_id = message_id
+        self.message_status = message_status
+        self.sender_number = sender_number
+        self.message_text = message_text
+        self.received_time = received_time
+        self.sent_time_utc = None
+        # The ids of the other parts of a long message.
+        self.part_ids = []
+        self.__sent_time_text__ = sent_time_text
+        self.__sent_time__ = None
+
+
+def parse_message_listing(listing, received_time=None):
+    """
+    Creates the messages in the reply to AT+CMGL,
+    given as the lines joined by newlines.
+
+    >>> messages = parse_message_listing(
+    ...     '+CMGL: 1,"REC READ","+12061234567","","18/01/20,14:05:03-32"\\n'
+    ...     + 'OK\\n'
+    ...     + '+CMGL: 2,"REC UNREAD","+12067654321",,"18/01/20,14:06:03-32"\\n'
+    ...     + 'Status, please')
+    >>> [(message.message_id, message.get_sender_number(), message.message_text)
+    ...  for message in messages]
+    [('1', '12061234567', 'OK'), ('2', '12067654321', 'Status, please')]
+    >>> messages[1].sent_time
+    datetime.datetime(2018, 1, 20, 14, 6, 3)
+    """
+
+    if received_time is None:
+        received_time = datetime.datetime.now()
+
+    return [SmsMessage(message_id, message_status, sender_number, sent_time_text,
+                       message_text, received_time)
+            for message_id, message_status, sender_number, sent_time_text, message_text
+            in LISTING_PATTERN.findall(listing)]
+
+
+def create_delivered_message(message_header, message_text):
+    """
+    Creates a message from a +CMT URC.
+    The message was never stored, so it has no id.
+
+    >>> message = create_delivered_message(
+    ...     '+CMT: "+12061234567","","18/01/20,14:05:03-32"', "STATUS")
+    >>> message.get_sender_number(), message.message_text, message.message_id
+    ('12061234567', 'STATUS', None)
+    """
+
+    match = DELIVERED_HEADER_PATTERN.match(message_header)
+
+    if match is None:
+        return SmsMessage(message_text=message_text)
+
+    return SmsMessage(None, "REC UNREAD", match.group(1), match.group(2), message_text)
+
+
+def create_stored_message(message_index, message_header, message_text):
+    """
+    Creates a message from the reply to AT+CMGR, which
+    leaves the index out of the header.
+
+    >>> message = create_stored_message(
+    ...     3, '+CMGR: "REC UNREAD","+12061234567","","18/01/20,14:05:03-32"', "ON")
+    >>> message.message_id, message.message_status, message.message_text
+    ('3', 'REC UNREAD', 'ON')
+    """
+
+    match = STORED_HEADER_PATTERN.match(message_header)
+
+    if match is None:
+        return SmsMessage(str(message_index), message_text=message_text)
+
+    return SmsMessage(str(message_index), match.group(1), match.group(2), match.group(3),
+                      message_text)
+
+
+def create_pdu_message(parts):
+    """
+    Creates a message from the sms_pdu.DeliverPdu parts
+    of a message, which are all stored separately.
+    """
+
+    first_part = parts[0]
+    message = SmsMessage(sender_number=first_part.sender,
+                         message_text="".join(part.text for part in parts))
+    message.part_ids = [str(part.message_index) for part in parts[1:]
+                        if part.message_index is not None]
+
+    if first_part.message_index is not None:
+        message.message_id = str(first_part.message_index)
+    message.sent_time = first_part.sent_time
+    message.sent_time_utc = first_part.get_sent_time_utc()
+
+    return message
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+def test_bad_messages_are_not_ok():
+    """
+    A header that can not be read gives a message
+    that is not ok, instead of an exception.
+    """
+
+    message = create_stored_message(4, '+CMGR: garbage', "ON")
+
+    assert message.message_id == "4"
+    assert not message.is_message_ok()
+    assert message.get_sender_number() is None
+
+    message = parse_message_listing(
+        '+CMGL: 1,"REC READ","+12061234567","","18/xx/20,14:05:03-32"\nON')[0]
+
+    assert not message.is_message_ok()
+    assert parse_message_listing('+CMGL: 1,"REC READ"\nON') == []
+
+
+######################
+# LISTING BENCHMARK  #
+######################
+
+
+def __parse_listing_by_lines__(message_lines):
+    """
+    The old parser: each header split on commas,
+    and every time parsed as the message was made.
+    """
+
+    class DictMessage(object):
+        """
+        The old, unslotted message.
+        """
+
+        def __init__(self, message_header, message_text):
+            self.message_id = None
+            self.sender_number = None
+            self.message_status = None
+            self.message_text = None
+            self.received_time = datetime.datetime.now()
+            self.sent_time = None
+            self.sent_time_utc = None
+            self.part_ids = []
+
+            try:
+                metadata_list = message_header.split(",")
+                date_tokens = metadata_list[4].replace('"', '').split('/')
+                time_tokens = metadata_list[5].split('-')[0].split(':')
+
+                self.message_id = metadata_list[0].rpartition(":")[2].strip()
+                self.sent_time = datetime.datetime.combine(
+                    datetime.datetime(
+                        int("20" + date_tokens[0]), int(date_tokens[1]), int(date_tokens[2])),
+                    datetime.time(
+                        int(time_tokens[0]), int(time_tokens[1]), int(time_tokens[2])))
+                self.sender_number = metadata_list[2]
+                self.message_status = metadata_list[1]
+                self.message_text = message_text
+                self.error_state = False
+            except:
+                self.error_state = True
+
+    messages = []
+
+    for line_index, message_header in enumerate(message_lines):
+        if "+CMGL:" in message_header and line_index + 1 < len(message_lines):
+            messages.append(DictMessage(message_header, message_lines[line_index + 1]))
+
+    return messages
+
+
+def __run_benchmark__(listing_count=2000, messages_per_listing=20):
+    """
+    Parses synthetic listings with the old parser, and
+    with parse_message_listing(), and compares the time
+    taken and the size of the messages.
+    """
+
+    import sys
+    import time
+
+    listings = []
+
+    for listing_number in range(listing_count):
+        message_lines = []
+
+        for message_number in range(messages_per_listing):
+            message_lines.append('+CMGL: ' + str(message_number + 1) + ',"REC UNREAD","+1206'
+                                 + str(1000000 + listing_number) + '","","18/01/20,14:'
+                                 + str(10 + message_number % 50) + ':03-32"')
+            message_lines.append("Status " + str(message_number))
+
+        listings.append(message_lines)
+
+    start_time = time.time()
+    old_messages = [__parse_listing_by_lines__(message_lines) for message_lines in listings]
+    old_time = time.time() - start_time
+
+    start_time = time.time()
+    new_messages = [parse_message_listing("\n".join(message_lines)) for message_lines in listings]
+    new_time = time.time() - start_time
+
+    message_count = listing_count * messages_per_listing
+    assert sum(len(messages) for messages in new_messages) == message_count
+    assert new_messages[-1][-1].message_text == old_messages[-1][-1].message_text
+    assert new_messages[-1][-1].sent_time == old_messages[-1][-1].sent_time
+
+    old_message = old_messages[0][0]
+    new_message = new_messages[0][0]
+
+    print "split per line: " + str(round(old_time * 1000000.0 / message_count, 2)) \
+        + " us/message, " + str(sys.getsizeof(old_message) + sys.getsizeof(old_message.__dict__)) \
+        + " bytes/message"
+    print "single pass: " + str(round(new_time * 1000000.0 / message_count, 2)) \
+        + " us/message, " + str(sys.getsizeof(new_message)) + " bytes/message"
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+    test_bad_messages_are_not_ok()
+
+    print "Tests finished"
+
+    print "Starting benchmark."
+
+    __run_benchmark__()
+
+    print "Benchmark finished"
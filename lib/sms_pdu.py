@@ -0,0 +1,630 @@
+# -*- coding: utf-8 -*-
+"""
+Module to encode and decode text messages in PDU mode
+(3GPP TS 23.040), the binary form the modem uses.
+
+Handles the GSM 7 bit alphabet and UCS-2, messages
+split over several parts (concatenated, with a user
+data header), and the service centre time stamp,
+including its time zone.
+
+Text is passed in and handed back as UTF-8 strings,
+like the rest of the messages in HangarBuddy.
+"""
+
+import binascii
+import datetime
+
+# The GSM 7 bit default alphabet, by septet value.
+GSM7_ALPHABET = u"@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?" \
+    u"¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+# Characters that take an escape and a second septet.
+GSM7_EXTENSION = {u"\f": 0x0A, u"^": 0x14, u"{": 0x28, u"}": 0x29, u"\\": 0x2F,
+                  u"[": 0x3C, u"~": 0x3D, u"]": 0x3E, u"|": 0x40, u"€": 0x65}
+GSM7_ESCAPE = 0x1B
+
+GSM7 = "GSM7"
+EIGHT_BIT = "8BIT"
+UCS2 = "UCS2"
+
+# How much fits in a single message, and in each part of a
+# message that has to be split (the rest holds the header).
+SINGLE_PART_LIMITS = {GSM7: 160, UCS2: 70}
+MULTIPART_LIMITS = {GSM7: 153, UCS2: 67}
+
+INTERNATIONAL_NUMBER = 0x91
+UNKNOWN_NUMBER = 0x81
+ALPHANUMERIC_ADDRESS = 0x50
+
+MESSAGE_TYPE_DELIVER = 0x00
+MESSAGE_TYPE_SUBMIT = 0x01
+VALIDITY_PERIOD_RELATIVE = 0x10
+USER_DATA_HEADER_INDICATOR = 0x40
+VALIDITY_PERIOD_FOUR_DAYS = 0xAA
+
+CONCATENATION_8_BIT = 0x00
+CONCATENATION_16_BIT = 0x08
+
+__GSM7_LOOKUP__ = dict((character, septet) for septet, character in enumerate(GSM7_ALPHABET))
+__GSM7_EXTENSION_LOOKUP__ = dict((septet, character)
+                                 for character, septet in GSM7_EXTENSION.items())
+
+
+def to_unicode(text):
+    """
+    Returns the text as unicode, reading a string as UTF-8.
+    """
+
+    if isinstance(text, unicode):
+        return text
+
+    return text.decode("utf-8", "replace")
+
+
+def to_utf8(text):
+    """
+    Returns the text as a UTF-8 string.
+    """
+
+    if isinstance(text, unicode):
+        return text.encode("utf-8")
+
+    return text
+
+
+def encode_gsm7(text):
+    """
+    Returns the septets for the text, or None if
+    it has characters outside the GSM alphabet.
+
+    >>> encode_gsm7("Hi {")
+    [72, 105, 32, 27, 40]
+    >>> encode_gsm7(u"☺") is None
+    True
+    """
+
+    septets = []
+
+    for character in to_unicode(text):
+        if character in __GSM7_LOOKUP__:
+            septets.append(__GSM7_LOOKUP__[character])
+        elif character in GSM7_EXTENSION:
+            septets.extend([GSM7_ESCAPE, GSM7_EXTENSION[character]])
+        else:
+            return None
+
+    return septets
+
+
+def decode_gsm7(septets):
+    """
+    Returns the text for the septets, as unicode.
+    """
+
+    characters = []
+    is_escaped = False
+
+    for septet in septets:
+        if is_escaped:
+            characters.append(__GSM7_EXTENSION_LOOKUP__.get(septet, u" "))
+            is_escaped = False
+        elif septet == GSM7_ESCAPE:
+            is_escaped = True
+        else:
+            characters.append(GSM7_ALPHABET[septet])
+
+    return u"".join(characters)
+
+
+def pack_septets(septets, padding_bits=0):
+    """
+    Packs septets into octets, after padding_bits
+    of fill that line them up behind a header.
+
+    >>> binascii.hexlify(pack_septets(encode_gsm7("hellohello"))).upper()
+    'E8329BFD4697D9EC37'
+    """
+
+    packed = bytearray()
+    bits = 0
+    bit_count = padding_bits
+
+    for septet in septets:
+        bits |= septet << bit_count
+        bit_count += 7
+
+        while bit_count >= 8:
+            packed.append(bits & 0xFF)
+            bits >>= 8
+            bit_count -= 8
+
+    if bit_count > 0:
+        packed.append(bits & 0xFF)
+
+    return packed
+
+
+def unpack_septets(octets, septet_count, padding_bits=0):
+    """
+    Unpacks septet_count septets from the octets,
+    skipping padding_bits of fill first.
+
+    >>> decode_gsm7(unpack_septets(binascii.unhexlify("E8329BFD4697D9EC37"), 10))
+    u'hellohello'
+    """
+
+    septets = []
+    bits = 0
+    bit_count = 0
+
+    for octet in bytearray(octets):
+        bits |= octet << bit_count
+        bit_count += 8
+
+        if padding_bits > 0:
+            bits >>= padding_bits
+            bit_count -= padding_bits
+            padding_bits = 0
+
+        while bit_count >= 7 and len(septets) < septet_count:
+            septets.append(bits & 0x7F)
+            bits >>= 7
+            bit_count -= 7
+
+    return septets
+
+
+def get_alphabet(data_coding_scheme):
+    """
+    Returns the alphabet the data coding scheme selects.
+
+    >>> get_alphabet(0x00), get_alphabet(0x08), get_alphabet(0xF4)
+    ('GSM7', 'UCS2', '8BIT')
+    """
+
+    coding_group = data_coding_scheme & 0xF0
+
+    if coding_group & 0xC0 == 0x00:
+        return [GSM7, EIGHT_BIT, UCS2, GSM7][(data_coding_scheme >> 2) & 0x03]
+
+    if coding_group == 0xF0:
+        return EIGHT_BIT if data_coding_scheme & 0x04 else GSM7
+
+    if coding_group == 0xE0:
+        return UCS2
+
+    return GSM7
+
+
+def encode_address(phone_number):
+    """
+    Returns the address field for a phone number.
+
+    >>> binascii.hexlify(encode_address("+12061234567"))
+    '0b912160214365f7'
+    """
+
+    if phone_number.startswith("+"):
+        number_type = INTERNATIONAL_NUMBER
+        phone_number = phone_number[1:]
+    else:
+        number_type = UNKNOWN_NUMBER
+
+    return bytearray([len(phone_number), number_type]) + encode_semi_octets(phone_number)
+
+
+def encode_semi_octets(digits):
+    """
+    Packs digits two to an octet, low nibble first,
+    padded with F.
+    """
+
+    if len(digits) % 2 == 1:
+        digits += "F"
+
+    return bytearray(binascii.unhexlify(
+        "".join(digits[index + 1] + digits[index] for index in range(0, len(digits), 2))))
+
+
+def decode_address(octets, position):
+    """
+    Reads an address field that starts at position.
+    Returns the address and the position after it.
+    """
+
+    digit_count = octets[position]
+    number_type = octets[position + 1]
+    octet_count = (digit_count + 1) / 2
+    address_octets = octets[position + 2:position + 2 + octet_count]
+
+    if number_type & 0x70 == ALPHANUMERIC_ADDRESS:
+        address = to_utf8(decode_gsm7(unpack_septets(address_octets, digit_count * 4 / 7)))
+    else:
+        address = decode_semi_octets(address_octets)[:digit_count]
+
+        if number_type == INTERNATIONAL_NUMBER:
+            address = "+" + address
+
+    return address, position + 2 + octet_count
+
+
+def decode_semi_octets(octets):
+    """
+    Unpacks digits stored two to an octet, low nibble first.
+    """
+
+    digits = binascii.hexlify(bytes(octets))
+
+    return "".join(digits[index + 1] + digits[index]
+                   for index in range(0, len(digits), 2)).upper().rstrip("F")
+
+
+def decode_timestamp(octets):
+    """
+    Reads a service centre time stamp.
+    Returns the local time it gives, and the minutes
+    that local time is ahead of UTC. The zone is in
+    quarter hours, with its sign in bit 3.
+
+    >>> decode_timestamp(bytearray(binascii.unhexlify("8110024150002B")))
+    (datetime.datetime(2018, 1, 20, 14, 5), -480)
+    """
+
+    fields = [(octet & 0x0F) * 10 + (octet >> 4) for octet in octets[:6]]
+    zone_octet = octets[6]
+    zone_minutes = ((zone_octet & 0x07) * 10 + (zone_octet >> 4)) * 15
+
+    if zone_octet & 0x08:
+        zone_minutes = -zone_minutes
+
+    return datetime.datetime(2000 + fields[0], fields[1], fields[2],
+                             fields[3], fields[4], fields[5]), zone_minutes
+
+
+def split_text(text):
+    """
+    Splits the text into the parts it would be sent as.
+    Returns the alphabet, and the list of parts.
+
+    >>> alphabet, parts = split_text("a" * 161)
+    >>> alphabet, [len(part) for part in parts]
+    ('GSM7', [153, 8])
+    >>> alphabet, parts = split_text(u"\\xb0" * 71)
+    >>> alphabet, [len(part) for part in parts]
+    ('UCS2', [67, 4])
+    """
+
+    text = to_unicode(text)
+    septets = encode_gsm7(text)
+
+    if septets is not None:
+        alphabet = GSM7
+        length = len(septets)
+    else:
+        alphabet = UCS2
+        length = len(text.encode("utf-16-be")) / 2
+
+    if length <= SINGLE_PART_LIMITS[alphabet]:
+        return alphabet, [text]
+
+    parts = []
+    part = u""
+    part_length = 0
+
+    for character in text:
+        character_length = __get_character_length__(alphabet, character)
+
+        # Whole characters only, so an escape or a surrogate
+        # pair is never split between parts.
+        if part_length + character_length > MULTIPART_LIMITS[alphabet]:
+            parts.append(part)
+            part = u""
+            part_length = 0
+
+        part += character
+        part_length += character_length
+
+    parts.append(part)
+
+    return alphabet, parts
+
+
+def get_segment_count(text):
+    """
+    Returns how many messages the text would be sent as.
+
+    >>> get_segment_count("a" * 160), get_segment_count("a" * 161)
+    (1, 2)
+    """
+
+    return len(split_text(text)[1])
+
+
+def __get_character_length__(alphabet, character):
+    """
+    Returns the septets, or UCS-2 code units, a character takes.
+    """
+
+    if alphabet == GSM7:
+        return len(encode_gsm7(character))
+
+    return len(character.encode("utf-16-be")) / 2
+
+
+def encode_submit_pdus(phone_number, text, concatenation_reference=0):
+    """
+    Encodes the text for sending to the phone number.
+    Returns a list with an entry for each part: the PDU
+    as hex, and the length AT+CMGS wants (the PDU without
+    the service centre, which is left to the modem).
+
+    >>> encode_submit_pdus("2061234567", "hellohello")
+    [('0011000A8102163254760000AA0AE8329BFD4697D9EC37', 22)]
+    """
+
+    alphabet, parts = split_text(text)
+    pdus = []
+
+    for sequence, part in enumerate(parts):
+        first_octet = MESSAGE_TYPE_SUBMIT | VALIDITY_PERIOD_RELATIVE
+        header = bytearray()
+
+        if len(parts) > 1:
+            first_octet |= USER_DATA_HEADER_INDICATOR
+            header = bytearray([5, CONCATENATION_8_BIT, 3,
+                                concatenation_reference & 0xFF, len(parts), sequence + 1])
+
+        if alphabet == GSM7:
+            data_coding_scheme = 0x00
+            septets = encode_gsm7(part)
+            header_septets = (len(header) * 8 + 6) / 7
+            user_data = header + pack_septets(septets, header_septets * 7 - len(header) * 8)
+            user_data_length = header_septets + len(septets)
+        else:
+            data_coding_scheme = 0x08
+            user_data = header + bytearray(part.encode("utf-16-be"))
+            user_data_length = len(user_data)
+
+        # No service centre, and the modem picks the message reference.
+        pdu = bytearray([0x00, first_octet, 0x00]) \
+            + encode_address(phone_number) \
+            + bytearray([0x00, data_coding_scheme, VALIDITY_PERIOD_FOUR_DAYS, user_data_length]) \
+            + user_data
+
+        pdus.append((binascii.hexlify(bytes(pdu)).upper(), len(pdu) - 1))
+
+    return pdus
+
+
+class DeliverPdu(object):
+    """
+    A received message, or one part of one.
+    """
+
+    def is_part(self):
+        """
+        Returns True if this is one part of a longer message.
+        """
+
+        return self.concatenation_total > 1
+
+    def get_sent_time_utc(self):
+        """
+        Returns when the message was sent, in UTC.
+        """
+
+        return self.sent_time - datetime.timedelta(minutes=self.utc_offset_minutes)
+
+    def __init__(self, pdu_hex, message_index=None):
+        """
+        Decodes a SMS-DELIVER PDU, as the modem gives it.
+        Message_index is where the modem stored it, if it did.
+        Raises ValueError if it is not a received message.
+        """
+
+        octets = bytearray(binascii.unhexlify(pdu_hex.strip()))
+        position = 1 + octets[0]
+        first_octet = octets[position]
+
+        if first_octet & 0x03 != MESSAGE_TYPE_DELIVER:
+            raise ValueError("Not a received message")
+
+        self.message_index = message_index
+        self.sender, position = decode_address(octets, position + 1)
+        data_coding_scheme = octets[position + 1]
+        self.sent_time, self.utc_offset_minutes = decode_timestamp(
+            octets[position + 2:position + 9])
+        user_data_length = octets[position + 9]
+        user_data = octets[position + 10:]
+
+        self.concatenation_reference = None
+        self.concatenation_total = 1
+        self.concatenation_sequence = 1
+        header_length = 0
+
+        if first_octet & USER_DATA_HEADER_INDICATOR:
+            header_length = user_data[0] + 1
+            self.__read_header__(user_data[1:header_length])
+
+        self.alphabet = get_alphabet(data_coding_scheme)
+
+        if self.alphabet == GSM7:
+            header_septets = (header_length * 8 + 6) / 7
+            text = decode_gsm7(unpack_septets(user_data, user_data_length)[header_septets:])
+        elif self.alphabet == UCS2:
+            text = bytes(user_data[header_length:user_data_length]).decode("utf-16-be", "replace")
+        else:
+            text = bytes(user_data[header_length:user_data_length]).decode("latin-1")
+
+        self.text = to_utf8(text)
+
+    def __read_header__(self, header):
+        """
+        Picks the concatenation out of the user data header.
+        """
+
+        position = 0
+
+        while position + 1 < len(header):
+            element_id = header[position]
+            element_length = header[position + 1]
+            element = header[position + 2:position + 2 + element_length]
+            position += 2 + element_length
+
+            if element_id == CONCATENATION_8_BIT and element_length == 3:
+                self.concatenation_reference = element[0]
+                self.concatenation_total = element[1]
+                self.concatenation_sequence = element[2]
+            elif element_id == CONCATENATION_16_BIT and element_length == 4:
+                self.concatenation_reference = (element[0] << 8) | element[1]
+                self.concatenation_total = element[2]
+                self.concatenation_sequence = element[3]
+
+
+class MultipartAssembler(object):
+    """
+    Holds the parts of long messages until
+    every part has arrived.
+    """
+
+    def add(self, part):
+        """
+        Adds a DeliverPdu. Returns all of the parts of its
+        message, in order, once they have all arrived,
+        otherwise None. A message in one part comes straight back.
+        """
+
+        if not part.is_part():
+            return [part]
+
+        key = (part.sender, part.concatenation_reference, part.concatenation_total)
+        parts = self.__messages__.setdefault(key, {})
+        # The same part read again, such as by a
+        # later listing, just replaces itself.
+        parts[part.concatenation_sequence] = part
+
+        if len(parts) < part.concatenation_total:
+            return None
+
+        del self.__messages__[key]
+
+        return [parts[sequence] for sequence in sorted(parts.keys())]
+
+    def expire(self, oldest_sent_time_utc):
+        """
+        Drops incomplete messages sent before the time.
+        Returns how many were dropped.
+        """
+
+        expired_keys = [key for key, parts in self.__messages__.items()
+                        if min(part.get_sent_time_utc() for part in parts.values())
+                        < oldest_sent_time_utc]
+
+        for key in expired_keys:
+            del self.__messages__[key]
+
+        return len(expired_keys)
+
+    def get_incomplete_count(self):
+        """
+        Returns how many messages are still missing parts.
+        """
+
+        return len(self.__messages__)
+
+    def __init__(self):
+        self.__messages__ = {}
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+def __make_deliver_pdu__(sender, text, concatenation=None):
+    """
+    Builds a received message, for the tests, by turning
+    a submit PDU around.
+    """
+
+    submit_hex = encode_submit_pdus(sender, text)[0][0]
+
+    if concatenation is not None:
+        submit_hex = encode_submit_pdus(sender, text * concatenation[1],
+                                        concatenation[0])[concatenation[2] - 1][0]
+
+    submit = bytearray(binascii.unhexlify(submit_hex))
+    first_octet = MESSAGE_TYPE_DELIVER | (submit[1] & USER_DATA_HEADER_INDICATOR)
+    address_end = 3 + 2 + (submit[3] + 1) / 2
+    timestamp = bytearray(binascii.unhexlify("8110024150002B"))
+
+    return binascii.hexlify(bytes(
+        bytearray([0x00, first_octet]) + submit[3:address_end]
+        + submit[address_end:address_end + 2] + timestamp + submit[address_end + 3:]))
+
+
+def test_round_trip():
+    """
+    GSM 7 bit (with an escaped character) and UCS-2
+    both come back as they went.
+    """
+
+    message = DeliverPdu(__make_deliver_pdu__("+12061234567", "Heat ON [90 min]"))
+
+    assert message.sender == "+12061234567"
+    assert message.text == "Heat ON [90 min]"
+    assert message.alphabet == GSM7
+    assert message.get_sent_time_utc() == datetime.datetime(2018, 1, 20, 22, 5, 0)
+    assert not message.is_part()
+
+    message = DeliverPdu(__make_deliver_pdu__("2061234567", u"Temp 20℃"))
+
+    assert message.alphabet == UCS2
+    assert message.text == u"Temp 20℃".encode("utf-8")
+
+
+def test_known_deliver_pdu():
+    """
+    A message as a real modem reports it, with a service centre.
+    """
+
+    message = DeliverPdu("07911326040000F0040B911346610089F60000208062917314080CC8F71D14969741F977FD07")
+
+    assert message.sender == "+31641600986"
+    assert message.text == "How are you?"
+    assert message.sent_time == datetime.datetime(2002, 8, 26, 19, 37, 41)
+
+
+def test_multipart_assembly():
+    """
+    The parts come back together in order, whatever
+    order they arrive in, and repeats are harmless.
+    """
+
+    text = "0123456789" * 10
+    assembler = MultipartAssembler()
+    parts = [DeliverPdu(__make_deliver_pdu__("+12061234567", text, (42, 2, sequence)))
+             for sequence in [2, 1]]
+
+    assert parts[0].is_part()
+    assert assembler.add(parts[0]) is None
+    assert assembler.add(parts[0]) is None
+    assert assembler.get_incomplete_count() == 1
+
+    assembled = assembler.add(parts[1])
+
+    assert "".join(part.text for part in assembled) == text * 2
+    assert assembler.get_incomplete_count() == 0
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+    test_round_trip()
+    test_known_deliver_pdu()
+    test_multipart_assembly()
+
+    print "Tests finished"
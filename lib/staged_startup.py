@@ -0,0 +1,175 @@
+"""
+Module to bring independent subsystems up at the
+same time, instead of one after another, and to
+report how long each one took.
+"""
+
+import sys
+import threading
+import utilities
+
+
+class StartupStage(object):
+    """
+    A single subsystem being brought up.
+    """
+
+    def __init__(self, stage_name, stage_callback):
+        self.name = stage_name
+        self.callback = stage_callback
+        self.result = None
+        self.error = None
+        self.duration = None
+        self.thread = None
+
+
+class StagedStartup(object):
+    """
+    Runs each stage on its own thread and waits for all of them.
+    A stage that raises is recorded as failed; the others
+    are still allowed to finish.
+    """
+
+    def add_stage(self, stage_name, stage_callback):
+        """
+        Adds a stage. The value the callback returns
+        is available from get_result() once run() finishes.
+        """
+
+        self.__stages__.append(StartupStage(stage_name, stage_callback))
+
+    def run(self):
+        """
+        Starts every stage, then waits for all of them.
+        Returns True if every stage succeeded.
+        """
+
+        start_time = utilities.get_monotonic_time()
+
+        for stage in self.__stages__:
+            stage.thread = threading.Thread(name="startup_" + stage.name,
+                                            target=self.__run_stage__,
+                                            args=(stage,))
+            stage.thread.daemon = True
+            stage.thread.start()
+
+        for stage in self.__stages__:
+            stage.thread.join()
+
+        self.__total_duration__ = utilities.get_monotonic_time() - start_time
+
+        for stage in self.__stages__:
+            if stage.error is not None:
+                self.__log__("STARTUP: " + stage.name + " failed:" + str(stage.error))
+
+        self.__log__("STARTUP: " + self.describe())
+
+        return len(self.get_failed_stages()) == 0
+
+    def get_result(self, stage_name):
+        """
+        Returns what the stage's callback returned.
+        """
+
+        for stage in self.__stages__:
+            if stage.name == stage_name:
+                return stage.result
+
+        return None
+
+    def get_failed_stages(self):
+        """
+        Returns the names of the stages that raised.
+        """
+
+        return [stage.name for stage in self.__stages__ if stage.error is not None]
+
+    def describe(self):
+        """
+        Returns the per-stage timings, suitable for the log.
+        """
+
+        timings = []
+
+        for stage in self.__stages__:
+            if stage.duration is None:
+                timings.append(stage.name + "=?")
+            else:
+                timings.append(stage.name + "=" + str(round(stage.duration, 2)) + "s")
+
+        return "total=" + str(round(self.__total_duration__, 2)) + "s " \
+            + ", ".join(timings)
+
+    def __init__(self, logger=None):
+        self.__logger__ = logger
+        self.__stages__ = []
+        self.__total_duration__ = 0.0
+
+    def __run_stage__(self, stage):
+        """
+        Runs a stage and records how it went.
+        """
+
+        start_time = utilities.get_monotonic_time()
+
+        try:
+            stage.result = stage.callback()
+        except:
+            stage.error = sys.exc_info()[0]
+
+        stage.duration = utilities.get_monotonic_time() - start_time
+
+    def __log__(self, message):
+        """
+        Logs, if there is a logger.
+        """
+
+        if self.__logger__ is not None:
+            self.__logger__.log_info_message(message)
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+def test_stages_overlap():
+    """
+    Two slow stages take as long as the slowest,
+    not as long as both together.
+    """
+
+    import time
+
+    startup = StagedStartup()
+    startup.add_stage("first", lambda: time.sleep(0.2) or 1)
+    startup.add_stage("second", lambda: time.sleep(0.2) or 2)
+
+    start_time = utilities.get_monotonic_time()
+    assert startup.run()
+    assert utilities.get_monotonic_time() - start_time < 0.35
+    assert startup.get_result("first") == 1
+    assert startup.get_result("second") == 2
+
+
+def test_failed_stage():
+    """
+    A failing stage is reported without stopping the others.
+    """
+
+    startup = StagedStartup()
+    startup.add_stage("broken", lambda: 1 / 0)
+    startup.add_stage("working", lambda: "OK")
+
+    assert not startup.run()
+    assert startup.get_failed_stages() == ["broken"]
+    assert startup.get_result("working") == "OK"
+
+
+if __name__ == '__main__':
+    print "Starting tests."
+
+    test_stages_overlap()
+    test_failed_stage()
+
+    print "Tests finished"
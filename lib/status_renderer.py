@@ -0,0 +1,152 @@
+"""
+Module to build status replies that know what they
+will cost to send.
+
+Each piece of the status has a verbose form (the
+sentences the HangarBuddy has always sent) and a terse,
+fixed field form, such as "HTR:OFF". The profile picks
+which is sent, and every reply says how many SMS
+segments it takes.
+"""
+
+from sms_pdu import split_text
+
+VERBOSE = "VERBOSE"
+TERSE = "TERSE"
+PROFILES = [VERBOSE, TERSE]
+
+# One field per line in both profiles; a newline
+# costs no more than any other separator.
+FIELD_SEPARATOR = "\n"
+
+
+def get_terse_time_text(number_of_seconds):
+    """
+    Returns the time in the fewest characters.
+
+    >>> get_terse_time_text(42)
+    '42s'
+    >>> get_terse_time_text(600)
+    '10m'
+    >>> get_terse_time_text(60 * 60 * 5 + 60 * 12)
+    '5h12m'
+    >>> get_terse_time_text(60 * 60 * 24 * 3 + 60 * 60 * 4)
+    '3d4h'
+    """
+
+    number_of_seconds = max(0, int(number_of_seconds))
+
+    if number_of_seconds < 60:
+        return str(number_of_seconds) + "s"
+
+    if number_of_seconds < 60 * 60:
+        return str(number_of_seconds / 60) + "m"
+
+    if number_of_seconds < 60 * 60 * 24:
+        return str(number_of_seconds / (60 * 60)) + "h" \
+            + str((number_of_seconds / 60) % 60) + "m"
+
+    return str(number_of_seconds / (60 * 60 * 24)) + "d" \
+        + str((number_of_seconds / (60 * 60)) % 24) + "h"
+
+
+def describe_segments(text):
+    """
+    Returns how the text will be sent, suitable for the log.
+
+    >>> describe_segments("Heater is OFF.")
+    '1 segment(s) GSM7/14'
+    >>> describe_segments("x" * 161)
+    '2 segment(s) GSM7/161'
+    """
+
+    rendered = RenderedStatus(text)
+
+    return str(rendered.segment_count) + " segment(s) " \
+        + rendered.alphabet + "/" + str(len(text))
+
+
+class RenderedStatus(object):
+    """
+    A reply, and what it will take to send it.
+    """
+
+    def __init__(self, text):
+        alphabet, parts = split_text(text)
+
+        self.text = text
+        self.alphabet = alphabet
+        self.segment_count = len(parts)
+
+
+class StatusRenderer(object):
+    """
+    Collects the fields of a status reply, and
+    renders them in the chosen profile.
+    """
+
+    def add(self, verbose_text, terse_text):
+        """
+        Adds a field, in both of its forms.
+        """
+
+        self.__fields__.append((verbose_text, terse_text))
+
+    def render(self, profile=None):
+        """
+        Returns the status as a RenderedStatus,
+        in the profile given, or the renderer's own.
+        """
+
+        if profile is None:
+            profile = self.__profile__
+
+        if profile == TERSE:
+            texts = [terse_text for _, terse_text in self.__fields__]
+        else:
+            texts = [verbose_text for verbose_text, _ in self.__fields__]
+
+        return RenderedStatus(FIELD_SEPARATOR.join(texts))
+
+    def __init__(self, profile=VERBOSE):
+        self.__profile__ = profile
+        self.__fields__ = []
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+def test_profiles():
+    """
+    The terse profile fits in one segment
+    where the verbose one does not.
+    """
+
+    renderer = StatusRenderer(TERSE)
+    renderer.add("Heater is ON.\n1.5 hours left.", "HTR:ON 1h30m")
+    renderer.add("Gas reading=236", "GAS:236")
+    renderer.add("123 LUX of light.\nHangar is Bright. Lights on?", "LUX:123 bright")
+    renderer.add("TEMP: 72F", "T:72F")
+    renderer.add("CSQ:17 Good\nBAT:95% V:42", "CSQ:17 Good\nBAT:95% 4.2V")
+    renderer.add("1.5 hours", "UP:1h30m")
+
+    terse = renderer.render()
+    verbose = renderer.render(VERBOSE)
+
+    assert terse.text.startswith("HTR:ON 1h30m\nGAS:236\n")
+    assert terse.segment_count == 1
+    assert len(terse.text) < len(verbose.text)
+    assert verbose.text.endswith("V:42\n1.5 hours")
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+    test_profiles()
+
+    print "Tests finished"
@@ -0,0 +1,162 @@
+"""
+Module to keep fixed-size timing histograms
+for the recurring tasks.
+"""
+
+import threading
+
+# Upper limit (in seconds) of each bucket.
+# Anything slower lands in the final overflow bucket.
+DEFAULT_BUCKET_LIMITS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5,
+                         1.0, 2.0, 5.0, 10.0, 30.0, 60.0]
+
+
+class Histogram(object):
+    """
+    Counts samples into a fixed set of buckets,
+    so the memory used never grows.
+    """
+
+    def add(self, value):
+        """
+        Records a sample.
+        """
+
+        bucket_index = len(self.bucket_limits)
+
+        for index, limit in enumerate(self.bucket_limits):
+            if value <= limit:
+                bucket_index = index
+                break
+
+        self.__lock__.acquire()
+        try:
+            self.bucket_counts[bucket_index] += 1
+            self.count += 1
+            self.total += value
+            self.maximum = max(self.maximum, value)
+        finally:
+            self.__lock__.release()
+
+    def get_mean(self):
+        """
+        Returns the average of the samples.
+
+        >>> histogram = Histogram()
+        >>> histogram.add(1.0)
+        >>> histogram.add(2.0)
+        >>> histogram.get_mean()
+        1.5
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        return self.total / self.count
+
+    def get_percentile(self, percentile):
+        """
+        Returns the upper limit of the bucket that holds the
+        given percentile (0-100) of the samples.
+        The overflow bucket reports the largest sample seen.
+
+        >>> histogram = Histogram([1.0, 2.0, 3.0])
+        >>> for sample in [0.5, 0.5, 1.5, 2.5]:
+        ...     histogram.add(sample)
+        >>> histogram.get_percentile(50)
+        1.0
+        >>> histogram.get_percentile(100)
+        3.0
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        samples_needed = max(1, int(round(self.count * percentile / 100.0)))
+        samples_seen = 0
+
+        for index, bucket_count in enumerate(self.bucket_counts):
+            samples_seen += bucket_count
+
+            if samples_seen >= samples_needed:
+                if index < len(self.bucket_limits):
+                    return self.bucket_limits[index]
+
+                break
+
+        return self.maximum
+
+    def describe(self):
+        """
+        Returns a short summary, suitable for the log.
+        """
+
+        return "n=" + str(self.count) \
+            + " avg=" + str(round(self.get_mean(), 3)) \
+            + " p50<=" + str(self.get_percentile(50)) \
+            + " p99<=" + str(self.get_percentile(99)) \
+            + " max=" + str(round(self.maximum, 3))
+
+    def __init__(self, bucket_limits=None):
+        if bucket_limits is None:
+            bucket_limits = DEFAULT_BUCKET_LIMITS
+
+        self.bucket_limits = bucket_limits
+        self.bucket_counts = [0] * (len(bucket_limits) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.__lock__ = threading.Lock()
+
+
+class TaskMetrics(object):
+    """
+    The timing metrics for a single recurring task.
+    """
+
+    def record_run(self, drift, duration, interval):
+        """
+        Records one run of the task.
+        Drift is how late the run started compared to its schedule.
+        """
+
+        self.start_drift.add(max(0.0, drift))
+        self.callback_duration.add(duration)
+
+        if duration > interval:
+            self.overrun_count += 1
+
+    def record_exception(self):
+        """
+        Records that the callback raised.
+        """
+
+        self.exception_count += 1
+
+    def describe(self):
+        """
+        Returns a short summary, suitable for the log.
+        """
+
+        return self.task_name \
+            + ": drift(" + self.start_drift.describe() + ")" \
+            + ", duration(" + self.callback_duration.describe() + ")" \
+            + ", overruns=" + str(self.overrun_count) \
+            + ", exceptions=" + str(self.exception_count)
+
+    def __init__(self, task_name):
+        self.task_name = task_name
+        self.start_drift = Histogram()
+        self.callback_duration = Histogram()
+        self.overrun_count = 0
+        self.exception_count = 0
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+
+    print "Tests finished"
@@ -0,0 +1,530 @@
+"""
+Module to listen to the modem for unsolicited result
+codes (URCs), such as +CMTI for a new text message,
+and to keep them apart from the replies to AT commands.
+
+A single listener thread does all of the reading from
+the serial port. Notifications go to typed handlers,
+and everything else is handed to the AT command engine.
+"""
+
+import collections
+import sys
+import threading
+import time
+import utilities
+from at_command import PROMPT_LINE, TEXT_HEADERS
+from serial_reader import SerialReader
+
+LISTEN_TIMEOUT = 1.0  # Seconds a read may block, so stop() is noticed
+MAXIMUM_READ_FAILURES = 5  # Failed reads in a row before the port is thought gone
+
+
+class Urc(object):
+    """
+    A notification the modem sent on its own.
+    """
+
+    # True if the notification is followed by a line of text.
+    HAS_TEXT = False
+
+    def __init__(self, line):
+        self.line = line
+        self.text = None
+        self.received_time = utilities.get_monotonic_time()
+
+
+class NewMessageUrc(Urc):
+    """
+    +CMTI: "SM",3
+    A text message was stored at the index.
+    """
+
+    def __init__(self, line):
+        Urc.__init__(self, line)
+        fields = line.partition(":")[2].split(",")
+        self.storage = fields[0].strip().strip('"')
+        self.index = int(fields[1])
+
+
+class MessageUrc(Urc):
+    """
+    +CMT: "+12061234567","","18/01/20,14:05:03-32"
+    A text message delivered straight to us,
+    with the text on the following line.
+    """
+
+    HAS_TEXT = True
+
+
+class RingUrc(Urc):
+    """
+    RING
+    An incoming call.
+    """
+
+
+class StatusReportUrc(Urc):
+    """
+    +CDS: 6,12,"+12061234567",145,...
+    A delivery report for a message we sent.
+    """
+
+    def __init__(self, line):
+        Urc.__init__(self, line)
+        fields = line.partition(":")[2].split(",")
+        self.message_reference = int(fields[1])
+
+
+class UnderVoltageUrc(Urc):
+    """
+    UNDER-VOLTAGE WARNNING or UNDER-VOLTAGE POWER DOWN
+    (the misspelling is the modem's).
+    """
+
+    def __init__(self, line):
+        Urc.__init__(self, line)
+        self.is_power_down = "POWER DOWN" in line
+
+
+class ModemStatusUrc(Urc):
+    """
+    RDY, Call Ready, SMS Ready, NORMAL POWER DOWN, and so on.
+    The modem has started, restarted, or is turning off.
+    """
+
+
+# Checked in order, so longer prefixes go first.
+URC_PREFIXES = [("+CMTI:", NewMessageUrc),
+                ("+CMT:", MessageUrc),
+                ("+CDS:", StatusReportUrc),
+                ("RING", RingUrc),
+                ("UNDER-VOLTAGE", UnderVoltageUrc),
+                ("OVER-VOLTAGE", UnderVoltageUrc),
+                ("RDY", ModemStatusUrc),
+                ("Call Ready", ModemStatusUrc),
+                ("SMS Ready", ModemStatusUrc),
+                ("NORMAL POWER DOWN", ModemStatusUrc),
+                ("+CFUN:", ModemStatusUrc),
+                ("+CPIN:", ModemStatusUrc)]
+
+
+def parse_urc(line):
+    """
+    Returns the URC the line starts, or None if the
+    line is part of the reply to a command.
+
+    >>> parse_urc('+CMTI: "SM",3').index
+    3
+    >>> parse_urc("+CSQ: 17,0") is None
+    True
+    """
+
+    for prefix, urc_type in URC_PREFIXES:
+        if line.startswith(prefix):
+            try:
+                return urc_type(line)
+            except (ValueError, IndexError):
+                return Urc(line)
+
+    return None
+
+
+class UrcDispatcher(object):
+    """
+    Routes each URC to the handlers for its type.
+    """
+
+    def add_handler(self, urc_type, handler):
+        """
+        Calls the handler with every URC of the given type
+        (or a subclass of it). Handlers run on the
+        listener thread and must not send AT commands.
+        """
+
+        self.__handlers__.append([urc_type, handler])
+
+    def dispatch(self, urc):
+        """
+        Hands the URC to its handlers.
+        Returns how many handlers were called.
+        """
+
+        handler_count = 0
+        self.__urc_count__ += 1
+
+        for urc_type, handler in self.__handlers__:
+            if not isinstance(urc, urc_type):
+                continue
+
+            handler_count += 1
+
+            try:
+                handler(urc)
+            except:
+                self.__log__("URC: Handler failed for " + urc.line + ":"
+                             + str(sys.exc_info()[0]))
+
+        if handler_count == 0:
+            self.__log__("URC: Unhandled " + urc.line)
+
+        return handler_count
+
+    def get_urc_count(self):
+        """
+        Returns how many URCs have been dispatched.
+        """
+
+        return self.__urc_count__
+
+    def __init__(self, logger=None):
+        self.__logger__ = logger
+        self.__handlers__ = []
+        self.__urc_count__ = 0
+
+    def __log__(self, message):
+        """
+        Logs, if there is a logger.
+        """
+
+        if self.__logger__ is not None:
+            self.__logger__.log_info_message(message)
+
+
+class SerialListener(object):
+    """
+    The only reader of the serial port.
+    URCs are dispatched as they arrive, and the replies
+    to commands are queued for the AT command engine.
+    A failed read is tried again after a pause. If the
+    reads keep failing, the read failure handler is told.
+    """
+
+    def start(self):
+        """
+        Starts the listener thread.
+        """
+
+        if self.__thread__ is not None or self.__serial_connection__ is None:
+            return
+
+        # A read that blocks forever would never see stop().
+        self.__serial_connection__.timeout = LISTEN_TIMEOUT
+
+        self.__thread__ = threading.Thread(name="urc_listener", target=self.__run__)
+        self.__thread__.daemon = True
+        self.__thread__.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops the listener thread.
+        """
+
+        self.__is_stopped__ = True
+
+        if self.__thread__ is not None \
+                and self.__thread__ is not threading.current_thread():
+            self.__thread__.join(timeout)
+
+    def get_response(self, timeout):
+        """
+        Returns the next line of a reply, PROMPT_LINE if
+        the modem is waiting for text, or None on timeout.
+        """
+
+        self.__condition__.acquire()
+        try:
+            if not self.__responses__:
+                self.__condition__.wait(timeout)
+
+            if self.__responses__:
+                return self.__responses__.popleft()
+
+            return None
+        finally:
+            self.__condition__.release()
+
+    def wait_for_response(self, timeout):
+        """
+        Returns True once there is a reply line waiting.
+        """
+
+        self.__condition__.acquire()
+        try:
+            if not self.__responses__:
+                self.__condition__.wait(timeout)
+
+            return len(self.__responses__) > 0
+        finally:
+            self.__condition__.release()
+
+    def discard(self):
+        """
+        Drops any reply lines nobody read.
+        Returns them, joined, for logging.
+        """
+
+        self.__condition__.acquire()
+        try:
+            stale_lines = "\n".join(self.__responses__)
+            self.__responses__.clear()
+
+            return stale_lines
+        finally:
+            self.__condition__.release()
+
+    def __init__(self,
+                 serial_connection,
+                 urc_dispatcher,
+                 logger=None,
+                 serial_reader=None,
+                 read_failure_handler=None):
+        if serial_reader is None:
+            serial_reader = SerialReader(serial_connection)
+
+        self.__serial_connection__ = serial_connection
+        self.__urc_dispatcher__ = urc_dispatcher
+        self.__logger__ = logger
+        self.__serial_reader__ = serial_reader
+        self.__read_failure_handler__ = read_failure_handler
+        self.__condition__ = threading.Condition()
+        self.__responses__ = collections.deque()
+        self.__urc_waiting_for_text__ = None
+        self.__is_text_next__ = False
+        self.__is_stopped__ = False
+        self.__thread__ = None
+
+    def __run__(self):
+        """
+        The listener thread.
+        """
+
+        read_failure_count = 0
+
+        while not self.__is_stopped__:
+            try:
+                first_byte = self.__serial_connection__.read(1)
+            except:
+                if self.__is_stopped__:
+                    return
+
+                read_failure_count += 1
+                self.__on_read_failure__(read_failure_count, str(sys.exc_info()[1]))
+                time.sleep(LISTEN_TIMEOUT)
+                continue
+
+            read_failure_count = 0
+
+            if not first_byte:
+                continue
+
+            self.__serial_reader__.feed(first_byte)
+            self.__serial_reader__.fill()
+            self.process_buffered_lines()
+
+    def __on_read_failure__(self, read_failure_count, error_text):
+        """
+        Logs the first of a run of failed reads, and tells
+        the read failure handler every time the run
+        reaches the limit, so it can reopen the port.
+        """
+
+        if read_failure_count == 1 and self.__logger__ is not None:
+            self.__logger__.log_warning_message("URC: Serial read failed:" + error_text)
+
+        if read_failure_count % MAXIMUM_READ_FAILURES == 0 \
+                and self.__read_failure_handler__ is not None:
+            self.__read_failure_handler__(error_text)
+
+    def process_buffered_lines(self):
+        """
+        Sorts the complete lines in the buffer into
+        URCs and replies. The line after a +CMGL or +CMGR
+        header is message text, and part of the reply even
+        if it reads like a URC, such as "RDY to go".
+        """
+
+        replies = []
+
+        while True:
+            line = self.__serial_reader__.read_line()
+
+            if line is None:
+                break
+
+            if self.__urc_waiting_for_text__ is not None:
+                urc = self.__urc_waiting_for_text__
+                self.__urc_waiting_for_text__ = None
+                urc.text = line
+                self.__urc_dispatcher__.dispatch(urc)
+                continue
+
+            if self.__is_text_next__:
+                replies.append(line)
+                self.__is_text_next__ = False
+                continue
+
+            urc = parse_urc(line)
+
+            if urc is None:
+                replies.append(line)
+                self.__is_text_next__ = self.__is_text_header__(line)
+            elif urc.HAS_TEXT:
+                self.__urc_waiting_for_text__ = urc
+            else:
+                self.__urc_dispatcher__.dispatch(urc)
+
+        if self.__serial_reader__.take_prompt():
+            replies.append(PROMPT_LINE)
+
+        if replies:
+            self.__condition__.acquire()
+            try:
+                self.__responses__.extend(replies)
+                self.__condition__.notify_all()
+            finally:
+                self.__condition__.release()
+
+    def __is_text_header__(self, line):
+        """
+        Returns True if the next line is the text of a message.
+        """
+
+        for header in TEXT_HEADERS:
+            if line.startswith(header):
+                return True
+
+        return False
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+def test_urcs_are_kept_apart_from_replies():
+    """
+    URCs in the middle of a reply go to the handlers,
+    and the reply is left whole.
+    """
+
+    received = []
+    dispatcher = UrcDispatcher()
+    dispatcher.add_handler(NewMessageUrc, lambda urc: received.append(urc.index))
+    dispatcher.add_handler(MessageUrc, lambda urc: received.append(urc.text))
+
+    reader = SerialReader(None)
+    listener = SerialListener(None, dispatcher, serial_reader=reader)
+
+    reader.feed('AT+CSQ\r\r\n+CMTI: "SM",4\r\n+CSQ: 17,0\r\n'
+                + '+CMT: "+12061234567","","18/01/20,14:05:03-32"\r\nON\r\n'
+                + '\r\nOK\r\n\r\n> ')
+    listener.process_buffered_lines()
+
+    assert received == [4, "ON"]
+    assert listener.get_response(0) == "AT+CSQ"
+    assert listener.get_response(0) == "+CSQ: 17,0"
+    assert listener.get_response(0) == "OK"
+    assert listener.get_response(0) == PROMPT_LINE
+    assert listener.get_response(0) is None
+
+
+def test_message_text_that_reads_like_a_urc():
+    """
+    The text of a listed or read message stays in the
+    reply, even when it starts like a URC.
+    """
+
+    received = []
+    dispatcher = UrcDispatcher()
+    dispatcher.add_handler(Urc, lambda urc: received.append(urc.line))
+
+    reader = SerialReader(None)
+    listener = SerialListener(None, dispatcher, serial_reader=reader)
+
+    reader.feed('+CMGL: 1,"REC READ","+12061234567","","18/01/20,14:05:03-32"\r\n'
+                + 'RDY to go\r\n'
+                + '+CMGL: 2,"REC READ","+12061234567","","18/01/20,14:06:03-32"\r\n'
+                + '+CMT: is not a URC here\r\n'
+                + '\r\nOK\r\n'
+                + '+CMGR: "REC READ","+12061234567","","18/01/20,14:07:03-32"\r\n'
+                + 'RING me\r\n'
+                + '\r\nOK\r\nRING\r\n')
+    listener.process_buffered_lines()
+
+    assert received == ["RING"]
+    assert listener.get_response(0).startswith("+CMGL: 1")
+    assert listener.get_response(0) == "RDY to go"
+    assert listener.get_response(0).startswith("+CMGL: 2")
+    assert listener.get_response(0) == "+CMT: is not a URC here"
+    assert listener.get_response(0) == "OK"
+    assert listener.get_response(0).startswith("+CMGR:")
+    assert listener.get_response(0) == "RING me"
+    assert listener.get_response(0) == "OK"
+    assert listener.get_response(0) is None
+
+
+def test_reply_after_a_read_error():
+    """
+    A failed read does not stop the listener,
+    and the reply that follows is still delivered.
+    """
+
+    class FlakySerialConnection(object):
+        """
+        Fails the first read, then has the reply.
+        """
+
+        def read(self, size=1):
+            if self.is_failing:
+                self.is_failing = False
+                raise IOError("device reports readiness to read but returned no data")
+
+            data = self.data[:size]
+            self.data = self.data[size:]
+
+            return data
+
+        def inWaiting(self):
+            return len(self.data)
+
+        def __init__(self, data):
+            self.data = data
+            self.is_failing = True
+            self.timeout = None
+
+    serial_connection = FlakySerialConnection("\r\nOK\r\n")
+    listener = SerialListener(serial_connection, UrcDispatcher())
+    listener.start()
+
+    try:
+        assert listener.get_response(LISTEN_TIMEOUT * 5) == "OK"
+        assert listener.__thread__.is_alive()
+    finally:
+        listener.stop(LISTEN_TIMEOUT * 2)
+
+
+def test_typed_urcs():
+    """
+    Each URC is parsed into its type.
+    """
+
+    assert isinstance(parse_urc("RING"), RingUrc)
+    assert parse_urc("+CDS: 6,12,\"+12061234567\",145").message_reference == 12
+    assert parse_urc("UNDER-VOLTAGE POWER DOWN").is_power_down
+    assert not parse_urc("UNDER-VOLTAGE WARNNING").is_power_down
+    assert isinstance(parse_urc("Call Ready"), ModemStatusUrc)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    print "Starting tests."
+
+    doctest.testmod()
+    test_urcs_are_kept_apart_from_replies()
+    test_message_text_that_reads_like_a_urc()
+    test_reply_after_a_read_error()
+    test_typed_urcs()
+
+    print "Tests finished"
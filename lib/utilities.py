@@ -3,9 +3,61 @@ Module to hold common utilities.
 """
 
 import subprocess
+import time
+import ctypes
+import ctypes.util
 import local_debug
 
 DEFAULT_POWER_CYCLE_DELAY = 2 # Time to allow for responses to be sent
+CLOCK_MONOTONIC = 1  # From <linux/time.h>
+
+
+class __TimeSpec__(ctypes.Structure):
+    """
+    Mirrors the C "struct timespec" for clock_gettime.
+    """
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def __get_clock_gettime__():
+    """
+    Returns the libc clock_gettime function, or None
+    if it is not available on this platform.
+    """
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = libc.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(__TimeSpec__)]
+
+        return clock_gettime
+    except:
+        return None
+
+
+__CLOCK_GETTIME__ = None if local_debug.is_debug() else __get_clock_gettime__()
+
+
+def get_monotonic_time():
+    """
+    Returns the number of seconds from a clock that
+    never goes backwards, even if the system clock
+    is set by NTP or the cell network.
+
+    Falls back to the wall clock when there is no
+    monotonic clock available.
+
+    >>> get_monotonic_time() <= get_monotonic_time()
+    True
+    """
+
+    if __CLOCK_GETTIME__ is not None:
+        time_spec = __TimeSpec__()
+        if __CLOCK_GETTIME__(CLOCK_MONOTONIC, ctypes.pointer(time_spec)) == 0:
+            return time_spec.tv_sec + (time_spec.tv_nsec * 1e-9)
+
+    return time.time()
+
 
 def get_singular_or_plural(value, unit):
     """
@@ -0,0 +1,102 @@
+"""
+Module to let the main service loop sleep until
+there is actually something for it to do.
+"""
+
+import threading
+
+DEFAULT_MAXIMUM_IDLE_SECONDS = 10
+
+
+class WakeupEvent(object):
+    """
+    A single wakeup source that is shared by everything
+    that produces work for the main service loop.
+
+    Producers call signal() after queuing work.
+    The service loop blocks in wait() until one of
+    them does, or until the timeout expires.
+    """
+
+    def signal(self, reason):
+        """
+        Wakes up the service loop.
+        The reason is only kept for logging and diagnosis.
+        """
+
+        self.__condition__.acquire()
+        try:
+            self.__reasons__.append(reason)
+            self.__condition__.notify_all()
+        finally:
+            self.__condition__.release()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until signaled, or the timeout (in seconds) expires.
+        Returns the list of reasons that were signaled,
+        which is empty if the timeout expired.
+        """
+
+        if timeout is not None and timeout < 0:
+            timeout = 0
+
+        self.__condition__.acquire()
+        try:
+            if not self.__reasons__ and (timeout is None or timeout > 0):
+                self.__condition__.wait(timeout)
+
+            reasons = self.__reasons__
+            self.__reasons__ = []
+        finally:
+            self.__condition__.release()
+
+        return reasons
+
+    def is_set(self):
+        """
+        Returns True if there is a pending signal.
+        """
+
+        return len(self.__reasons__) > 0
+
+    def __init__(self):
+        """
+        Creates a new wakeup source.
+        """
+
+        self.__condition__ = threading.Condition(threading.Lock())
+        self.__reasons__ = []
+
+
+##############
+# UNIT TESTS #
+##############
+
+
+def test_signal_before_wait():
+    """
+    A signal that happens before the wait
+    must not be lost.
+    """
+    wakeup = WakeupEvent()
+    wakeup.signal("TEST")
+    assert wakeup.wait(0) == ["TEST"]
+    assert wakeup.wait(0) == []
+
+
+def test_timeout():
+    """
+    Waiting without a signal returns no reasons.
+    """
+    wakeup = WakeupEvent()
+    assert wakeup.wait(0.01) == []
+
+
+if __name__ == '__main__':
+    print "Starting tests."
+
+    test_signal_before_wait()
+    test_timeout()
+
+    print "Tests finished"
@@ -0,0 +1,150 @@
+"""
+Module to notice when the service loop or a recurring
+task has been stuck for too long, and to log what
+every thread was doing at the time.
+"""
+
+import itertools
+import sys
+import threading
+import traceback
+import utilities
+
+DEFAULT_STALL_THRESHOLD = 30  # Seconds
+
+
+class StallWatchdog(object):
+    """
+    Tracks the work that is in progress.
+    A background thread checks how long each piece of
+    work has been running, and when one passes the
+    threshold, logs the stack of every thread once.
+    """
+
+    def begin(self, activity_name):
+        """
+        Marks the start of a piece of work.
+        Returns a token to pass to end().
+        """
+
+        token = next(self.__tokens__)
+        self.__activities__[token] = [activity_name,
+                                      utilities.get_monotonic_time(),
+                                      False]
+
+        return token
+
+    def end(self, token):
+        """
+        Marks the end of a piece of work.
+        """
+
+        activity = self.__activities__.pop(token, None)
+
+        if activity is not None and activity[2] and self.__logger__ is not None:
+            self.__logger__.log_warning_message(
+                "STALL CLEARED: " + activity[0] + " finished after "
+                + str(round(utilities.get_monotonic_time() - activity[1], 1)) + "s")
+
+    def start(self, stall_threshold, logger):
+        """
+        Starts watching. Calling start again only
+        changes the threshold and logger.
+        """
+
+        self.__stall_threshold__ = stall_threshold
+        self.__logger__ = logger
+
+        if self.__thread__ is not None:
+            return
+
+        self.__thread__ = threading.Thread(name="watchdog", target=self.__run__)
+        self.__thread__.daemon = True
+        self.__thread__.start()
+
+    def stop(self):
+        """
+        Stops watching.
+        """
+
+        self.__stopped__.set()
+
+    def get_stall_count(self):
+        """
+        Returns how many stalls have been detected.
+        """
+
+        return self.__stall_count__
+
+    def __init__(self):
+        self.__stall_threshold__ = DEFAULT_STALL_THRESHOLD
+        self.__logger__ = None
+        self.__thread__ = None
+        self.__tokens__ = itertools.count()
+        self.__activities__ = {}
+        self.__stall_count__ = 0
+        self.__stopped__ = threading.Event()
+
+    def __run__(self):
+        """
+        The watchdog thread.
+        """
+
+        while not self.__stopped__.is_set():
+            self.__stopped__.wait(max(1.0, self.__stall_threshold__ / 4.0))
+
+            try:
+                self.__check_for_stalls__()
+            except:
+                pass
+
+    def __check_for_stalls__(self):
+        """
+        Reports any work that has been running
+        for longer than the threshold.
+        """
+
+        current_time = utilities.get_monotonic_time()
+
+        for activity in self.__activities__.values():
+            stall_duration = current_time - activity[1]
+
+            if activity[2] or stall_duration < self.__stall_threshold__:
+                continue
+
+            activity[2] = True
+            self.__stall_count__ += 1
+            self.__log_stall__(activity[0], stall_duration)
+
+    def __log_stall__(self, activity_name, stall_duration):
+        """
+        Logs the stall, and the stack of every thread.
+        """
+
+        if self.__logger__ is None:
+            return
+
+        self.__logger__.log_warning_message(
+            "STALL: " + activity_name + " has been running for "
+            + str(round(stall_duration, 1)) + "s")
+
+        thread_names = {}
+        for thread in threading.enumerate():
+            thread_names[thread.ident] = thread.name
+
+        for thread_id, frame in sys._current_frames().items():
+            self.__logger__.log_warning_message(
+                "STALL: Thread " + thread_names.get(thread_id, str(thread_id))
+                + "\n" + "".join(traceback.format_stack(frame)))
+
+
+__DEFAULT_WATCHDOG__ = StallWatchdog()
+
+
+def get_default_watchdog():
+    """
+    Returns the watchdog shared by the service loop
+    and the recurring tasks.
+    """
+
+    return __DEFAULT_WATCHDOG__
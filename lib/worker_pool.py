@@ -0,0 +1,105 @@
+"""
+Module to run blocking hardware calls on a small,
+bounded set of worker threads so that they overlap
+instead of waiting behind one another.
+"""
+
+import sys
+import threading
+import Queue
+
+DEFAULT_WORKER_COUNT = 4
+DEFAULT_MAXIMUM_PENDING = 32
+
+
+class WorkerPool(object):
+    """
+    A fixed number of worker threads servicing a bounded queue.
+    """
+
+    def submit(self, work_callback):
+        """
+        Queues the callback to be run by a worker.
+        Returns False if the pool is full or stopped,
+        in which case the caller should run the work itself.
+        """
+
+        if self.__is_stopped__:
+            return False
+
+        try:
+            self.__work_queue__.put_nowait(work_callback)
+        except Queue.Full:
+            return False
+
+        return True
+
+    def stop(self, timeout=None):
+        """
+        Stops the workers once they finish what they are doing.
+        Work that has not started is dropped.
+        """
+
+        self.__is_stopped__ = True
+
+        for _ in self.__workers__:
+            try:
+                self.__work_queue__.put_nowait(None)
+            except Queue.Full:
+                pass
+
+        for worker in self.__workers__:
+            worker.join(timeout)
+
+    def get_pending_count(self):
+        """
+        Returns how many callbacks are waiting for a worker.
+        """
+
+        return self.__work_queue__.qsize()
+
+    def get_worker_count(self):
+        """
+        Returns the number of worker threads.
+        """
+
+        return len(self.__workers__)
+
+    def __init__(self,
+                 logger=None,
+                 worker_count=DEFAULT_WORKER_COUNT,
+                 maximum_pending=DEFAULT_MAXIMUM_PENDING,
+                 name="worker"):
+        """
+        Creates the pool and starts the workers.
+        """
+
+        self.__logger__ = logger
+        self.__is_stopped__ = False
+        self.__work_queue__ = Queue.Queue(maximum_pending)
+        self.__workers__ = []
+
+        for worker_index in range(worker_count):
+            worker = threading.Thread(name=name + "_" + str(worker_index),
+                                      target=self.__run_worker__)
+            worker.daemon = True
+            worker.start()
+            self.__workers__.append(worker)
+
+    def __run_worker__(self):
+        """
+        Runs queued work until the pool is stopped.
+        """
+
+        while not self.__is_stopped__:
+            work_callback = self.__work_queue__.get()
+
+            if work_callback is None:
+                break
+
+            try:
+                work_callback()
+            except:
+                if self.__logger__ is not None:
+                    self.__logger__.log_warning_message(
+                        "Exception in worker:" + str(sys.exc_info()[0]))
@@ -3,12 +3,12 @@
 # encoding: UTF-8
 
 import time
-import Queue
-from multiprocessing import Queue as MPQueue
 
 import text
 import lib.utilities as utilities
 from lib.relay import PowerRelay
+from lib.event_bus import EventBus
+from lib.events import HeaterCommandEvent
 
 
 class RelayManager(object):
@@ -22,7 +22,7 @@ class RelayManager(object):
         """
 
         if not self.is_relay_on():
-            self.__heater_queue__.put(text.HEATER_ON_COMMAND)
+            self.__queue_heater_command__(text.HEATER_ON_COMMAND)
             return True
 
         return False
@@ -32,7 +32,7 @@ class RelayManager(object):
         Tells the heater to turn off.
         """
         if self.is_relay_on():
-            self.__heater_queue__.put(text.HEATER_OFF_COMMAND)
+            self.__queue_heater_command__(text.HEATER_OFF_COMMAND)
             return True
 
         return False
@@ -73,6 +73,33 @@ class RelayManager(object):
 
         return time_remaining
 
+    def has_pending_commands(self):
+        """
+        Returns True if there are commands waiting for the relay.
+        """
+
+        return not self.__heater_queue__.empty()
+
+    def get_seconds_until_shutoff(self):
+        """
+        Returns how many seconds until the shutoff timer
+        needs to be serviced, or None if the heater is not timed.
+        """
+
+        if self.__heater_shutoff_timer__ is None:
+            return None
+
+        return max(0, self.__heater_shutoff_timer__ - time.time())
+
+    def shutdown(self):
+        """
+        Forces the heater off, without waiting for the queue.
+        Any queued commands are dropped.
+        """
+
+        self.__heater_queue__.drain()
+        self.__stop_heater__()
+
     def update(self):
         """
         Services the queue from the heater service thread.
@@ -83,30 +110,32 @@ class RelayManager(object):
         # check the queue to deal with various issues,
         # such as Max heater time and the gas sensor being tripped
         while not self.__heater_queue__.empty():
-            try:
-                status_queue = self.__heater_queue__.get()
+            heater_command = self.__heater_queue__.get()
 
-                if text.HEATER_ON_COMMAND in status_queue:
-                    self.__start_heater_immediate__()
+            if heater_command.command == text.HEATER_ON_COMMAND:
+                self.__start_heater_immediate__()
 
-                if text.HEATER_OFF_COMMAND in status_queue:
-                    self.__stop_heater_immediate__()
+            if heater_command.command == text.HEATER_OFF_COMMAND:
+                self.__stop_heater_immediate__()
 
-                if text.MAX_TIME in status_queue:
-                    self.__max_time_immediate__()
-            except Queue.Empty:
-                pass
+            if heater_command.command == text.MAX_TIME:
+                self.__max_time_immediate__()
 
     def __init__(self,
                  configuration,
                  logger,
                  heater_on_callback,
                  heater_off_callback,
-                 heater_max_time_callback):
+                 heater_max_time_callback,
+                 event_bus=None):
         """ Initialize the object. """
 
+        if event_bus is None:
+            event_bus = EventBus()
+
         self.__configuration__ = configuration
         self.__logger__ = logger
+        self.__event_bus__ = event_bus
         self.__on_callback__ = heater_on_callback
         self.__off_callback__ = heater_off_callback
         self.__max_time_callback__ = heater_max_time_callback
@@ -114,7 +143,7 @@ class RelayManager(object):
         # create heater relay instance
         self.__heater_relay__ = PowerRelay(
             "heater_relay", configuration.heater_pin)
-        self.__heater_queue__ = MPQueue()
+        self.__heater_queue__ = event_bus.subscribe(HeaterCommandEvent)
 
         # create queue to hold heater timer.
         self.__heater_shutoff_timer__ = None
@@ -122,6 +151,13 @@ class RelayManager(object):
         # make sure and turn heater off
         self.__heater_relay__.switch_low()
 
+    def __queue_heater_command__(self, command):
+        """
+        Queues a command for the relay.
+        """
+
+        self.__event_bus__.publish(HeaterCommandEvent(command))
+
     def __max_time_immediate__(self):
         """
         Trigger everything associated with the timer
@@ -197,9 +233,9 @@ class RelayManager(object):
 
         if self.__heater_shutoff_timer__ is not None \
                 and self.__heater_shutoff_timer__ < time.time():
-            self.__heater_queue__.put(text.MAX_TIME)
+            self.__queue_heater_command__(text.MAX_TIME)
         elif self.__heater_shutoff_timer__ is None \
                 and self.is_relay_on():
             self.__logger__.log_warning_message(
                 "Heater should not be on, but the PIN is still active... attempting shutdown.")
-            self.__heater_queue__.put(text.HEATER_OFF_COMMAND)
+            self.__queue_heater_command__(text.HEATER_OFF_COMMAND)